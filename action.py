@@ -3,6 +3,7 @@ import time
 import record_emg3 as emg
 import record_fmg as fmg
 import record_cyberglove as glove
+from device_bringup import bring_up_devices
 import tkinter as tk
 from tkinter import simpledialog, messagebox, Toplevel, Label
 from PIL import Image, ImageTk
@@ -13,51 +14,34 @@ from PIL import Image, ImageTk
 emg_recorder = None
 gesture_thread = None
 stop_gesture_event = threading.Event()  
-fmg_initialized = False
 main_loop_flag = True
 participant_num = 1
 action_num = 0
 test_number = 1
 set_action_button = None
-init_condition = threading.Condition()
 popup = None  # Reference to the image popup
 timer_label = None  # Reference to the timer label
 timer_thread = None
 stop_timer_event = threading.Event()
 glove_recorder=None
-
-# starts the Mqtt connection
-def initialize_sys():
-    global fmg_initialized
-
-    with init_condition:
-        if not fmg_initialized:
-            threading.Thread(target=fmg.read_serial, daemon=True).start()
-            init_condition.wait(timeout=2)
-            fmg_initialized = True
-            print("FMG initialization started. Waiting for the first message to confirm initialization.")
+session_devices = {}  # devices that came up in bring_up_devices
 
 # Starts the Measurement and runs it, while main_loop_flag is true
 def action_task(participant_num):
     try:
 
-        global emg_recorder,glove_recorder
-        emg_recorder = emg.EMGRecorder()
-        threading.Thread(target=fmg.start_recording, args=(participant_num, test_number)).start()
-        print(f"FMG recording started for participant {participant_num}.")
-
-        glove_recorder = glove.initialize_cyberglove()
-        glove.start_recording_thread(glove_recorder)
-        print("Cyberglove recording started.")
-
-        emg_recorder.start_recording()
-        emg_recorder.update_participant_action(participant_num, action_num)
-        print("EMG recording started.")
-
-        
+        global emg_recorder,glove_recorder,session_devices
+        # connects FMG, EMG and glove in parallel and waits for the first sample of each
+        session_devices, start_time = bring_up_devices(participant_num, test_number)
+        emg_recorder = session_devices.get('emg')
+        glove_recorder = session_devices.get('glove')
+        print(f"Recording started for participant {participant_num} at {time.strftime('%H:%M:%S', time.localtime(start_time))}.")
+        if not emg_recorder:
+            print("EMG is not recording, the action labels are not stored.")
 
         while main_loop_flag:
-            emg_recorder.update_participant_action(participant_num, action_num)
+            if emg_recorder:
+                emg_recorder.update_participant_action(participant_num, action_num)
             time.sleep(1)
 
     except Exception as e:
@@ -73,9 +57,10 @@ def quit_program():
     main_loop_flag = False
 
     try:
-        fmg.stop_recording()
-        print("FMG recording stopped.")
-        time.sleep(1)
+        if 'fmg' in session_devices:
+            fmg.stop_recording()
+            print("FMG recording stopped.")
+            time.sleep(1)
         if emg_recorder:
             emg_recorder.stop_recording(participant_num, test_number)
             print("EMG recording stopped.")
@@ -202,7 +187,8 @@ def set_action_number():
     try:
         action_number = int(action_entry.get())
         action_num = action_number
-        emg_recorder.update_participant_action(participant_num, action_num)
+        if emg_recorder:
+            emg_recorder.update_participant_action(participant_num, action_num)
         status_label.config(text=f"Action number updated to {action_num}.")
         set_action_button.config(state=tk.DISABLED)
         start_timer()  # Start the timer when action is set
@@ -232,7 +218,8 @@ def set_action_to_zero():
     show_image(0)
     # Reset the action number and update the label
     action_num = 0
-    emg_recorder.update_participant_action(participant_num, action_num)
+    if emg_recorder:
+        emg_recorder.update_participant_action(participant_num, action_num)
     status_label.config(text="Action number set to 0.")
     set_action_button.config(state=tk.NORMAL)
 
@@ -244,9 +231,7 @@ if __name__ == "__main__":
 
     test_number=f'P{participant_num}/{test_number}'
 
-    initialize_sys()  # Initialize FMG and wait for it to be ready
 
-        
     # Initialize Tkinter UI
     root = tk.Tk()
     root.title("EMG Action Control")
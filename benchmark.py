@@ -0,0 +1,407 @@
+import os
+import sys
+import io
+import json
+import time
+import queue
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from types import SimpleNamespace
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# the processing scripts import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_processing', 'scripts'))
+import pytrignos  # noqa: E402
+from ingest import read_recording, cache_path  # noqa: E402
+from emg_data import emg_data_processing_upsampling, emg_data_upsampling  # noqa: E402
+from aux_data import aux_data_processing, aux_data_interpolation  # noqa: E402
+from fmg_data import fmg_data_preparation  # noqa: E402
+from data_integration import integrate_data, save_integrated_data, merge_mat_files  # noqa: E402
+from synthetic_session import write_session, EMG_CHANNELS, EMG_POLL, AUX_RATE, FMG_RATE, FMG_CHANNELS  # noqa: E402
+
+
+# Benchmarks of the acquisition and processing hot paths on synthetic sessions.
+# Every stage runs `repeat` times, the fastest run is reported (wall clock), then once more
+# under tracemalloc for the peak memory (Python and numpy allocations above the memory held
+# before the stage). The inputs are synthetic sessions in the recorder formats (synthetic_session.py),
+# the stages are
+#   read_all_emg        pytrignos: the TCP stream of 16 EMG channels, read poll by poll from a socket pair
+#   read_serial         record_fmg: the serial frames of the FMG bracelet, replayed from memory
+#   emg_upsampling      emg_data_processing_upsampling, raw EMG CSV -> equalized CSV
+#   aux_processing      aux_data_processing, raw AUX CSV -> interpolated CSV
+#   integration         integrate_data, resampling of AUX, FMG and glove onto the EMG grid (merge_asof)
+#   merge_mat_files     merge of MERGE_FILES integrated .mat files
+# The CSV stages read the files without the ingest cache (cold). The results are saved as JSON
+# with the commit, so the runs of two commits can be compared with --compare.
+
+SCALES = {'5min': 300, '30min': 1800, '2h': 7200}
+STAGES = ('read_all_emg', 'read_serial', 'emg_upsampling', 'aux_processing', 'integration', 'merge_mat_files')
+
+EMG_RATE = 2000
+AUX_SENSORS = 6  # sensors with ACC and GYRO data, the other AUX columns are 0.0
+MERGE_FILES = 2
+
+
+def remove_cache(csv_path):
+    # the CSV stages are measured without the ingest cache
+    if os.path.exists(cache_path(csv_path)):
+        os.remove(cache_path(csv_path))
+
+
+class ReplaySerial:
+    """
+    Serial port that returns the given bytes (used in place of serial.Serial by read_serial).
+    Stops the reader of record_fmg when all bytes were read.
+    """
+
+    def __init__(self, data, module):
+        self.buffer = io.BytesIO(data)
+        self.remaining = len(data)
+        self.module = module
+
+    @property
+    def in_waiting(self):
+        return self.remaining
+
+    def read(self, size=1):
+        data = self.buffer.read(size)
+        self.remaining -= len(data)
+        if self.remaining == 0:
+            self.module.stop_fmg = 1
+        return data
+
+
+def fmg_frames(seconds, seed=0):
+    # serial frames of the bracelet: 0xFF, uint64 timestamp, 24 float32, 0x00
+    frame = np.dtype([('start', 'u1'), ('timestamp', '<u8'), ('fsr', '<f4', FMG_CHANNELS), ('end', 'u1')])
+    frames = np.zeros(int(seconds * FMG_RATE), dtype=frame)
+    frames['start'] = 0xFF
+    frames['timestamp'] = np.arange(len(frames)) * (1000 // FMG_RATE)
+    frames['fsr'] = np.random.default_rng(seed).random((len(frames), FMG_CHANNELS)) * 3.3
+    return frames.tobytes(), len(frames)
+
+
+def stage_read_all_emg(session, seconds):
+    # EMG polls of EMG_POLL samples are sent through a socket pair and read with read_all_emg
+    daq = pytrignos._BaseTrignoDaq.__new__(pytrignos._BaseTrignoDaq)
+    daq.total_emg_channels = EMG_CHANNELS
+    daq._min_emg_recv_size = EMG_CHANNELS * daq.BYTES_PER_CHANNEL
+    poll = np.random.default_rng(0).standard_normal((EMG_POLL, EMG_CHANNELS), dtype=np.float32).tobytes()
+    polls = int(seconds * EMG_RATE) // EMG_POLL
+
+    def run():
+        sender, receiver = socket.socketpair()
+        receiver.setblocking(False)
+        daq._emg_data_socket = receiver
+        elapsed = 0.0
+        try:
+            for _ in range(polls):
+                sender.sendall(poll)
+                start = time.perf_counter()
+                daq.read_all_emg()
+                elapsed += time.perf_counter() - start
+        finally:
+            sender.close()
+            receiver.close()
+        # only the reading is timed, not the sending
+        return elapsed
+
+    return run, polls * EMG_POLL
+
+
+def stage_read_serial(session, seconds):
+    try:
+        import record_fmg
+    except ImportError as e:
+        raise RuntimeError(f"record_fmg could not be imported ({e}), install pyserial.")
+    data, frames = fmg_frames(seconds)
+
+    def run():
+        serial_module, message_queue = record_fmg.serial, record_fmg.message_queue
+        record_fmg.serial = SimpleNamespace(Serial=lambda *args, **kwargs: ReplaySerial(data, record_fmg),
+                                            SerialException=serial_module.SerialException)
+        record_fmg.message_queue = queue.Queue()  # unbounded, nobody takes the frames
+        record_fmg.is_recording, record_fmg.stop_fmg, record_fmg.session_start_time = True, 0, None
+        try:
+            record_fmg.read_serial()
+            if record_fmg.message_queue.qsize() != frames:
+                raise RuntimeError(f"read_serial queued {record_fmg.message_queue.qsize()} of {frames} frames.")
+        finally:
+            record_fmg.serial, record_fmg.message_queue = serial_module, message_queue
+            record_fmg.is_recording, record_fmg.stop_fmg = False, 0
+
+    return run, frames
+
+
+def stage_emg_upsampling(session, seconds):
+    input_file = os.path.join(session, 'emg_data_P1.csv')
+    output_file = os.path.join(session, 'emg_data_P1_m.csv')
+
+    def run():
+        remove_cache(input_file)
+        emg_data_processing_upsampling(input_file, output_file)
+
+    return run, int(seconds * EMG_RATE)
+
+
+def stage_aux_processing(session, seconds):
+    input_file = os.path.join(session, 'aux_data_P1.csv')
+    output_file = os.path.join(session, 'aux_data_P1_m.csv')
+
+    def run():
+        remove_cache(input_file)
+        aux_data_processing(input_file, output_file)
+
+    return run, int(seconds * AUX_RATE)
+
+
+def load_session(session):
+    # processed recordings of a session in memory, the input of integrate_data
+    emg_df = emg_data_upsampling(read_recording(os.path.join(session, 'emg_data_P1.csv')))
+    aux_df = aux_data_interpolation(read_recording(os.path.join(session, 'aux_data_P1.csv')))
+    fmg_df = fmg_data_preparation(read_recording(os.path.join(session, 'fmg_data_P1.csv')))
+    glove_df = read_recording(os.path.join(session, 'glove_data_P1.csv'))
+    return emg_df, aux_df, fmg_df, glove_df
+
+
+def stage_integration(session, seconds):
+    recordings = load_session(session)
+
+    def run():
+        integrate_data(*recordings, 1)
+
+    return run, len(recordings[0])
+
+
+def stage_merge_mat_files(session, seconds):
+    # MERGE_FILES copies of the integrated session as output_data/<test>/final_data_P1.mat
+    output_folder = os.path.join(session, 'output_data')
+    first_file = os.path.join(output_folder, '1', 'final_data_P1.mat')
+    if not os.path.exists(first_file):
+        os.makedirs(os.path.dirname(first_file), exist_ok=True)
+        save_integrated_data(integrate_data(*load_session(session), 1), first_file)
+    for test in range(2, MERGE_FILES + 1):
+        mat_file = os.path.join(output_folder, str(test), 'final_data_P1.mat')
+        if not os.path.exists(mat_file):
+            os.makedirs(os.path.dirname(mat_file), exist_ok=True)
+            shutil.copyfile(first_file, mat_file)
+            shutil.copyfile(first_file.replace('.mat', '_segments.csv'), mat_file.replace('.mat', '_segments.csv'))
+    merged_folder = os.path.join(session, 'merged')
+    os.makedirs(merged_folder, exist_ok=True)
+
+    def run():
+        merge_mat_files(output_folder, os.path.join(merged_folder, 'final_data'),
+                        os.path.join(merged_folder, 'interpolated_data'))
+
+    return run, MERGE_FILES * int(seconds * EMG_RATE)
+
+
+STAGE_FUNCTIONS = {
+    'read_all_emg': stage_read_all_emg,
+    'read_serial': stage_read_serial,
+    'emg_upsampling': stage_emg_upsampling,
+    'aux_processing': stage_aux_processing,
+    'integration': stage_integration,
+    'merge_mat_files': stage_merge_mat_files,
+}
+
+
+def measure(run, repeat=3, memory=True):
+    """
+    Runs a stage repeat times and once more under tracemalloc.
+
+    Returns
+    -------
+    times : list of float
+        Seconds of every run (the stage may return its own time, e.g. without the setup of every poll).
+    peak_mb : float or None
+        Peak of the traced memory above the memory held before the run, in MiB.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        elapsed = run()
+        times.append(elapsed if elapsed is not None else time.perf_counter() - start)
+
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            run()
+            peak_mb = (tracemalloc.get_traced_memory()[1] - baseline) / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return times, peak_mb
+
+
+def git_commit():
+    # commit and working tree state of the benchmarked code
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+
+def run_benchmarks(scales, stages, workdir, repeat=3, memory=True):
+    """
+    Runs the stages on the synthetic sessions of the given scales.
+
+    Parameters
+    ----------
+    scales : list of str
+        Keys of SCALES.
+    stages : list of str
+        Names of STAGES.
+    workdir : str
+        Folder of the synthetic sessions (<workdir>/<scale>), existing sessions are reused.
+    repeat : int
+        Timed runs per stage, the fastest one is reported.
+    memory : bool
+        Measure the peak memory (one more run under tracemalloc).
+
+    Returns
+    -------
+    results : list of dict
+        One entry per stage and scale.
+    """
+    results = []
+    for scale in scales:
+        seconds = SCALES[scale]
+        session = os.path.join(workdir, scale)
+        if not os.path.exists(os.path.join(session, 'glove_data_P1.csv')):
+            start = time.perf_counter()
+            write_session(session, 1, seconds, sensors=EMG_CHANNELS, aux_sensors=AUX_SENSORS, emg_rate=EMG_RATE)
+            print(f"Synthetic {scale} session written to {session} in {time.perf_counter() - start:.1f} s.")
+
+        for stage in stages:
+            entry = {'stage': stage, 'scale': scale, 'duration_s': seconds}
+            try:
+                run, samples = STAGE_FUNCTIONS[stage](session, seconds)
+                times, peak_mb = measure(run, repeat, memory)
+            except Exception as e:
+                print(f"{stage} ({scale}) failed: {e}")
+                entry['error'] = str(e)
+                results.append(entry)
+                continue
+            entry.update({
+                'seconds': min(times),
+                'times': times,
+                'peak_mb': peak_mb,
+                'samples': samples,
+                'samples_per_s': samples / min(times) if min(times) > 0 else None,
+            })
+            results.append(entry)
+            memory_text = f", peak {peak_mb:.0f} MiB" if peak_mb is not None else ""
+            print(f"{stage:16s} {scale:>6s}: {min(times):8.3f} s{memory_text}")
+    return results
+
+
+def save_results(results, results_folder, settings):
+    # <results_folder>/<date>_<commit>.json
+    commit, dirty = git_commit()
+    os.makedirs(results_folder, exist_ok=True)
+    created = datetime.now()
+    result_file = os.path.join(results_folder, f"{created.strftime('%Y%m%d_%H%M%S')}_{commit}{'_dirty' if dirty else ''}.json")
+    content = {
+        'commit': commit,
+        'dirty': dirty,
+        'created': created.isoformat(timespec='seconds'),
+        'machine': {
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+        },
+        'settings': settings,
+        'results': results,
+    }
+    with open(result_file, 'w') as file:
+        json.dump(content, file, indent=2)
+    print(f"Results saved to {result_file}.")
+    return result_file
+
+
+def compare_results(base_file, new_file, tolerance=0.1):
+    """
+    Compares the times and peak memory of two result files stage by stage.
+
+    Returns
+    -------
+    regressions : list of str
+        Stages that got slower or use more memory than base * (1 + tolerance).
+    """
+    with open(base_file) as file:
+        base = json.load(file)
+    with open(new_file) as file:
+        new = json.load(file)
+    base_results = {(entry['stage'], entry['scale']): entry for entry in base['results'] if 'seconds' in entry}
+
+    print(f"{base['commit']} -> {new['commit']}")
+    print(f"{'stage':16s} {'scale':>6s} {'base s':>9s} {'new s':>9s} {'ratio':>6s} {'base MiB':>9s} {'new MiB':>9s}")
+    regressions = []
+    for entry in new['results']:
+        key = (entry['stage'], entry['scale'])
+        if 'seconds' not in entry or key not in base_results:
+            continue
+        old = base_results[key]
+        ratio = entry['seconds'] / old['seconds'] if old['seconds'] > 0 else float('nan')
+        flags = []
+        if ratio > 1 + tolerance:
+            flags.append('slower')
+        if old.get('peak_mb') and entry.get('peak_mb') and entry['peak_mb'] > old['peak_mb'] * (1 + tolerance):
+            flags.append('more memory')
+        if flags:
+            regressions.append(f"{entry['stage']} ({entry['scale']}): {', '.join(flags)}")
+
+        def mib(value):
+            return f"{value:9.0f}" if value is not None else f"{'-':>9s}"
+        print(f"{entry['stage']:16s} {entry['scale']:>6s} {old['seconds']:9.3f} {entry['seconds']:9.3f} {ratio:6.2f} "
+              f"{mib(old.get('peak_mb'))} {mib(entry.get('peak_mb'))}  {' '.join(flags)}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the acquisition and processing hot paths.")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=list(SCALES), help="Session durations.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to run.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage (the fastest is reported).")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the peak memory run.")
+    parser.add_argument("--workdir", default=None,
+                        help="Folder for the synthetic sessions, kept and reused (default: temporary folder).")
+    parser.add_argument("--results", default="benchmark_results", help="Folder of the result files.")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Compare two result files instead.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown for --compare (0.1 = 10 %%).")
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare_results(*args.compare, tolerance=args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        sys.exit(0)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        results = run_benchmarks(args.scales, args.stages, workdir, args.repeat, not args.no_memory)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    save_results(results, args.results, {
+        'scales': args.scales, 'repeat': args.repeat, 'emg_rate': EMG_RATE, 'emg_channels': EMG_CHANNELS,
+        'aux_sensors': AUX_SENSORS, 'merge_files': MERGE_FILES,
+    })
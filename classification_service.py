@@ -0,0 +1,326 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import threading
+from collections import Counter, deque
+import numpy as np
+import yaml
+
+# the feature engine of the offline processing, so the live features are the same as in training
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_processing', 'scripts'))
+from features import window_features, load_model  # noqa: E402
+
+# Default Trigno sampling rates, used if the channel layout could not be discovered
+DEFAULT_EMG_RATE = 1925.925
+DEFAULT_AUX_RATE = 148.148
+
+# modalities of the model that the recorder streams live (FMG and glove are not)
+LIVE_MODALITIES = ('emg', 'acc', 'gyro')
+
+
+# Online gesture classification. The service is registered as listener of an EMGRecorder
+# and copies every poll into ring buffers of one window. As soon as a full stride of new
+# samples arrived, a worker thread computes the features of the latest window (same feature
+# engine and parameters as the trained model), predicts the gesture and decides on a change
+# of state by majority vote over the last class_count predictions. The latency of every
+# decision (poll of the last sample of the stride -> decision) is logged.
+#
+# Window and stride are those of the model (samples of the integrated data, i.e. the EMG
+# grid). The training sees the AUX data held onto the EMG timestamps (zoh), so the live AUX
+# features are computed over the same time span after holding the latest AUX samples onto
+# the window_size EMG sample times.
+
+
+class RingBuffer:
+    """
+    Holds the last `capacity` samples of a (samples, channels) stream.
+    """
+
+    def __init__(self, capacity, channels):
+        self.data = np.zeros((capacity, channels), dtype=np.float64)
+        self.capacity = capacity
+        self.total = 0  # samples written since the start
+
+    def extend(self, block):
+        # block: (channels, samples) as delivered by the Trigno
+        block = np.asarray(block, dtype=np.float64).T
+        count = len(block)
+        block = block[-self.capacity:]
+        position = (self.total + count - len(block)) % self.capacity
+        first = min(len(block), self.capacity - position)
+        self.data[position:position + first] = block[:first]
+        self.data[:len(block) - first] = block[first:]
+        self.total += count
+
+    def latest(self, count):
+        # last count samples in time order (a copy)
+        position = self.total % self.capacity
+        return np.roll(self.data, -position, axis=0)[self.capacity - count:]
+
+
+def hold_onto_grid(values, count, source_rate, target_rate):
+    """
+    Holds the samples of a slower stream (samples, channels) onto the last `count` sample times of
+    a stream with target_rate (zero-order hold, as the integration does). The last samples of
+    both streams are taken as simultaneous.
+    """
+    # samples of the slow stream back from its latest one, for every target sample time
+    back = np.ceil(np.arange(count - 1, -1, -1) * source_rate / target_rate - 1e-9).astype(np.int64)
+    return values[len(values) - 1 - back]
+
+
+class GestureClassificationService:
+    """
+    Live gesture classification from the EMG and AUX data of an EMGRecorder.
+
+    Parameters
+    ----------
+    model_file : str
+        Model artifact written by the training (features.save_model).
+    config_path : str
+        Sensor config with use_emg/use_aux and class_count, window and stride are taken from the model.
+    channel_layout : dict, optional
+        Channel layout of the recorder, selects the ACC and GYRO channels of the AUX data.
+        Without one the AUX channels are taken as groups of 6 (acc x/y/z, gyro x/y/z).
+    on_change : callable, optional
+        Called with the new gesture label whenever the voted state changes.
+    """
+
+    def __init__(self, model_file, config_path="config.yaml", channel_layout=None, on_change=None):
+        with open(config_path, "r") as file:
+            self.config = yaml.load(file, Loader=yaml.FullLoader)
+        self.artifact = load_model(model_file)
+        self.model = self.artifact['model']
+        self.modalities = self.artifact['modalities']
+        missing = [key for key in self.modalities if key not in LIVE_MODALITIES]
+        if missing:
+            raise ValueError(f"Modalities {missing} of the model are not available live, only {list(LIVE_MODALITIES)}.")
+        self.feature_params = self.artifact['feature_params']
+        self.on_change = on_change
+
+        self.use_emg = self.config.get('use_emg', True) and 'emg' in self.modalities
+        self.use_aux = self.config.get('use_aux', True) and ('acc' in self.modalities or 'gyro' in self.modalities)
+        if not (self.use_emg or self.use_aux):
+            raise ValueError("The model uses neither EMG nor AUX features enabled by use_emg / use_aux.")
+        # samples of the EMG grid of the training
+        self.emg_window = int(self.artifact['window_size'])
+        self.emg_stride = int(self.artifact['stride'])
+        self.class_count = int(self.config.get('class_count', 1))
+
+        self.set_channel_layout(channel_layout)
+
+        self.emg_buffer = None
+        self.aux_buffer = None
+        self.aux_columns = None
+        self.next_decision = None
+        self.lock = threading.Lock()
+        self.pending = threading.Condition(self.lock)
+        self.pending_time = None  # receive time of the poll that completed the latest stride
+        self.skipped = 0  # strides that were not classified (worker still busy or several strides in one poll)
+        self.stop_event = threading.Event()
+        self.worker = None
+        self.error = None  # exception that stopped the worker
+
+        self.votes = deque(maxlen=self.class_count)
+        self.state = None
+        self.log = []  # (receive time, decision time, latency in ms, prediction, state)
+
+    def set_channel_layout(self, channel_layout):
+        self.channel_layout = channel_layout
+        emg_rate = channel_layout['emg'][0]['rate'] if channel_layout and channel_layout['emg'] else DEFAULT_EMG_RATE
+        aux_rate = channel_layout['aux'][0]['rate'] if channel_layout and channel_layout['aux'] else DEFAULT_AUX_RATE
+        self.emg_rate, self.aux_rate = emg_rate, aux_rate
+        # AUX samples that cover the time span of one window and one stride of the EMG grid
+        self.aux_window = int(np.ceil((self.emg_window - 1) * aux_rate / emg_rate - 1e-9)) + 1
+        self.aux_stride = max(int(round(self.emg_stride * aux_rate / emg_rate)), 1)
+        # a decision is due after every stride of the stream that drives the decisions
+        self.stride_duration = self.emg_stride / emg_rate
+
+    def aux_channels(self, channels):
+        # indices of the ACC and GYRO rows of the AUX data
+        if self.channel_layout:
+            kinds = [channel['kind'] for channel in self.channel_layout['aux']]
+            return {kind: [i for i, k in enumerate(kinds) if k == kind] for kind in ('acc', 'gyro')}
+        return {
+            'acc': [i for start in range(0, channels, 6) for i in range(start, min(start + 3, channels))],
+            'gyro': [i for start in range(0, channels, 6) for i in range(start + 3, min(start + 6, channels))],
+        }
+
+    def attach(self, recorder):
+        """
+        Registers the service as listener of an EMGRecorder and starts the worker thread.
+        """
+        if self.channel_layout is None:
+            self.set_channel_layout(recorder.channel_layout)
+        recorder.add_listener(self.on_data)
+        self.start()
+
+    def start(self):
+        self.stop_event.clear()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        with self.pending:
+            self.stop_event.set()
+            self.pending.notify()
+        if self.worker is not None:
+            self.worker.join()
+
+    def on_data(self, emg_data, aux_data, receive_time):
+        """
+        Listener of the recorder: copies the new samples into the ring buffers and wakes the worker
+        when a full stride of new samples arrived. Runs in the recording thread, so it only copies.
+        """
+        with self.pending:
+            if self.use_emg and emg_data.size > 0:
+                if self.emg_buffer is None:
+                    self.emg_buffer = RingBuffer(self.emg_window, emg_data.shape[0])
+                self.emg_buffer.extend(emg_data)
+            if self.use_aux and aux_data.size > 0:
+                if self.aux_buffer is None:
+                    self.aux_buffer = RingBuffer(self.aux_window, aux_data.shape[0])
+                    self.aux_columns = self.aux_channels(aux_data.shape[0])
+                self.aux_buffer.extend(aux_data)
+
+            if not self.windows_full():
+                return
+            driver, stride = (self.emg_buffer, self.emg_stride) if self.use_emg else (self.aux_buffer, self.aux_stride)
+            if self.next_decision is None:
+                self.next_decision = driver.total
+            if driver.total >= self.next_decision:
+                # only the latest window is classified, older strides that were not taken yet are skipped
+                missed = (driver.total - self.next_decision) // stride
+                self.next_decision += (missed + 1) * stride
+                if self.pending_time is not None:
+                    self.skipped += 1
+                self.skipped += missed
+                self.pending_time = receive_time
+                self.pending.notify()
+
+    def windows_full(self):
+        emg_full = not self.use_emg or (self.emg_buffer is not None and self.emg_buffer.total >= self.emg_window)
+        aux_full = not self.use_aux or (self.aux_buffer is not None and self.aux_buffer.total >= self.aux_window)
+        return emg_full and aux_full
+
+    def current_features(self):
+        # features of the latest windows, in the order of the model (called with the lock held)
+        features = []
+        for key, feature_set in self.modalities.items():
+            if key == 'emg':
+                values, window = self.emg_buffer.latest(self.emg_window), self.emg_window
+            elif key in ('acc', 'gyro'):
+                values = hold_onto_grid(self.aux_buffer.latest(self.aux_window)[:, self.aux_columns[key]],
+                                        self.emg_window, self.aux_rate, self.emg_rate)
+                window = self.emg_window
+            else:
+                raise ValueError(f"Modality '{key}' of the model is not available live.")
+            features.append((values, window, key, feature_set))
+        return features
+
+    def classify(self, windows):
+        columns = []
+        for values, window, key, feature_set in windows:
+            feature, _ = window_features(values, [0], window, feature_set,
+                                         self.feature_params.get('zc_threshold', 0.0),
+                                         self.feature_params.get('ssc_threshold', 0.0),
+                                         self.feature_params.get('hist_bins', 9),
+                                         self.artifact['hist_ranges'].get(key))
+            columns.append(feature)
+        features = np.concatenate(columns, axis=1)
+        if features.shape[1] != len(self.artifact['names']):
+            raise ValueError(f"{features.shape[1]} live features, the model expects {len(self.artifact['names'])}. "
+                             "Check the sensors and use_emg / use_aux.")
+        return int(self.model.predict(features)[0])
+
+    def vote(self, prediction):
+        # the state changes when the majority of the last class_count predictions differs from it
+        self.votes.append(prediction)
+        if len(self.votes) < self.class_count:
+            return self.state
+        label, count = Counter(self.votes).most_common(1)[0]
+        if count * 2 > self.class_count and label != self.state:
+            self.state = label
+            if self.on_change:
+                self.on_change(label)
+        return self.state
+
+    def run(self):
+        """
+        Worker thread: classifies the latest window after every stride.
+        """
+        while True:
+            try:
+                with self.pending:
+                    while self.pending_time is None and not self.stop_event.is_set():
+                        self.pending.wait()
+                    if self.stop_event.is_set():
+                        return
+                    receive_time = self.pending_time
+                    self.pending_time = None
+                    windows = self.current_features()
+
+                prediction = self.classify(windows)
+                state = self.vote(prediction)
+            except Exception as e:
+                # no further decisions, the recorder keeps recording
+                self.error = e
+                self.stop_event.set()
+                print(f"Error in gesture classification, classification stopped: {str(e)}")
+                return
+            decision_time = time.time()
+            latency = (decision_time - receive_time) * 1000
+            self.log.append((receive_time, decision_time, latency, prediction, state))
+            if latency > self.stride_duration * 1000:
+                print(f"Warning: decision took {latency:.1f} ms, longer than one stride ({self.stride_duration * 1000:.1f} ms).")
+
+    def latency_summary(self):
+        """
+        Median, 95th percentile and maximum decision latency in ms and the number of skipped strides.
+        """
+        latencies = np.array([entry[2] for entry in self.log])
+        if len(latencies) == 0:
+            return {'decisions': 0, 'skipped': self.skipped}
+        return {
+            'decisions': len(latencies),
+            'skipped': self.skipped,
+            'median_ms': float(np.median(latencies)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'max_ms': float(latencies.max()),
+            'stride_ms': self.stride_duration * 1000,
+        }
+
+    def save_log(self, log_file):
+        with open(log_file, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(['receive_time', 'decision_time', 'latency_ms', 'prediction', 'state'])
+            writer.writerows(self.log)
+        print(f"Decision log saved to {log_file}.")
+
+
+if __name__ == "__main__":
+    import record_emg3 as emg
+
+    parser = argparse.ArgumentParser(description="Classify the gestures live from the EMG and AUX data.")
+    parser.add_argument("model", help="Model artifact of the training.")
+    parser.add_argument("--config", default="config.yaml", help="Path to the sensor config file.")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run.")
+    parser.add_argument("--log", default="classification_log.csv", help="CSV file for the decision latencies.")
+    args = parser.parse_args()
+
+    recorder = emg.EMGRecorder(args.config)
+    service = GestureClassificationService(args.model, args.config,
+                                           on_change=lambda label: print(f"Gesture: {label}"))
+    service.attach(recorder)
+    recorder.start_recording()
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        print("Classification manually stopped.")
+    finally:
+        recorder.stop_event.set()
+        service.stop()
+        service.save_log(args.log)
+        print(service.latency_summary())
@@ -1,57 +1,65 @@
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from ingest import read_recording, save_processed_csv
 
-import pandas as pd
-from datetime import datetime, timedelta
 
-def  aux_data_processing(input_file_path, output_file_path):
-    # Schritt 1: CSV-Datei laden
-    data = pd.read_csv(input_file_path)
+def interpolate_clusters(timestamps_us):
+    """
+    Interpoliert die Zeitstempel innerhalb von Clustern gleicher Zeitstempel (int64 Mikrosekunden).
 
-    # Schritt 2: Zeitstempel in datetime-Objekte konvertieren
-    data['Timestamp'] = pd.to_datetime(data['Timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
+    Der letzte Wert jedes Clusters bleibt fest, die übrigen Werte werden gleichmäßig zwischen
+    dem letzten Wert des vorherigen Clusters und dem letzten Wert des Clusters verteilt.
+    Das erste Cluster bleibt unverändert. Gerundet wird wie bei timedelta(seconds=...).
+    """
+    timestamps_us = np.asarray(timestamps_us, dtype=np.int64)
+    n = len(timestamps_us)
+    if n == 0:
+        return timestamps_us.copy()
+
+    # Start und Länge jedes Clusters
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(timestamps_us)) + 1))
+    lengths = np.diff(np.append(starts, n))
 
-    # Schritt 3: Cluster identifizieren
-    clusters = []
-    current_cluster = [0]  # Startet mit dem Index des ersten Eintrags
+    # Gesamtzeitintervall zum letzten Wert des vorherigen Clusters, geteilt durch die Clusterlänge
+    start_time = np.repeat(np.append(timestamps_us[0], timestamps_us[starts[:-1]]), lengths)
+    end_time = np.repeat(timestamps_us[starts], lengths)
+    interval = (end_time - start_time) / 1e6 / np.repeat(lengths, lengths)
 
-    for i in range(1, len(data)):
-        if data['Timestamp'][i] == data['Timestamp'][i - 1]:
-            current_cluster.append(i)
-        else:
-            clusters.append(current_cluster)
-            current_cluster = [i]
-    clusters.append(current_cluster)  # Letztes Cluster hinzufügen
+    # Position im Cluster, der letzte Wert jedes Clusters und das erste Cluster bleiben fest
+    position = np.arange(n) - np.repeat(starts, lengths)
+    fixed = (position == np.repeat(lengths, lengths) - 1) | (np.arange(n) < lengths[0])
 
-    # Schritt 4: Rückwärts durch die Cluster iterieren und interpolieren
-    for i in range(len(clusters) - 1, 0, -1):
-        current_cluster = clusters[i]
-        previous_cluster = clusters[i - 1]
+    # Sekunden -> Mikrosekunden wie timedelta(seconds=...): ganze Sekunden plus gerundeter Bruchteil
+    offset = interval * (position + 1)
+    fraction, whole = np.modf(offset)
+    offset_us = whole.astype(np.int64) * 1000000 + np.rint(fraction * 1e6).astype(np.int64)
 
-        # Letzter Wert des aktuellen und vorherigen Clusters
-        end_time = data['Timestamp'][current_cluster[-1]]
-        start_time = data['Timestamp'][previous_cluster[-1]]
+    return np.where(fixed, timestamps_us, start_time + offset_us)
 
-        # Gesamtzeitintervall zwischen den letzten Werten der Cluster
-        total_interval = (end_time - start_time).total_seconds()
 
-        # Anzahl der zu interpolierenden Werte im aktuellen Cluster (ohne den letzten Wert)
-        num_values_to_interpolate = len(current_cluster) - 1
+def aux_data_interpolation(data):
+    # In-memory Schritt: rohe AUX-Daten -> DataFrame mit interpolierten Zeitstempeln (datetime64)
+    data = data.copy()
+
+    # Zeitstempel in datetime-Objekte konvertieren
+    data['Timestamp'] = pd.to_datetime(data['Timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
+
+    # Cluster identifizieren (Run-Length-Encoding der int64 Zeitstempel) und interpolieren
+    timestamps = data['Timestamp'].to_numpy(dtype='datetime64[us]').astype(np.int64)
+    timestamps = interpolate_clusters(timestamps)
+    data['Timestamp'] = timestamps.astype('datetime64[us]').astype('datetime64[ns]')
+    return data
 
-        if num_values_to_interpolate > 0:
-            # Zeitintervall für die Interpolation
-            interval = total_interval / (num_values_to_interpolate + 1)
 
-            # Interpolierte Zeitstempel berechnen
-            for j in range(num_values_to_interpolate):
-                interpolated_time = start_time + timedelta(seconds=interval * (j + 1))
-                data.at[current_cluster[j], 'Timestamp'] = interpolated_time
+def  aux_data_processing(input_file_path, output_file_path):
+    # Schritt 1: CSV-Datei laden
+    data = read_recording(input_file_path)
 
-    # Schritt 5: Zeitstempel zurück in das gewünschte Format konvertieren
-    data['Timestamp'] = data['Timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+    # Schritt 2-4: Zeitstempel interpolieren
+    data = aux_data_interpolation(data)
 
-    # Schritt 6: Modifizierte Daten in eine neue CSV-Datei speichern
-    data.to_csv(output_file_path, index=False)
+    # Schritt 5: Modifizierte Daten in eine neue CSV-Datei speichern
+    save_processed_csv(data, output_file_path)
 
     print(f"Die Zeitstempel wurden interpoliert und die Datei wurde gespeichert: {output_file_path}")
 
@@ -0,0 +1,128 @@
+import os
+import ast
+import json
+import hashlib
+
+
+# Incremental build: every output gets a small manifest file next to it
+# (<output>.manifest.json) with the hashes of its input files, the processing
+# parameters and the version of the processing code. An output is only rebuilt
+# if one of them changed.
+
+# main.py (with the in-memory path) and its processing stages, they and all local modules they import change the content of the outputs
+PIPELINE_ENTRY_MODULES = ['main.py', 'emg_data.py', 'aux_data.py', 'fmg_data.py', 'data_integration.py', 'build_manifest.py']
+
+
+def local_imports(module_file):
+    # modules of this folder imported by a module (import x / from x import y)
+    with open(module_file, 'r', encoding='utf-8') as file:
+        tree = ast.parse(file.read(), module_file)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+    folder = os.path.dirname(module_file)
+    return sorted(f'{name}.py' for name in names if os.path.isfile(os.path.join(folder, f'{name}.py')))
+
+
+def pipeline_modules(entry_modules=PIPELINE_ENTRY_MODULES):
+    # the entry modules and everything they import from this folder, so a new module cannot be forgotten
+    folder = os.path.dirname(os.path.abspath(__file__))
+    modules = []
+    pending = list(entry_modules)
+    while pending:
+        module = pending.pop(0)
+        if module in modules:
+            continue
+        modules.append(module)
+        pending += local_imports(os.path.join(folder, module))
+    return modules
+
+
+PIPELINE_MODULES = pipeline_modules()
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    # sha256 of the file content, read in chunks
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def code_version(modules=PIPELINE_MODULES):
+    # one hash over the source code of all pipeline modules
+    sha = hashlib.sha256()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for module in modules:
+        sha.update(module.encode())
+        sha.update(file_hash(os.path.join(folder, module)).encode())
+    return sha.hexdigest()
+
+
+def manifest_path(output_file):
+    return output_file + '.manifest.json'
+
+
+def load_manifest(output_file):
+    try:
+        with open(manifest_path(output_file), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def describe_inputs(input_files, previous=None):
+    """
+    Returns {path: {'size', 'mtime', 'sha256'}} for all existing input files.
+    The hash of a file whose size and mtime did not change is taken from the previous
+    manifest, so unchanged inputs are not read again.
+    """
+    previous = previous or {}
+    inputs = {}
+    for input_file in input_files:
+        if not os.path.exists(input_file):
+            continue
+        stat = os.stat(input_file)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        old = previous.get(input_file)
+        if old and old.get('size') == entry['size'] and old.get('mtime') == entry['mtime']:
+            entry['sha256'] = old['sha256']
+        else:
+            entry['sha256'] = file_hash(input_file)
+        inputs[input_file] = entry
+    return inputs
+
+
+def is_up_to_date(output_file, input_files, params):
+    """
+    True if the output exists and was built from the same input contents, parameters
+    and code version as recorded in its manifest.
+    """
+    manifest = load_manifest(output_file)
+    if manifest is None or not all(os.path.exists(f) for f in manifest.get('outputs', [output_file])):
+        return False
+    if manifest.get('params') != params or manifest.get('code_version') != code_version():
+        return False
+
+    recorded = manifest.get('inputs', {})
+    current = describe_inputs(input_files, recorded)
+    if set(current) != set(recorded):
+        return False
+    return all(current[path]['sha256'] == recorded[path]['sha256'] for path in current)
+
+
+def write_manifest(output_file, input_files, params, outputs=None):
+    # Records the state after a successful build, outputs lists the files written by the build (default: output_file)
+    previous = load_manifest(output_file) or {}
+    manifest = {
+        'outputs': outputs or [output_file],
+        'inputs': describe_inputs(input_files, previous.get('inputs')),
+        'params': params,
+        'code_version': code_version(),
+    }
+    with open(manifest_path(output_file), 'w') as file:
+        json.dump(manifest, file, indent=2)
@@ -1,26 +1,39 @@
+import os
 import re
-
-def clean(input_datei):
-
-
-
-
-        # Open the file in read mode and read all lines
-        with open(input_datei, mode='r', encoding='utf-8') as infile:
-            lines = infile.readlines()
-
-        # Function to replace commas with periods only in numeric values
-        def replace_commas_in_numbers(line):
-            # Regex to find numeric values with commas as decimal separator
-            return re.sub(r'(\d),(\d)', r'\1.\2', line)
-
-        # Replace commas with periods in each line
-        lines_ersetzt = [replace_commas_in_numbers(line) for line in lines]
-
-        # Overwrite the same file with the modified content
-        with open(input_datei, mode='w', encoding='utf-8') as outfile:
-            outfile.writelines(lines_ersetzt)
-
-        print(f"The file '{input_datei}' has been successfully updated.")
-
-
+import shutil
+import tempfile
+
+# Regex to find numeric values with commas as decimal separator (on bytes, so no decoding is needed)
+DECIMAL_COMMA = re.compile(rb'(\d),(\d)')
+
+
+def clean(input_datei, output_datei=None, chunk_size=1 << 20):
+    """
+    Replaces the decimal commas of a CSV file with periods ('1,5' -> '1.5').
+
+    The file is streamed in chunks of complete lines, so the memory does not grow with the
+    file size. The result is written to a temporary file in the same folder that replaces
+    the output (default: the input file itself) in one atomic rename, an interrupted run
+    leaves the original file untouched.
+    """
+    output_datei = output_datei or input_datei
+    output_dir = os.path.dirname(os.path.abspath(output_datei))
+    handle, temp_datei = tempfile.mkstemp(dir=output_dir, suffix='.tmp')
+    try:
+        with open(input_datei, mode='rb') as infile, os.fdopen(handle, mode='wb') as outfile:
+            rest = b''
+            for chunk in iter(lambda: infile.read(chunk_size), b''):
+                # only complete lines are replaced, the incomplete last line goes into the next chunk
+                chunk = rest + chunk
+                end = chunk.rfind(b'\n') + 1
+                rest = chunk[end:]
+                outfile.write(DECIMAL_COMMA.sub(rb'\1.\2', chunk[:end]))
+            outfile.write(DECIMAL_COMMA.sub(rb'\1.\2', rest))
+        shutil.copymode(input_datei, temp_datei)
+        os.replace(temp_datei, output_datei)
+    except BaseException:
+        if os.path.exists(temp_datei):
+            os.remove(temp_datei)
+        raise
+
+    print(f"The file '{output_datei}' has been successfully updated.")
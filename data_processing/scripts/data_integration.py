@@ -1,172 +1,204 @@
 import pandas as pd
 import os
 import numpy as np
-from scipy.io import savemat,loadmat
+from scipy.io import savemat,loadmat,whosmat
 from datetime import datetime
+import yaml
+from ingest import read_recording, select_time_range
+from resampling import target_grid, resample_frame
+from mat73 import Mat73Writer, save_mat73, load_mat73, is_mat73
+from segments import write_segment_index
 
-def data_integration_processing_interpolate(
-        global_emg_file_path, 
-        global_aux_file_path, 
-        global_fmg_file_path, 
-        glove_file_path, 
-        output_file_path,
-        sensor_list,
-        repetition_value,
-        excluded_sensor='S8'
-        ):
-    
-    # Load CSV files with parsed timestamps
 
-    emg_df = pd.read_csv(global_emg_file_path, dtype={'Timestamp': 'object'})
+def load_channel_map(channel_map_file):
+    """
+    Loads the channel map written by the EMG recorder (channel_map_P{n}.yaml).
+    Returns None if there is no channel map for the recording.
+    """
+    if channel_map_file is None or not os.path.exists(channel_map_file):
+        return None
+    with open(channel_map_file, "r") as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
 
-    # Convert 'Timestamp' column to datetime with microsecond precision
-    emg_df['Timestamp'] = pd.to_datetime(emg_df['Timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
-   
-    # Load other datasets
-    aux_df = pd.read_csv(global_aux_file_path, dtype={'Timestamp': 'object'})
-    aux_df ['Timestamp'] = pd.to_datetime(aux_df['Timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
 
-    fmg_df = pd.read_csv(global_fmg_file_path, parse_dates=['Timestamp'])
-    glove_df = pd.read_csv(glove_file_path, parse_dates=['Timestamp'])
+def extract_sensor_arrays(integrated_df, channel_map=None):
+    """
+    Extracts the EMG, ACC and GYRO arrays from the integrated DataFrame.
 
+    With a channel map the columns are selected by their buffer position and kept in the
+    order of the map. Without one the old fixed layout is assumed: AUX in groups of 6
+    (acc, gyro) and a Quattro sensor in the first 4 EMG slots that is moved to the end.
+    """
+    if channel_map:
+        def columns(prefix, channels, kind):
+            return [f"{prefix}{channel['column']}" for channel in channels if channel['kind'] == kind]
 
-    	
-    emg_df = resolve_duplicates(emg_df, column='Timestamp')
-    aux_df = resolve_duplicates(aux_df, column='Timestamp')
-    fmg_df = resolve_duplicates(fmg_df, column='Timestamp')
+        emg_data = integrated_df[columns('EMG', channel_map['emg'], 'emg')].to_numpy(dtype=np.float32)
+        acc_data = integrated_df[columns('AUX', channel_map['aux'], 'acc')].to_numpy(dtype=np.float32)
+        gyro_data = integrated_df[columns('AUX', channel_map['aux'], 'gyro')].to_numpy(dtype=np.float32)
+        return emg_data, acc_data, gyro_data
 
+    emg_data = integrated_df.filter(regex='EMG\d+', axis=1).to_numpy(dtype=np.float32)
+    aux_data = integrated_df.filter(regex='AUX\d+', axis=1).to_numpy(dtype=np.float32)
 
-    # Determine the common time range across all datasets (use the EMG range here)
-    start_time = emg_df['Timestamp'].min()
-    end_time = emg_df['Timestamp'].max()
+    # Split AUX into ACC and GYRO (assuming groups of 6 columns)
+    acc_data = np.hstack([aux_data[:, i:i+3] for i in range(0, aux_data.shape[1], 6)])
+    gyro_data = np.hstack([aux_data[:, i+3:i+6] for i in range(0, aux_data.shape[1], 6)])
 
-    # Filter the other datasets to the same time range as the EMG data
-    aux_df = aux_df[(aux_df['Timestamp'] >= start_time) & (aux_df['Timestamp'] <= end_time)]
-    fmg_df = fmg_df[(fmg_df['Timestamp'] >= start_time) & (fmg_df['Timestamp'] <= end_time)]
-    glove_df = glove_df[(glove_df['Timestamp'] >= start_time) & (glove_df['Timestamp'] <= end_time)]
+    # Move first few columns to the end for correct alignment
+    emg_data = np.hstack([emg_data[:, 4:], emg_data[:, :4]])
+    gyro_data = np.hstack([gyro_data[:, 3:], gyro_data[:, :3]])
+    acc_data = np.hstack([acc_data[:, 3:], acc_data[:, :3]])
+    return emg_data, acc_data, gyro_data
 
-    # Interpolate AUX data to match EMG timestamps
-    aux_df = aux_df.set_index('Timestamp').reindex(emg_df['Timestamp']).interpolate(method='linear').bfill()
-    aux_df = aux_df.reset_index().rename(columns={'index': 'Timestamp'})
 
-    # Interpolate glove data to match EMG timestamps
-    glove_df = glove_df.set_index('Timestamp').reindex(emg_df['Timestamp']).interpolate(method='linear').bfill()
-    glove_df = glove_df.reset_index().rename(columns={'index': 'Timestamp'})
+RECORDINGS = ('emg', 'aux', 'fmg', 'glove')
 
-    # Interpolate FMG data to match EMG timestamps
-    fmg_df = fmg_df.set_index('Timestamp').reindex(emg_df['Timestamp']).interpolate(method='linear').bfill()
-    fmg_df = fmg_df.reset_index().rename(columns={'index': 'Timestamp'})
 
-    emg_df['Timestamp_numeric'] = (emg_df['Timestamp'] - start_time).dt.total_seconds()
-    aux_df['Timestamp_numeric'] = (aux_df['Timestamp'] - start_time).dt.total_seconds()
-    fmg_df['Timestamp_numeric'] = (fmg_df['Timestamp'] - start_time).dt.total_seconds()
-    glove_df['Timestamp_numeric'] = (glove_df['Timestamp'] - start_time).dt.total_seconds()
-    
-    # Merge all datasets with EMG data using EMG timestamps as the main reference
-    integrated_df = pd.merge_asof(emg_df.sort_values('Timestamp'), aux_df.sort_values('Timestamp'), on='Timestamp', suffixes=('', '_aux'))
-    integrated_df = pd.merge_asof(integrated_df, fmg_df.sort_values('Timestamp'), on='Timestamp', suffixes=('', '_fmg'))
-    integrated_df = pd.merge_asof(integrated_df, glove_df.sort_values('Timestamp'), on='Timestamp', suffixes=('', '_glove'))
-
-    # Rename columns to clarify data sources
-    new_columns = {}
-    for col in integrated_df.columns:
-        if col.endswith('_aux'):
-            new_columns[col] = f"Aux_{col[:-4]}"
-        elif col.endswith('_fmg'):
-            new_columns[col] = f"Fmg_{col[:-4]}"
-    integrated_df.rename(columns=new_columns, inplace=True)
+def select_sensors(channel_map, sensors):
+    """
+    Keeps only the channels of the given sensor labels in a channel map.
+    """
+    if channel_map is None or sensors is None:
+        return channel_map
+    return dict(channel_map, **{
+        kind: [channel for channel in channel_map[kind] if channel['sensor'] in sensors] for kind in ('emg', 'aux')
+    })
 
-    # Drop rows with missing FMG data
-    integrated_df = integrated_df.dropna(subset=[col for col in integrated_df.columns if col.startswith('Fmg_')])
 
-    # Rearrange columns if necessary
-    cols_to_move = ['Action_Label'] if 'Action_Label' in integrated_df.columns else []
-    cols = [col for col in integrated_df.columns if col not in cols_to_move] + cols_to_move
-    integrated_df = integrated_df[cols]
+def selected_columns(channel_map=None, channels=None):
+    """
+    Returns the CSV columns of every recording that are needed for the integration
+    (None: all columns). The EMG and AUX columns come from the channel map, channels
+    ({'emg'|'aux'|'fmg'|'glove': [columns]}) selects columns explicitly.
+    """
+    columns = dict.fromkeys(RECORDINGS)
+    if channel_map:
+        for kind in ('emg', 'aux'):
+            columns[kind] = [str(channel['column']) for channel in channel_map[kind]]
+    for kind, selected in (channels or {}).items():
+        columns[kind] = [str(col) for col in selected]
+
+    for kind in RECORDINGS:
+        if columns[kind] is not None:
+            columns[kind] = ['Timestamp'] + columns[kind] + (['Action_Label'] if kind == 'emg' else [])
+    return columns
+
+
+def absolute_time_range(time_range, emg_df):
+    # (start, end) as timestamps, numbers are seconds from the first EMG sample
+    if time_range is None:
+        return None
+    session_start = emg_df['Timestamp'].min()
+    return tuple(
+        session_start + pd.Timedelta(seconds=float(bound)) if isinstance(bound, (int, float, np.number)) else bound
+        for bound in time_range
+    )
 
-    # Create the NumPy arrays from the DataFrame
-    labels = integrated_df['Action_Label'].to_numpy(dtype=np.int32).reshape(-1, 1)
-    frequ =  np.full((1, 1), 2000)
-    repetitions = np.full(len(integrated_df), repetition_value, dtype=np.int32).reshape(-1, 1)
 
-    # EMG data
-    emg_data = integrated_df[[sensor for sensor in sensor_list if sensor in integrated_df.columns and sensor != excluded_sensor]].to_numpy(dtype=np.float32)
+def cut_recordings(recordings, time_range=None, cutoff_label=None, common_range=False):
+    """
+    Cuts the single recordings before they are merged.
 
-    # Accelerometer and gyroscope data (general sensors)
-    acc_columns = [f"{sensor}_acc_{axis} (g)" for sensor in sensor_list if sensor != excluded_sensor for axis in ['x', 'y', 'z']]
-    gyro_columns = [f"{sensor}_gyr_{axis} (deg/s)" for sensor in sensor_list if sensor != excluded_sensor for axis in ['x', 'y', 'z']]
-    acc_data = integrated_df[acc_columns].to_numpy(dtype=np.float32) if acc_columns else np.empty((len(integrated_df), 0), dtype=np.float32)
-    gyro_data = integrated_df[gyro_columns].to_numpy(dtype=np.float32) if gyro_columns else np.empty((len(integrated_df), 0), dtype=np.float32)
+    time_range: (start, end) as timestamps or seconds from the first EMG sample, None leaves a side open.
+    common_range: keep only the time covered by all recordings.
+    cutoff_label: drop everything after the last EMG sample with this label.
 
-    # Accelerometer and gyroscope data (excluded sensor)
-    glove_acc_data = integrated_df[[f"{excluded_sensor}_acc_{axis} (g)" for axis in ['x', 'y', 'z']]].to_numpy(dtype=np.float32) \
-        if f"{excluded_sensor}_acc_x (g)" in integrated_df.columns else np.empty((len(integrated_df), 0), dtype=np.float32)
-    glove_gyro_data = integrated_df[[f"{excluded_sensor}_gyr_{axis} (deg/s)" for axis in ['x', 'y', 'z']]].to_numpy(dtype=np.float32) \
-        if f"{excluded_sensor}_gyr_x (deg/s)" in integrated_df.columns else np.empty((len(integrated_df), 0), dtype=np.float32)
+    The EMG samples decide the rows of the result. The other recordings keep one sample on
+    each side of the range, so the kept EMG rows are aligned exactly as without the cut.
+    """
+    def cut(recordings, start, end):
+        return {kind: select_time_range(df, (start, end), margin=0 if kind == 'emg' else 1)
+                for kind, df in recordings.items()}
 
-    # FMG data
-    fmg_columns = [f"FSR{i:02d}" for i in range(1, 25) if f"FSR{i:02d}" in integrated_df.columns]
-    fmg_data = integrated_df[fmg_columns].to_numpy(dtype=np.float32) if fmg_columns else np.empty((len(integrated_df), 0), dtype=np.float32)
+    if time_range is not None:
+        recordings = cut(recordings, *absolute_time_range(time_range, recordings['emg']))
 
-    # Glove data
-    glove_columns = [f"Sensor{i}" for i in range(18) if f"Sensor{i}" in integrated_df.columns]
-    glove_data = integrated_df[glove_columns].to_numpy(dtype=np.float32) if glove_columns else np.empty((len(integrated_df), 0), dtype=np.float32)
+    if common_range:
+        start = max(df['Timestamp'].min() for df in recordings.values())
+        end = min(df['Timestamp'].max() for df in recordings.values())
+        recordings = cut(recordings, start, end)
 
+    if cutoff_label is not None:
+        emg_df = recordings['emg']
+        labelled = emg_df.loc[emg_df['Action_Label'] == cutoff_label, 'Timestamp']
+        if len(labelled):
+            # only keep the data up to the last occurrence of the label
+            recordings = cut(recordings, None, labelled.max())
+    return recordings
 
 
+def integrate_data(emg_df, aux_df, fmg_df, glove_df, repetition_value, channel_map=None, sensors=None, channels=None,
+                   time_range=None, cutoff_label=None, common_range=False, alignment='zoh', grid='emg', fsr_mapping=None):
+    """
+    Integrates EMG, AUX, FMG and glove DataFrames (datetime64 'Timestamp' columns) on a common
+    time grid and returns the dictionary that is saved as .mat file.
+
+    The channel selection (sensors, channels, see selected_columns) and the cuts (time_range,
+    cutoff_label, common_range, see cut_recordings) are applied to the single recordings
+    before they are merged. alignment is the resampling method ('zoh', 'nearest', 'linear',
+    'decimate', see resampling.py), grid 'emg' (the EMG timestamps) or a rate in Hz.
+    fsr_mapping is the FSR remap applied to the FMG data (fmg_data.load_fmg_data), it is saved
+    as 'fsr_mapping' (one row: raw FSR channel of every fmg column).
+    """
+    channel_map = select_sensors(channel_map, sensors)
+    integrated_df = merge_recordings(emg_df, aux_df, fmg_df, glove_df, channel_map, channels, time_range, cutoff_label,
+                                     common_range, alignment, grid)
+
+    # Extract numerical data
+    labels = integrated_df['Action_Label'].to_numpy(dtype=np.int32).reshape(-1, 1)
     timestamp_data = integrated_df['Timestamp_numeric'].to_numpy(dtype=np.float32).reshape(-1, 1)
 
-    # Combine data into a dictionary
+    # Drop non-numeric columns before converting to NumPy
+    emg_data, acc_data, gyro_data = extract_sensor_arrays(integrated_df, channel_map)
+    fmg_df = integrated_df.filter(regex='FSR\d+', axis=1)
+    fmg_data = fmg_df.to_numpy(dtype=np.float32)
+    glove_data = integrated_df.filter(regex='Sensor\d+', axis=1).to_numpy(dtype=np.float32)
+
+    # Create dictionary for .mat file
     data_dict = {
-        'frequency': frequ,
-        'repetition': repetitions,
-        'stimulus': labels,
+        'frequency': np.full((1, 1), 2000 if isinstance(grid, str) else int(round(float(grid)))),
+        'repetition': np.full(len(integrated_df), repetition_value, dtype=np.int32).reshape(-1, 1),
+        'stimulus': labels, #+17
         'emg': emg_data,
-        'acc': acc_data,
         'gyro': gyro_data,
+        'acc': acc_data,
         'fmg': fmg_data,
         'glove': glove_data,
-        'glove_acc': glove_acc_data,
-        'glove_gyro': glove_gyro_data,
-        'timestamp': timestamp_data,  # Add numeric timestamps
+        'timestamp': timestamp_data,
     }
-
-    # Save as .mat file
-    savemat(output_file_path, data_dict)
-    print(f"Data integration and conversion completed. File saved to {output_file_path}.")
+    if fsr_mapping is not None:
+        data_dict['fsr_mapping'] = fsr_mapping_row(fsr_mapping, fmg_df.columns)
+    return data_dict
 
 
+def merge_recordings(emg_df, aux_df, fmg_df, glove_df, channel_map=None, channels=None, time_range=None,
+                     cutoff_label=None, common_range=False, alignment='zoh', grid='emg', drop_zero_columns=None):
+    """
+    Cuts and resamples the recordings onto the common grid and returns them side by side in one
+    DataFrame (EMG and AUX columns prefixed with EMG/AUX, Timestamp_numeric in seconds from the start).
+    drop_zero_columns removes EMG and AUX columns with only 0.0, by default only without a channel map.
+    """
+    columns = selected_columns(channel_map, channels)
 
+    # Same time resolution for all merge keys, only the selected channels
+    recordings = {}
+    for kind, df in zip(RECORDINGS, (emg_df, aux_df, fmg_df, glove_df)):
+        if columns[kind] is not None:
+            df = df[[col for col in df.columns if col in set(columns[kind])]]
+        recordings[kind] = df.assign(Timestamp=df['Timestamp'].astype('datetime64[ns]'))
 
+    # Remove columns with only 0.0 (not needed if the recorder only kept the real channels)
+    if drop_zero_columns is None:
+        drop_zero_columns = channel_map is None
+    if drop_zero_columns:
+        for kind in ('emg', 'aux'):
+            recordings[kind] = recordings[kind].loc[:, (recordings[kind] != 0.0).any(axis=0)]
 
+    recordings = cut_recordings(recordings, time_range, cutoff_label, common_range)
 
-
-def data_integration_and_mat_conversion(
-    global_emg_file_path,
-    global_aux_file_path,
-    global_fmg_file_path,
-    glove_file_path,
-    output_mat_file_path,
-    sensor_list,
-    repetition_value
-):
-    # Load CSV files
-    emg_df = pd.read_csv(global_emg_file_path, dtype={'Timestamp': 'object'})
-    emg_df['Timestamp'] = pd.to_datetime(emg_df['Timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
-
-    aux_df = pd.read_csv(global_aux_file_path, parse_dates=['Timestamp'])
-    fmg_df = pd.read_csv(global_fmg_file_path, parse_dates=['Timestamp'])
-    glove_df = pd.read_csv(glove_file_path, parse_dates=['Timestamp'])
-
-    # Remove columns with only 0.0
-    emg_df = emg_df.loc[:, (emg_df != 0.0).any(axis=0)]
-    aux_df = aux_df.loc[:, (aux_df != 0.0).any(axis=0)]
-
-    # Ensure all dataframes are sorted by timestamp (required for merge_asof)
-    emg_df = emg_df.sort_values('Timestamp')
-    aux_df = aux_df.sort_values('Timestamp')
-    fmg_df = fmg_df.sort_values('Timestamp')
-    glove_df = glove_df.sort_values('Timestamp')
+    # Ensure all dataframes are sorted by timestamp (required for the resampling)
+    emg_df, aux_df, fmg_df, glove_df = [recordings[kind].sort_values('Timestamp') for kind in RECORDINGS]
 
     emg_df.columns = [
         f"EMG{col}" if col not in ['Timestamp', 'Action_Label'] else col
@@ -179,57 +211,301 @@ def data_integration_and_mat_conversion(
         for col in aux_df.columns
 ]
 
-    # Merge using nearest timestamp alignment
-    integrated_df = pd.merge_asof(emg_df, aux_df, on='Timestamp', suffixes=('', ''))
-    integrated_df = pd.merge_asof(integrated_df, fmg_df, on='Timestamp', suffixes=('', '_fmg'))
-    integrated_df = pd.merge_asof(integrated_df, glove_df, on='Timestamp', suffixes=('', '_glove'))
+    # Resample all recordings onto the common grid and put them side by side
+    timestamps = target_grid(emg_df['Timestamp'].to_numpy(), grid)
+    if not (isinstance(grid, str) and grid == 'emg'):
+        emg_df = resample_frame(emg_df, timestamps, alignment)
+    aux_df, fmg_df, glove_df = [
+        resample_frame(df, timestamps, alignment).drop(columns='Timestamp') for df in (aux_df, fmg_df, glove_df)
+    ]
+    integrated_df = pd.concat([emg_df.reset_index(drop=True), aux_df, fmg_df, glove_df], axis=1)
 
     # Convert timestamps to numeric (relative to start_time)
     start_time = integrated_df['Timestamp'].min()
     integrated_df['Timestamp_numeric'] = (integrated_df['Timestamp'] - start_time).dt.total_seconds()
+    return integrated_df
 
-    # Extract numerical data
-    labels = integrated_df['Action_Label'].to_numpy(dtype=np.int32).reshape(-1, 1)
-    timestamp_data = integrated_df['Timestamp_numeric'].to_numpy(dtype=np.float32).reshape(-1, 1)
 
-    # Drop non-numeric columns before converting to NumPy
-    emg_data = integrated_df.filter(regex='EMG\d+', axis=1).to_numpy(dtype=np.float32)
-    aux_data = integrated_df.filter(regex='AUX\d+', axis=1).to_numpy(dtype=np.float32)
-    fmg_data = integrated_df.filter(regex='FSR\d+', axis=1).to_numpy(dtype=np.float32)
-    glove_data = integrated_df.filter(regex='Sensor\d+', axis=1).to_numpy(dtype=np.float32)
-    
+def fsr_mapping_row(fsr_mapping, fmg_columns):
+    # raw FSR channel number of every fmg column, one row per file like the frequency
+    return np.array([[int(str(fsr_mapping.get(col, col))[3:]) for col in fmg_columns]], dtype=np.int32)
 
 
-    # Split AUX into ACC and GYRO (assuming groups of 6 columns)
-    acc_data = np.hstack([aux_data[:, i:i+3] for i in range(0, aux_data.shape[1], 6)])
-    gyro_data = np.hstack([aux_data[:, i+3:i+6] for i in range(0, aux_data.shape[1], 6)])
+def integrate_files(emg_file_path, aux_file_path, fmg_file_path, glove_file_path, repetition_value, channel_map=None,
+                    sensors=None, channels=None, time_range=None, cutoff_label=None, common_range=False, alignment='zoh',
+                    grid='emg', fsr_mapping=None):
+    """
+    Loads the processed recordings and integrates them with integrate_data. Only the selected
+    channels are loaded, and the other recordings are only loaded for the time range left
+    over by the EMG cuts, so excluded data is not read or merged.
+    """
+    channel_map = select_sensors(channel_map, sensors)
+    columns = selected_columns(channel_map, channels)
+
+    # The EMG recording is loaded first, its cut decides the time range of the others
+    emg_df = read_recording(emg_file_path, columns=columns['emg'])
+    time_range = absolute_time_range(time_range, emg_df)
+    load_range = None
+    if time_range is not None or cutoff_label is not None:
+        emg_df = cut_recordings({'emg': emg_df}, time_range, cutoff_label)['emg']
+        load_range = (emg_df['Timestamp'].min(), emg_df['Timestamp'].max())
+
+    aux_df, fmg_df, glove_df = [
+        read_recording(file_path, columns=columns[kind], time_range=load_range, margin=1)
+        for kind, file_path in (('aux', aux_file_path), ('fmg', fmg_file_path), ('glove', glove_file_path))
+    ]
+    return integrate_data(emg_df, aux_df, fmg_df, glove_df, repetition_value, channel_map, None, channels,
+                          time_range, cutoff_label, common_range, alignment, grid, fsr_mapping)
 
-    # Move first few columns to the end for correct alignment
-    emg_data = np.hstack([emg_data[:, 4:], emg_data[:, :4]])
-    gyro_data = np.hstack([gyro_data[:, 3:], gyro_data[:, :3]])
-    acc_data = np.hstack([acc_data[:, 3:], acc_data[:, :3]])
 
-    # Create dictionary for .mat file
+def save_mat(file_path, data_dict, mat_format='v5'):
+    # 'v5' through scipy.io.savemat, 'v7.3' as HDF5 (chunked, no 2 GB limit, needs h5py)
+    if mat_format == 'v7.3':
+        save_mat73(file_path, data_dict)
+    elif mat_format == 'v5':
+        savemat(file_path, data_dict)
+    else:
+        raise ValueError(f"Unknown mat_format '{mat_format}', use 'v5' or 'v7.3'.")
+
+
+def load_mat(file_path, variable_names=None):
+    # Reads v5 and v7.3 .mat files
+    if is_mat73(file_path):
+        return load_mat73(file_path, variable_names)
+    return loadmat(file_path, variable_names=variable_names)
+
+
+def save_integrated_data(data_dict, output_mat_file_path, mat_format='v5'):
+    # Save as .mat file, with the segment index (<name>_segments.csv) next to it
+    save_mat(output_mat_file_path, data_dict, mat_format)
+    write_segment_index(output_mat_file_path, data_dict)
+    print(f"Data integration and conversion completed. File saved to {output_mat_file_path}.")
+
+
+def data_integration_processing_interpolate(
+        global_emg_file_path, 
+        global_aux_file_path, 
+        global_fmg_file_path, 
+        glove_file_path, 
+        output_file_path,
+        sensor_list,
+        repetition_value,
+        excluded_sensor='S8',
+        channel_map_file=None
+        ):
+    # AUX, FMG and glove data interpolated at the EMG timestamps. EMG, acc and gyro of the sensors
+    # in sensor_list, the IMU of the excluded sensor (on the glove) as glove_acc / glove_gyro.
+    channel_map = load_channel_map(channel_map_file)
+    recordings = [read_recording(file_path) for file_path in
+                  (global_emg_file_path, global_aux_file_path, global_fmg_file_path, glove_file_path)]
+    integrated_df = merge_recordings(*recordings, alignment='linear', drop_zero_columns=False)
+
+    # Drop rows with missing FMG data
+    fmg_columns = [f"FSR{i:02d}" for i in range(1, 25) if f"FSR{i:02d}" in integrated_df.columns]
+    integrated_df = integrated_df.dropna(subset=fmg_columns).reset_index(drop=True)
+
+    sensors = [sensor for sensor in sensor_list if sensor != excluded_sensor]
+    if channel_map:
+        emg_data, acc_data, gyro_data = extract_sensor_arrays(integrated_df, select_sensors(channel_map, sensors))
+        _, glove_acc_data, glove_gyro_data = extract_sensor_arrays(integrated_df, select_sensors(channel_map, [excluded_sensor]))
+    else:
+        # columns named after the sensors
+        def named(names):
+            names = [name for name in names if name in integrated_df.columns]
+            return integrated_df[names].to_numpy(dtype=np.float32)
+
+        emg_data = named([f"EMG{sensor}" for sensor in sensors])
+        acc_data = named([f"AUX{sensor}_acc_{axis} (g)" for sensor in sensors for axis in ['x', 'y', 'z']])
+        gyro_data = named([f"AUX{sensor}_gyr_{axis} (deg/s)" for sensor in sensors for axis in ['x', 'y', 'z']])
+        glove_acc_data = named([f"AUX{excluded_sensor}_acc_{axis} (g)" for axis in ['x', 'y', 'z']])
+        glove_gyro_data = named([f"AUX{excluded_sensor}_gyr_{axis} (deg/s)" for axis in ['x', 'y', 'z']])
+
     data_dict = {
         'frequency': np.full((1, 1), 2000),
         'repetition': np.full(len(integrated_df), repetition_value, dtype=np.int32).reshape(-1, 1),
-        'stimulus': labels, #+17
+        'stimulus': integrated_df['Action_Label'].to_numpy(dtype=np.int32).reshape(-1, 1),
         'emg': emg_data,
-        'gyro': gyro_data,
         'acc': acc_data,
-        'fmg': fmg_data,
-        'glove': glove_data,
-        'timestamp': timestamp_data,
+        'gyro': gyro_data,
+        'fmg': integrated_df[fmg_columns].to_numpy(dtype=np.float32),
+        'glove': integrated_df.filter(regex='Sensor\d+', axis=1).to_numpy(dtype=np.float32),
+        'glove_acc': glove_acc_data,
+        'glove_gyro': glove_gyro_data,
+        'timestamp': integrated_df['Timestamp_numeric'].to_numpy(dtype=np.float32).reshape(-1, 1),
     }
+    save_integrated_data(data_dict, output_file_path)
 
-    # Save as .mat file
-    savemat(output_mat_file_path, data_dict)
-    print(f"Data integration and conversion completed. File saved to {output_mat_file_path}.")
 
+def data_integration_and_mat_conversion(
+    global_emg_file_path,
+    global_aux_file_path,
+    global_fmg_file_path,
+    glove_file_path,
+    output_mat_file_path,
+    sensor_list,
+    repetition_value,
+    channel_map_file=None,
+    fsr_mapping=None
+):
+    data_dict = integrate_files(global_emg_file_path, global_aux_file_path, global_fmg_file_path, glove_file_path,
+                                repetition_value, load_channel_map(channel_map_file), fsr_mapping=fsr_mapping)
+    save_integrated_data(data_dict, output_mat_file_path)
 
 
 
-def merge_mat_files(base_folder, final_output_file, interpolated_output_file):
+
+# dtypes of the MATLAB classes reported by whosmat
+MAT_CLASS_DTYPES = {
+    'double': np.float64, 'single': np.float32,
+    'int8': np.int8, 'int16': np.int16, 'int32': np.int32, 'int64': np.int64,
+    'uint8': np.uint8, 'uint16': np.uint16, 'uint32': np.uint32, 'uint64': np.uint64,
+    'logical': np.uint8,
+}
+
+
+def scan_mat_files(mat_files):
+    """
+    Reads only the headers of the .mat files and returns the keys, shapes and dtypes of the
+    merged arrays (keys of the first file, rows summed over all files) and the rows of every file.
+    """
+    layout = {}
+    file_rows = []
+    for i, mat_path in enumerate(mat_files):
+        variables = {name: (shape, mat_class) for name, shape, mat_class in whosmat(mat_path)}
+        if i == 0:
+            # the keys of the first file decide the keys of the merged data
+            for name, (shape, mat_class) in variables.items():
+                layout[name] = {'rows': 0, 'columns': shape[1:], 'dtypes': []}
+        for name, entry in layout.items():
+            if name not in variables:
+                print(f"Warning: Key '{name}' not found in file {os.path.basename(mat_path)}. Skipping.")
+                continue
+            shape, mat_class = variables[name]
+            if shape[1:] != entry['columns']:
+                raise ValueError(f"Key '{name}' in {mat_path} has shape {shape}, expected (*, {entry['columns']}).")
+            entry['rows'] += shape[0]
+            entry['dtypes'].append(MAT_CLASS_DTYPES.get(mat_class))
+        file_rows.append(max((shape[0] for shape, _ in variables.values()), default=0))
+
+    for entry in layout.values():
+        # None if a class has no plain numeric dtype (char, cell, struct), these keys are stacked at the end
+        entry['dtype'] = None if None in entry['dtypes'] else np.result_type(*entry['dtypes'])
+    return layout, file_rows
+
+
+def merge_mat_file_list(mat_files):
+    """
+    Merges the arrays of the given .mat files row by row (same result as repeated np.vstack).
+    The shapes are scanned first, every output array is allocated once and the data of every
+    file is copied exactly once. Only one input file is loaded at a time.
+
+    Returns the merged dictionary and the index DataFrame (file, start, stop) with the row
+    range of every file in the merged data.
+    """
+    layout, file_rows = scan_mat_files(mat_files)
+    merged = {}
+    pieces = {}
+    for name, entry in layout.items():
+        if entry['dtype'] is None:
+            pieces[name] = []
+        else:
+            merged[name] = np.empty((entry['rows'],) + entry['columns'], dtype=entry['dtype'])
+    positions = dict.fromkeys(layout, 0)
+
+    for mat_path in mat_files:
+        print(f"Processing: {mat_path}")
+        mat_data = loadmat(mat_path, variable_names=list(layout))
+        for name in layout:
+            if name not in mat_data:
+                continue
+            if name in pieces:
+                pieces[name].append(mat_data[name])
+                continue
+            rows = mat_data[name].shape[0]
+            merged[name][positions[name]:positions[name] + rows] = mat_data[name]
+            positions[name] += rows
+        del mat_data
+
+    for name, arrays in pieces.items():
+        merged[name] = np.vstack(arrays)
+
+    stops = np.cumsum(file_rows, dtype=np.int64)
+    index = pd.DataFrame({'file': mat_files, 'start': stops - file_rows, 'stop': stops})
+    return merged, index
+
+
+def index_file_path(merged_file):
+    # The row index is saved next to the merged .mat file
+    return os.path.splitext(merged_file)[0] + '_index.csv'
+
+
+def slice_merged_file(merged_file, source_file, merged_data=None):
+    """
+    Returns the data of one source .mat file from a merged .mat file, using the row index
+    written by merge_mat_files. Arrays with one row per file (e.g. frequency) give the row of that file.
+    """
+    index = pd.read_csv(index_file_path(merged_file))
+    matches = index[index['file'].map(os.path.normpath) == os.path.normpath(source_file)]
+    if matches.empty:
+        raise KeyError(f"{source_file} is not part of {merged_file}.")
+    position = matches.index[0]
+    start, stop = int(matches['start'].iloc[0]), int(matches['stop'].iloc[0])
+
+    if merged_data is None:
+        merged_data = load_mat(merged_file)
+    total_rows = int(index['stop'].iloc[-1])
+    data = {}
+    for key, value in merged_data.items():
+        if key.startswith('__'):
+            continue
+        if value.shape[0] == total_rows:
+            data[key] = value[start:stop]
+        elif value.shape[0] == len(index):
+            data[key] = value[position:position + 1]
+        else:
+            data[key] = value
+    return data
+
+
+def stream_mat_files_to_mat73(mat_files, output_file):
+    """
+    Merges the .mat files directly into a v7.3 file: every file is loaded and appended on its
+    own, the merged data is never held in memory. Variables with one row per file (frequency)
+    get one row per file as in the v5 merge. Returns the index DataFrame like merge_mat_file_list.
+    """
+    layout, file_rows = scan_mat_files(mat_files)
+    with Mat73Writer(output_file) as writer:
+        for mat_path in mat_files:
+            print(f"Processing: {mat_path}")
+            writer.append(loadmat(mat_path, variable_names=list(layout)))
+
+    stops = np.cumsum(file_rows, dtype=np.int64)
+    return pd.DataFrame({'file': mat_files, 'start': stops - file_rows, 'stop': stops})
+
+
+def save_merged_data(mat_files, output_file, mat_format='v5'):
+    # Merges the files, saves the .mat file and its row index
+
+    # Extrahiere den Ordnerpfad aus dem finalen Dateipfad
+    output_dir = os.path.dirname(output_file)
+
+    # Prüfe, ob der Ordner existiert, und erstelle ihn bei Bedarf
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+        print(f"Ordner {output_dir} wurde erstellt.")
+
+    if mat_format == 'v7.3':
+        index = stream_mat_files_to_mat73(mat_files, output_file)
+        merged = load_mat73(output_file, ['stimulus', 'repetition', 'timestamp'])
+    else:
+        merged, index = merge_mat_file_list(mat_files)
+        save_mat(output_file, merged, mat_format)
+    index.to_csv(index_file_path(output_file), index=False)
+    # segments never run across the border of two source files
+    write_segment_index(output_file, merged, index['start'].to_numpy())
+
+
+def merge_mat_files(base_folder, final_output_file, interpolated_output_file, mat_format='v5'):
     """
     Merges all 'final_data_*.mat' files and 'interpolated_data_*.mat' files 
     in subfolders of a specified folder into two separate .mat files.
@@ -238,119 +514,55 @@ def merge_mat_files(base_folder, final_output_file, interpolated_output_file):
     - base_folder: str, path to the base folder containing subfolders with .mat files.
     - final_output_file: str, path to the output .mat file for merged final_data files.
     - interpolated_output_file: str, path to the output .mat file for merged interpolated_data files.
+    - mat_format: str, 'v5' (scipy.io.savemat) or 'v7.3' (HDF5, streamed file by file, needs h5py).
     
     Output:
-    Saves the merged data as two separate .mat files.
+    Saves the merged data as two separate .mat files, each with a <name>_index.csv that holds
+    the row range of every source file (see slice_merged_file). Returns the list of saved files.
     """
-    final_data = {}
-    interpolated_data = {}
-    
-    # Initialize flags for keys in the merged data
-    final_keys_initialized = False
-    interpolated_keys_initialized = False
-    
+    saved_files = []
+    final_files = []
+    interpolated_files = []
+
     # Recursively find all .mat files in subfolders
     for root, _, files in os.walk(base_folder):
         for file in files:
             if file.endswith('.mat'):
-                mat_path = os.path.join(root, file)
-                print(f"Processing: {mat_path}")
-
-                # Load the .mat file
-                mat_data = loadmat(mat_path)
-                
                 # Determine if the file is a final_data file or interpolated_data file
                 if 'final_data' in file:
-                    # Merge final_data files
-                    final_id = file.split('_')[-1].replace(".mat", "")
-                    if not final_keys_initialized:
-                        # Initialize merged_data with keys from the first final_data file
-                        for key in mat_data:
-                            # Skip metadata fields
-                            if not key.startswith('__'):
-                                final_data[key] = mat_data[key]
-                        final_keys_initialized = True
-                    else:
-                        # Merge data for each key in final_data
-                        final_int_id = file.split('_')[-1].replace(".mat", "")
-                        for key in final_data.keys():
-                            if key in mat_data:
-                                # Concatenate arrays for final_data
-                                if isinstance(final_data[key], np.ndarray) and isinstance(mat_data[key], np.ndarray):
-                                    final_data[key] = np.vstack((final_data[key], mat_data[key]))
-                                else:
-                                    print(f"Warning: Skipping concatenation for non-array key '{key}' in final_data.")
-                            else:
-                                print(f"Warning: Key '{key}' not found in file {file}. Skipping.")
-                
+                    final_files.append(os.path.join(root, file))
                 elif 'interpolated_data' in file:
-                    # Merge interpolated_data files
-                    if not interpolated_keys_initialized:
-                        # Initialize merged_data with keys from the first interpolated_data file
-                        for key in mat_data:
-                            # Skip metadata fields
-                            if not key.startswith('__'):
-                                interpolated_data[key] = mat_data[key]
-                        interpolated_keys_initialized = True
-                    else:
-                        # Merge data for each key in interpolated_data
-                        for key in interpolated_data.keys():
-                            if key in mat_data:
-                                # Concatenate arrays for interpolated_data
-                                if isinstance(interpolated_data[key], np.ndarray) and isinstance(mat_data[key], np.ndarray):
-                                    interpolated_data[key] = np.vstack((interpolated_data[key], mat_data[key]))
-                                else:
-                                    print(f"Warning: Skipping concatenation for non-array key '{key}' in interpolated_data.")
-                            else:
-                                print(f"Warning: Key '{key}' not found in file {file}. Skipping.")
-    
+                    interpolated_files.append(os.path.join(root, file))
+
+    # os.walk order depends on the file system, sorted so the merged rows, the index and final_id are reproducible
+    final_files.sort()
+    interpolated_files.sort()
+
     # Save the merged final_data to the output file
-    if final_data:
+    if final_files:
         # Erstelle den finalen Dateipfad mit final_id
+        final_id = os.path.basename(final_files[-1]).split('_')[-1].replace(".mat", "")
         final_output_file = final_output_file + "_" + final_id + ".mat"
-
-        # Extrahiere den Ordnerpfad aus dem finalen Dateipfad
-        output_dir = os.path.dirname(final_output_file)
-
-        # Prüfe, ob der Ordner existiert, und erstelle ihn bei Bedarf
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-            print(f"Ordner {output_dir} wurde erstellt.")
-
-        # Speichere die finalen Daten als .mat-Datei
-        savemat(final_output_file, final_data)
+        save_merged_data(final_files, final_output_file, mat_format)
+        saved_files.append(final_output_file)
         print(f"Merged final_data saved to {final_output_file}")
     else:
         print("No final_data files were found to merge.")
     
     # Save the merged interpolated_data to the output file
-    if interpolated_data:
+    if interpolated_files:
+        final_int_id = os.path.basename(interpolated_files[-1]).split('_')[-1].replace(".mat", "")
         interpolated_output_file=interpolated_output_file+"_"+ final_int_id+".mat"
-        savemat(interpolated_output_file, interpolated_data)
+        save_merged_data(interpolated_files, interpolated_output_file, mat_format)
+        saved_files.append(interpolated_output_file)
         print(f"Merged interpolated_data saved to {interpolated_output_file}")
     else:
         print("No interpolated_data files were found to merge.")
+    return saved_files
 
 
 
 
-def resolve_duplicates(df, column='Timestamp'):
-    # Find duplicates
-    duplicates = df[df[column].duplicated(keep=False)]
-    if not duplicates.empty:
-        print(f"Resolving duplicates for {len(duplicates)} rows")
-        print(duplicates[column].value_counts())
-
-    # Add a small time delta to each duplicate
-    df[column] += pd.to_timedelta(df.groupby(column).cumcount() * 1e-6, unit='s')
-
-    # Verify uniqueness
-    if df[column].duplicated().any():
-        print("Duplicates still exist after resolution!")
-    else:
-        print("Duplicates successfully resolved.")
-    return df
-
 def mat_and_cuttoff(
     global_emg_file_path,
     global_aux_file_path,
@@ -360,126 +572,10 @@ def mat_and_cuttoff(
     repetition_value,
     cutoff_label
 ):
-    # Load the CSV files and parse timestamps
-    emg_df = pd.read_csv(global_emg_file_path, dtype={'Timestamp': 'object'})
-    emg_df['Timestamp'] = pd.to_datetime(emg_df['Timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
-
-    aux_df = pd.read_csv(global_aux_file_path, parse_dates=['Timestamp'])
-    fmg_df = pd.read_csv(global_fmg_file_path, parse_dates=['Timestamp'])
-    glove_df = pd.read_csv(glove_file_path, parse_dates=['Timestamp'])
-
-    # Remove columns in EMG and AUX that contain only 0.0
-    emg_df = emg_df.loc[:, (emg_df != 0.0).any(axis=0)]
-    aux_df = aux_df.loc[:, (aux_df != 0.0).any(axis=0)]
-
-    # Synchronize timestamps by defining a common time range
-    start_time = max(
-        emg_df['Timestamp'].min(),
-        aux_df['Timestamp'].min(),
-        fmg_df['Timestamp'].min(),
-        glove_df['Timestamp'].min()
-    )
-    end_time = min(
-        emg_df['Timestamp'].max(),
-        aux_df['Timestamp'].max(),
-        fmg_df['Timestamp'].max(),
-        glove_df['Timestamp'].max()
-    )
-
-    # Filter data based on synchronized timestamps
-    emg_df = emg_df[(emg_df['Timestamp'] >= start_time) & (emg_df['Timestamp'] <= end_time)]
-    aux_df = aux_df[(aux_df['Timestamp'] >= start_time) & (aux_df['Timestamp'] <= end_time)]
-    fmg_df = fmg_df[(fmg_df['Timestamp'] >= start_time) & (fmg_df['Timestamp'] <= end_time)]
-    glove_df = glove_df[(glove_df['Timestamp'] >= start_time) & (glove_df['Timestamp'] <= end_time)]
-
-    if cutoff_label in emg_df['Action_Label'].values:
-        cutoff_time = emg_df[emg_df['Action_Label'] == cutoff_label]['Timestamp'].max()
-        
-        # Nur Werte behalten, die VOR dem letzten Auftreten des Labels liegen
-        emg_df = emg_df[emg_df['Timestamp'] <= cutoff_time]
-        aux_df = aux_df[aux_df['Timestamp'] <= cutoff_time]
-        fmg_df = fmg_df[fmg_df['Timestamp'] <= cutoff_time]
-        glove_df = glove_df[glove_df['Timestamp'] <= cutoff_time]
-
-    # Convert timestamps to numeric (seconds since start_time)
-    emg_df['Timestamp_numeric'] = (emg_df['Timestamp'] - start_time).dt.total_seconds()
-    aux_df['Timestamp_numeric'] = (aux_df['Timestamp'] - start_time).dt.total_seconds()
-    fmg_df['Timestamp_numeric'] = (fmg_df['Timestamp'] - start_time).dt.total_seconds()
-    glove_df['Timestamp_numeric'] = (glove_df['Timestamp'] - start_time).dt.total_seconds()
-
-    # Convert data to NumPy arrays
-    emg_data = emg_df.select_dtypes(include=[np.number]).to_numpy(dtype=np.float32)
-    aux_data = aux_df.select_dtypes(include=[np.number]).to_numpy(dtype=np.float32)
-    fmg_data = fmg_df.select_dtypes(include=[np.number]).to_numpy(dtype=np.float32)
-    glove_data = glove_df.select_dtypes(include=[np.number]).to_numpy(dtype=np.float32)
-
-
-    labels = emg_df['Action_Label'].to_numpy(dtype=np.int32).reshape(-1, 1)
-    timestamp_data = emg_df['Timestamp_numeric'].to_numpy(dtype=np.float32).reshape(-1, 1)
-
-
-    emg_df = emg_df.sort_values('Timestamp')
-    aux_df = aux_df.sort_values('Timestamp')
-    fmg_df = fmg_df.sort_values('Timestamp')
-    glove_df = glove_df.sort_values('Timestamp')
-
-    emg_df.columns = [
-        f"EMG{col}" if col not in ['Timestamp', 'Action_Label'] else col
-        for col in emg_df.columns
-    ]
-
-    # Umbenennen der Spalten in aux_df, außer 'Timestamp' und 'Action_Label'
-    aux_df.columns = [
-        f"AUX{col}" if col not in ['Timestamp', 'Action_Label'] else col
-        for col in aux_df.columns
-]
-
-    # Merge using nearest timestamp alignment
-    integrated_df = pd.merge_asof(emg_df, aux_df, on='Timestamp', suffixes=('', ''))
-    integrated_df = pd.merge_asof(integrated_df, fmg_df, on='Timestamp', suffixes=('', '_fmg'))
-    integrated_df = pd.merge_asof(integrated_df, glove_df, on='Timestamp', suffixes=('', '_glove'))
-
-    # Convert timestamps to numeric (relative to start_time)
-    start_time = integrated_df['Timestamp'].min()
-    integrated_df['Timestamp_numeric'] = (integrated_df['Timestamp'] - start_time).dt.total_seconds()
-
-    # Extract numerical data
-    labels = integrated_df['Action_Label'].to_numpy(dtype=np.int32).reshape(-1, 1)
-    timestamp_data = integrated_df['Timestamp_numeric'].to_numpy(dtype=np.float32).reshape(-1, 1)
-
-    # Drop non-numeric columns before converting to NumPy
-    emg_data = integrated_df.filter(regex='EMG\d+', axis=1).to_numpy(dtype=np.float32)
-    aux_data = integrated_df.filter(regex='AUX\d+', axis=1).to_numpy(dtype=np.float32)
-    fmg_data = integrated_df.filter(regex='FSR\d+', axis=1).to_numpy(dtype=np.float32)
-    glove_data = integrated_df.filter(regex='Sensor\d+', axis=1).to_numpy(dtype=np.float32)
-    
-
-
-    # Split AUX into ACC and GYRO (assuming groups of 6 columns)
-    acc_data = np.hstack([aux_data[:, i:i+3] for i in range(0, aux_data.shape[1], 6)])
-    gyro_data = np.hstack([aux_data[:, i+3:i+6] for i in range(0, aux_data.shape[1], 6)])
-
-    # Move first few columns to the end for correct alignment
-    emg_data = np.hstack([emg_data[:, 4:], emg_data[:, :4]])
-    gyro_data = np.hstack([gyro_data[:, 3:], gyro_data[:, :3]])
-    acc_data = np.hstack([acc_data[:, 3:], acc_data[:, :3]])
-
-    # Create dictionary for .mat file
-    data_dict = {
-        'frequency': np.full((1, 1), 2000),
-        'repetition': np.full(len(integrated_df), 6, dtype=np.int32).reshape(-1, 1),
-        'stimulus': labels,
-        'emg': emg_data,
-        'gyro': gyro_data,
-        'acc': acc_data,
-        'fmg': fmg_data,
-        'glove': glove_data,
-        'timestamp': timestamp_data,
-    }
-
-    # Save as .mat file
-    savemat(output_mat_file_path, data_dict)
-    print(f"Data integration and conversion completed. File saved to {output_mat_file_path}.")
+    # Only the time range covered by all recordings, up to the last occurrence of the cutoff label
+    data_dict = integrate_files(global_emg_file_path, global_aux_file_path, global_fmg_file_path, glove_file_path,
+                                repetition_value, common_range=True, cutoff_label=cutoff_label)
+    save_integrated_data(data_dict, output_mat_file_path)
 
 
 
@@ -492,84 +588,7 @@ def new_cut(
     repetition_value,
     cutoff  # New parameter
 ):
-    # Load CSV files
-    emg_df = pd.read_csv(global_emg_file_path, dtype={'Timestamp': 'object'})
-    emg_df['Timestamp'] = pd.to_datetime(emg_df['Timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
-
-    aux_df = pd.read_csv(global_aux_file_path, parse_dates=['Timestamp'])
-    fmg_df = pd.read_csv(global_fmg_file_path, parse_dates=['Timestamp'])
-    glove_df = pd.read_csv(glove_file_path, parse_dates=['Timestamp'])
-
-    # Remove columns with only 0.0
-    emg_df = emg_df.loc[:, (emg_df != 0.0).any(axis=0)]
-    aux_df = aux_df.loc[:, (aux_df != 0.0).any(axis=0)]
-
-    # Ensure all dataframes are sorted by timestamp
-    emg_df = emg_df.sort_values('Timestamp')
-    aux_df = aux_df.sort_values('Timestamp')
-    fmg_df = fmg_df.sort_values('Timestamp')
-    glove_df = glove_df.sort_values('Timestamp')
-
-    emg_df.columns = [
-        f"EMG{col}" if col not in ['Timestamp', 'Action_Label'] else col
-        for col in emg_df.columns
-    ]
-
-    aux_df.columns = [
-        f"AUX{col}" if col not in ['Timestamp', 'Action_Label'] else col
-        for col in aux_df.columns
-    ]
-
-    # Merge using nearest timestamp alignment
-    integrated_df = pd.merge_asof(emg_df, aux_df, on='Timestamp', suffixes=('', ''))
-    integrated_df = pd.merge_asof(integrated_df, fmg_df, on='Timestamp', suffixes=('', '_fmg'))
-    integrated_df = pd.merge_asof(integrated_df, glove_df, on='Timestamp', suffixes=('', '_glove'))
-
-    # Convert timestamps to numeric (relative to start_time)
-    start_time = integrated_df['Timestamp'].min()
-    integrated_df['Timestamp_numeric'] = (integrated_df['Timestamp'] - start_time).dt.total_seconds()
-
-    # Extract numerical data
-    labels = integrated_df['Action_Label'].to_numpy(dtype=np.int32).reshape(-1, 1)
-    timestamp_data = integrated_df['Timestamp_numeric'].to_numpy(dtype=np.float32).reshape(-1, 1)
-
-    # Find last occurrence of cutoff stimulus
-    last_cutoff_index = np.where(labels == cutoff)[0]
-    if len(last_cutoff_index) > 0:
-        last_cutoff_index = last_cutoff_index[-1]  # Last occurrence of cutoff
-    else:
-        last_cutoff_index = len(labels)  # If cutoff is not found, keep all data
-
-    # Drop non-numeric columns before converting to NumPy
-    emg_data = integrated_df.filter(regex='EMG\d+', axis=1).to_numpy(dtype=np.float32)[:last_cutoff_index + 1]
-    aux_data = integrated_df.filter(regex='AUX\d+', axis=1).to_numpy(dtype=np.float32)[:last_cutoff_index + 1]
-    fmg_data = integrated_df.filter(regex='FSR\d+', axis=1).to_numpy(dtype=np.float32)[:last_cutoff_index + 1]
-    glove_data = integrated_df.filter(regex='Sensor\d+', axis=1).to_numpy(dtype=np.float32)[:last_cutoff_index + 1]
-    labels = labels[:last_cutoff_index + 1]
-    timestamp_data = timestamp_data[:last_cutoff_index + 1]
-
-    # Split AUX into ACC and GYRO (assuming groups of 6 columns)
-    acc_data = np.hstack([aux_data[:, i:i+3] for i in range(0, aux_data.shape[1], 6)])
-    gyro_data = np.hstack([aux_data[:, i+3:i+6] for i in range(0, aux_data.shape[1], 6)])
-
-    # Move first few columns to the end for correct alignment
-    emg_data = np.hstack([emg_data[:, 4:], emg_data[:, :4]])
-    gyro_data = np.hstack([gyro_data[:, 3:], gyro_data[:, :3]])
-    acc_data = np.hstack([acc_data[:, 3:], acc_data[:, :3]])
-
-    # Create dictionary for .mat file
-    data_dict = {
-        'frequency': np.full((1, 1), 2000),
-        'repetition': np.full(len(labels), repetition_value, dtype=np.int32).reshape(-1, 1),
-        'stimulus': labels,
-        'emg': emg_data,
-        'gyro': gyro_data,
-        'acc': acc_data,
-        'fmg': fmg_data,
-        'glove': glove_data,
-        'timestamp': timestamp_data,
-    }
-
-    # Save as .mat file
-    savemat(output_mat_file_path, data_dict)
-    print(f"Data integration and conversion completed. File saved to {output_mat_file_path}.")
+    # Everything up to the last occurrence of the cutoff stimulus
+    data_dict = integrate_files(global_emg_file_path, global_aux_file_path, global_fmg_file_path, glove_file_path,
+                                repetition_value, cutoff_label=cutoff)
+    save_integrated_data(data_dict, output_mat_file_path)
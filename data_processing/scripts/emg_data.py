@@ -1,69 +1,67 @@
 
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
-import csv
+from ingest import read_recording, save_processed_csv
 
 
 
+def parse_timestamps_us(timestamps, timestamp_format='%Y-%m-%d %H:%M:%S.%f'):
+    # Timestamp strings -> int64 microseconds since epoch, parsed in one go
+    return pd.to_datetime(timestamps, format=timestamp_format).to_numpy(dtype='datetime64[us]').astype(np.int64)
+
+
+def equalize_timestamps(timestamps_us):
+    """
+    Spreads runs of equal timestamps linearly up to the next different timestamp.
+
+    Every poll of the Trigno gives many samples with the same timestamp. The samples of a run
+    get start + i * (next - start) / length, the interval rounded to microseconds like a
+    timedelta division. The last run starts at its timestamp and continues with the last interval.
+    """
+    timestamps_us = np.asarray(timestamps_us, dtype=np.int64)
+    n = len(timestamps_us)
+    if n == 0:
+        return timestamps_us.copy()
+
+    # start and length of every run of equal timestamps
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(timestamps_us)) + 1))
+    lengths = np.diff(np.append(starts, n))
+
+    # interval of every run but the last one: (next - start) / length, rounded half to even
+    delta = timestamps_us[starts[1:]] - timestamps_us[starts[:-1]]
+    quotient, remainder = np.divmod(delta, lengths[:-1])
+    round_up = (2 * remainder > lengths[:-1]) | ((2 * remainder == lengths[:-1]) & (quotient % 2 == 1))
+    intervals = quotient + round_up
+
+    # the last run continues with the interval of the run before it
+    last_interval = intervals[-1] if len(intervals) else 0
+    intervals = np.append(intervals, last_interval)
+
+    position = np.arange(n) - np.repeat(starts, lengths)
+    return np.repeat(timestamps_us[starts], lengths) + position * np.repeat(intervals, lengths)
+
+
+def emg_data_upsampling(data):
+    # In-memory stage: raw EMG DataFrame -> DataFrame with equalized timestamps (datetime64)
+    # decimal commas are already parsed by read_recording (ingest.parse_csv)
+    data = data[data.iloc[:, 1] != 0].copy()
+
+    # 获取所有时间戳并转换为整数微秒, 然后均匀分布
+    timestamps = equalize_timestamps(parse_timestamps_us(data['Timestamp']))
+    data['Timestamp'] = timestamps.astype('datetime64[us]').astype('datetime64[ns]')
+    return data
+
 
 def emg_data_processing_upsampling(input_file_path, output_file_path):
 
 
     # 步骤1: 读取CSV文件
-    data = pd.read_csv(input_file_path)
-    data=data.replace(",",".")
-    data = data[data.iloc[:, 1] != 0]
-    
-
-    # 步骤2: 获取所有时间戳并转换为datetime对象
-    timestamps = data['Timestamp']
-    timestamps = [datetime.strptime(ts, '%Y-%m-%d %H:%M:%S.%f') for ts in timestamps]
-
-    # 初始化一个空的列表来保存新计算的时间戳
-    new_timestamps = []
-    
-    # 初始化起始点
-    start_index = 0
-
-    while start_index < len(timestamps) - 1:
-        start_timestamp = timestamps[start_index]
-        end_index = start_index + 1
-        
-        # 查找下一个不同的时间戳
-        while end_index < len(timestamps) and timestamps[end_index] == start_timestamp:
-            end_index += 1
-        
-        if end_index < len(timestamps):
-            end_timestamp = timestamps[end_index]
-            segment_length = end_index - start_index
-            interval = (end_timestamp - start_timestamp) / segment_length
-
-            # 为当前段生成新的时间戳
-            for i in range(segment_length):
-                new_timestamp = start_timestamp + i * interval
-                new_timestamps.append(new_timestamp)
-        
-        start_index = end_index
-    
-    # 添加最后一个时间戳
-    if len(new_timestamps) < len(timestamps):
-        new_timestamps.append(timestamps[-1])
-    
-   # 使用最后一个已知的时间间隔填充缺失的时间戳
-    while len(new_timestamps) < len(data) and interval is not None:
-        new_timestamp = new_timestamps[-1] + interval
-        new_timestamps.append(new_timestamp)
-
-    # 将datetime对象转换回字符串格式，精确到毫秒
-    new_timestamps_str = [t.strftime('%Y-%m-%d %H:%M:%S.%f') for t in new_timestamps]
-
-    # 步骤3: 使用新的时间戳更新DataFrame
-    data.loc[:, 'Timestamp'] = new_timestamps_str
+    data = read_recording(input_file_path)
+
+    # 步骤2+3: 时间戳均匀分布, 精确到微秒
+    data = emg_data_upsampling(data)
 
     # 步骤4: 保存修改后的数据到新的CSV文件
-    data.to_csv(output_file_path, index=False)
+    save_processed_csv(data, output_file_path)
 
     print(f"EMG_data: Timestamps have been equalized, and the file has been generated: {output_file_path}")
-
-
-
@@ -0,0 +1,240 @@
+import pickle
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# Sliding-window features of the integrated recordings (all modalities on the EMG grid).
+# The windows are the ones of sliding_window_view(array, window_size)[::stride]. Every
+# standard feature is a sum of per-sample terms over a window, so it is computed for all
+# windows at once from cumulative sums at the window borders (O(samples), no loop over windows
+# and no copy of the overlapping windows). The windows are processed in blocks to bound the memory.
+#
+# EMG / FMG   mav   mean absolute value
+#             rms   root mean square
+#             wl    waveform length (sum of |x[i+1] - x[i]|)
+#             zc    zero crossings, |x[i+1] - x[i]| >= zc_threshold
+#             ssc   slope sign changes, (x[i] - x[i-1]) * (x[i] - x[i+1]) > ssc_threshold
+#             var   variance (ddof=1)
+#             hist  number of samples in each of hist_bins bins between hist_range (outliers in the outer bins)
+# ACC / GYRO  mean, std
+
+TIME_DOMAIN_FEATURES = ('mav', 'rms', 'wl', 'zc', 'ssc', 'var', 'hist')
+IMU_FEATURES = ('mean', 'std')
+FEATURE_SETS = {'emg': TIME_DOMAIN_FEATURES, 'fmg': TIME_DOMAIN_FEATURES, 'acc': IMU_FEATURES, 'gyro': IMU_FEATURES}
+
+
+def sliding_windows(array, window_size, stride):
+    # (samples, channels) -> read-only view (windows, channels, window_size), nothing is copied
+    array = np.asarray(array)
+    if array.ndim == 1:
+        array = array.reshape(-1, 1)
+    if len(array) < window_size:
+        return np.empty((0, array.shape[1], window_size), dtype=array.dtype)
+    return sliding_window_view(array, window_size, axis=0)[::stride]
+
+
+def window_starts(n_samples, window_size, stride):
+    # first sample of every window of sliding_windows
+    if n_samples < window_size:
+        return np.empty(0, dtype=np.int64)
+    return np.arange(0, n_samples - window_size + 1, stride, dtype=np.int64)
+
+
+def window_sums(terms, starts, length):
+    """
+    Sums of terms[start:start + length] (along the first axis) for every start.
+    The sums between the sorted window borders come from one np.add.reduceat, their
+    cumulative sum gives every window as a difference, so every sample is added once.
+    """
+    terms = np.asarray(terms)
+    # counts (boolean terms) are summed as integers, which is faster and exact
+    dtype = np.int64 if terms.dtype.kind in 'bui' else np.float64
+    points, position = np.unique(np.concatenate((starts, starts + length)), return_inverse=True)
+    inner = points[points < len(terms)]
+    cumulative = np.zeros((len(points) + 1,) + terms.shape[1:], dtype=dtype)
+    if len(inner):
+        np.cumsum(np.add.reduceat(terms, inner, axis=0, dtype=dtype), axis=0, out=cumulative[1:len(inner) + 1])
+    return cumulative[position[len(starts):]] - cumulative[position[:len(starts)]]
+
+
+def window_counts(keys, n_keys, starts, length):
+    """
+    Number of samples with every key 0 .. n_keys - 1 in keys[start:start + length] (keys: (samples, channels) ints),
+    returns (windows, channels, n_keys). Same borders as window_sums, the counts between them come from one np.bincount.
+    """
+    samples, channels = keys.shape
+    points, position = np.unique(np.concatenate((starts, starts + length)), return_inverse=True)
+    inner = points[points < samples]
+    cumulative = np.zeros((len(points) + 1, channels, n_keys), dtype=np.int64)
+    if len(inner):
+        segment = np.repeat(np.arange(len(inner)), np.diff(np.append(inner, samples)))
+        flat = (segment[:, None] * channels + np.arange(channels)) * n_keys + keys[inner[0]:]
+        counts = np.bincount(flat.ravel(), minlength=len(inner) * channels * n_keys)
+        np.cumsum(counts.reshape(len(inner), channels, n_keys), axis=0, out=cumulative[1:len(inner) + 1])
+    return cumulative[position[len(starts):]] - cumulative[position[:len(starts)]]
+
+
+def histogram_range(values, width=3.0):
+    # default histogram range of every channel: mean +- width * std
+    mean = np.nanmean(values, axis=0)
+    std = np.nanstd(values, axis=0)
+    std = np.where(std > 0, std, 1.0)
+    return mean - width * std, mean + width * std
+
+
+def window_features(values, starts, window_size, feature_set=TIME_DOMAIN_FEATURES, zc_threshold=0.0,
+                    ssc_threshold=0.0, hist_bins=9, hist_range=None):
+    """
+    Computes the features of the windows values[start:start + window_size] of a (samples, channels) array.
+
+    Returns a float32 (windows, features) array and the feature names ('mav_0', 'hist_3_1', ...),
+    ordered by feature, then channel (then bin). Windows containing NaN samples get NaN features.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    starts = np.asarray(starts, dtype=np.int64)
+    length = window_size
+    channels = values.shape[1]
+
+    missing = np.isnan(values)
+    has_missing = missing.any()
+    if has_missing:
+        values = np.where(missing, 0.0, values)
+
+    columns = []
+    names = []
+
+    def add(name, feature):
+        columns.append(feature)
+        names.extend(f"{name}_{channel}" for channel in range(channels))
+
+    if {'mean', 'std', 'rms', 'var'} & set(feature_set):
+        sums = window_sums(values, starts, length)
+        squares = window_sums(values * values, starts, length)
+    diff = np.diff(values, axis=0) if {'wl', 'zc', 'ssc'} & set(feature_set) else None
+
+    for name in feature_set:
+        if name == 'mav':
+            add(name, window_sums(np.abs(values), starts, length) / length)
+        elif name == 'rms':
+            add(name, np.sqrt(squares / length))
+        elif name == 'var':
+            add(name, np.maximum(squares - sums * sums / length, 0.0) / max(length - 1, 1))
+        elif name == 'mean':
+            add(name, sums / length)
+        elif name == 'std':
+            add(name, np.sqrt(np.maximum(squares / length - (sums / length) ** 2, 0.0)))
+        elif name == 'wl':
+            add(name, window_sums(np.abs(diff), starts, length - 1))
+        elif name == 'zc':
+            crossings = (values[:-1] * values[1:] < 0) & (np.abs(diff) >= zc_threshold)
+            add(name, window_sums(crossings, starts, length - 1))
+        elif name == 'ssc':
+            # (x[i] - x[i-1]) * (x[i] - x[i+1]) of the samples 1 .. n-2, a window has length - 2 of them
+            changes = -diff[:-1] * diff[1:] > ssc_threshold
+            add(name, window_sums(changes, starts, length - 2))
+        elif name == 'hist':
+            low, high = histogram_range(values) if hist_range is None else hist_range
+            low = np.broadcast_to(np.asarray(low, dtype=np.float64), (channels,))
+            high = np.broadcast_to(np.asarray(high, dtype=np.float64), (channels,))
+            bins = np.floor((values - low) / np.where(high > low, high - low, 1.0) * hist_bins)
+            bins = np.clip(bins, 0, hist_bins - 1).astype(np.int64)
+            counts = window_counts(bins, hist_bins, starts, length)
+            for b in range(hist_bins):
+                add(f"hist_{b}", counts[:, :, b])
+        else:
+            raise ValueError(f"Unknown feature '{name}'.")
+
+    features = np.concatenate(columns, axis=1) if columns else np.empty((len(starts), 0))
+    if has_missing:
+        # features of windows with missing samples are NaN (per channel)
+        incomplete = window_sums(missing, starts, length) > 0
+        features[np.tile(incomplete, len(columns))] = np.nan
+    return features.astype(np.float32), names
+
+
+def extract_features(data_dict, window_size=500, stride=27, modalities=None, zc_threshold=0.0, ssc_threshold=0.0,
+                     hist_bins=9, hist_ranges=None, pure_windows=False, block_windows=4096):
+    """
+    Extracts the sliding-window features of an integrated data dict (as saved in the .mat files).
+
+    Parameters:
+    - data_dict: dict with 'stimulus', 'repetition' and the (samples, channels) arrays of the modalities.
+    - window_size, stride: window length and step in samples (config.yaml: emg_window_size, emg_strides).
+    - modalities: {name: feature set}, default FEATURE_SETS for all modalities with channels.
+    - zc_threshold, ssc_threshold, hist_bins: feature parameters.
+    - hist_ranges: {modality: (low, high)} of the histograms, default mean +- 3 std of the whole recording.
+    - pure_windows: keep only windows with one label and repetition.
+    - block_windows: windows per block (memory bound).
+
+    Returns a dict with 'features' float32 (windows, features), 'names', the 'labels' and 'repetition'
+    of the last sample of every window, the 'start' row of every window and the 'hist_ranges' used.
+    """
+    if modalities is None:
+        modalities = {key: feature_set for key, feature_set in FEATURE_SETS.items()
+                      if key in data_dict and np.asarray(data_dict[key]).ndim == 2 and np.asarray(data_dict[key]).shape[1]}
+    stimulus = np.asarray(data_dict['stimulus']).ravel()
+    repetition = np.asarray(data_dict.get('repetition', np.zeros(len(stimulus)))).ravel()
+    starts = window_starts(len(stimulus), window_size, stride)
+
+    hist_ranges = dict(hist_ranges or {})
+    for key, feature_set in modalities.items():
+        if 'hist' in feature_set and key not in hist_ranges:
+            hist_ranges[key] = histogram_range(np.asarray(data_dict[key], dtype=np.float64))
+
+    if pure_windows and len(starts):
+        changes = (np.diff(stimulus) != 0) | (np.diff(repetition) != 0)
+        starts = starts[window_sums(changes, starts, window_size - 1) == 0]
+
+    names = []
+    blocks = []
+    for first in range(0, max(len(starts), 1), block_windows):
+        block_starts = starts[first:first + block_windows]
+        if len(block_starts) == 0:
+            break
+        # only the samples covered by the windows of this block
+        begin, end = block_starts[0], block_starts[-1] + window_size
+        block = []
+        for key, feature_set in modalities.items():
+            features, feature_names = window_features(
+                np.asarray(data_dict[key][begin:end]), block_starts - begin, window_size, feature_set,
+                zc_threshold, ssc_threshold, hist_bins, hist_ranges.get(key))
+            block.append(features)
+            if first == 0:
+                names += [f"{key}_{name}" for name in feature_names]
+        blocks.append(np.concatenate(block, axis=1))
+
+    last = starts + window_size - 1
+    return {
+        'features': np.concatenate(blocks) if blocks else np.empty((0, len(names)), dtype=np.float32),
+        'names': names,
+        'labels': stimulus[last].astype(np.int32),
+        'repetition': repetition[last].astype(np.int32),
+        'start': starts,
+        'hist_ranges': hist_ranges,
+    }
+
+
+def save_model(model_file, model, feature_info, window_size, stride, modalities, feature_params):
+    """
+    Saves a trained classifier together with everything needed to compute its features again
+    (window, modalities, thresholds, histogram ranges, feature names), e.g. for the live classification.
+    """
+    artifact = {
+        'model': model,
+        'names': list(feature_info['names']),
+        'hist_ranges': feature_info['hist_ranges'],
+        'window_size': window_size,
+        'stride': stride,
+        'modalities': dict(modalities),
+        'feature_params': dict(feature_params),
+    }
+    with open(model_file, 'wb') as file:
+        pickle.dump(artifact, file)
+
+
+def load_model(model_file):
+    # Model artifact written by save_model
+    with open(model_file, 'rb') as file:
+        return pickle.load(file)
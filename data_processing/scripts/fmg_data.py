@@ -1,40 +1,80 @@
+import os
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
+from ingest import read_recording, save_processed_csv
 
 
 
 
 
-def swap_columns(csv_file, output_file,swap_table_file = '../data/swap_table.csv'):
-    # Read the CSV file into a pandas DataFrame
-    df = pd.read_csv(csv_file)
+def fsr_channel_permutation(columns, swap_table_file='../data/swap_table.csv'):
+    """
+    Composes the pairwise swaps of the swap table into one column permutation.
 
+    Returns a dict: FSR column in the output -> FSR column of the raw file whose data it gets.
+    """
     # Read the swap table (assumes two columns: "From" and "To")
     swap_table = pd.read_csv(swap_table_file, names=['From', 'To'], delimiter='-')
 
-    # Convert "From" and "To" to match the column names in the DataFrame
-    swap_table['From'] = swap_table['From'].apply(lambda x: f"FSR{x:02}")
-    swap_table['To'] = swap_table['To'].apply(lambda x: f"FSR{x:02}")
+    fsr_columns = [col for col in columns if col.startswith('FSR')]
+    mapping = {col: col for col in fsr_columns}
 
-    # Perform the swaps
-    for _, row in swap_table.iterrows():
-        from_col = row['From']
-        to_col = row['To']
+    # Apply the swaps one after another on the mapping instead of the data
+    for from_num, to_num in zip(swap_table['From'], swap_table['To']):
+        from_col = f"FSR{from_num:02}"
+        to_col = f"FSR{to_num:02}"
 
-        if from_col in df.columns and to_col in df.columns:
-            # Swap the columns
-            df[from_col], df[to_col] = df[to_col], df[from_col]
+        if from_col in mapping and to_col in mapping:
+            mapping[from_col], mapping[to_col] = mapping[to_col], mapping[from_col]
         else:
             print(f"Warning: Columns {from_col} or {to_col} not found in the CSV.")
+    return mapping
+
+
+def load_fmg_data(input_file_path, swap_table_file='../data/swap_table.csv'):
+    """
+    Reads a raw FMG CSV and applies the FSR channel remap while loading. The raw file is not changed.
+
+    Returns the remapped DataFrame and the applied mapping (output column -> raw column).
+    """
+    df = read_recording(input_file_path)
+    mapping = fsr_channel_permutation(df.columns, swap_table_file)
+
+    changed = {col: source for col, source in mapping.items() if col != source}
+    if changed:
+        df[list(changed)] = df[list(changed.values())].to_numpy()
+    return df, mapping
+
+
+def save_channel_mapping(mapping, output_file_path):
+    """
+    Writes the applied FSR mapping next to an output file as <output>_channel_map.csv.
+    """
+    mapping_file_path = os.path.splitext(output_file_path)[0] + '_channel_map.csv'
+    pd.DataFrame({'Channel': list(mapping), 'Source': list(mapping.values())}).to_csv(mapping_file_path, index=False)
+    return mapping_file_path
+
+
+def swap_columns(csv_file, output_file,swap_table_file = '../data/swap_table.csv'):
+    # Read the CSV file and apply the swaps of the swap table
+    df, mapping = load_fmg_data(csv_file, swap_table_file)
 
     # Save the modified DataFrame to a new CSV file
     df.to_csv(output_file, index=False)
     print(f"Swapped columns saved to {output_file}")
 
 
-def fmg_data_processing(input_file_path, emg_file_path, output_file_path):
+def fmg_data_preparation(data):
+    # In-memory stage: remapped raw FMG DataFrame -> DataFrame with the Windows timestamp first (datetime64)
+    data = data.drop(columns=["Timestamp"])
+    data = data.rename(columns={"Timestamp_win": "Timestamp"})
+    data['Timestamp'] = pd.to_datetime(data['Timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
+    cols = ['Timestamp'] + [col for col in data.columns if col != 'Timestamp']
+    return data[cols]
+
+
+def fmg_data_processing(input_file_path, emg_file_path, output_file_path, swap_table_file='../data/swap_table.csv'):
 
-    swap_columns(input_file_path,input_file_path)
     # 步骤1: 读取Timestamp_Log.csv，获取最后一条记录的日期
     #timestamp_log = pd.read_csv(emg_file_path)
     #first_log_timestamp_str = timestamp_log.iloc[1]['Timestamp']
@@ -42,7 +82,8 @@ def fmg_data_processing(input_file_path, emg_file_path, output_file_path):
 
     # 步骤2: 读取mqtt_data.csv文件
     ##file_path = 'C:/Users/HOU/Desktop/datamerge/2/mqtt_data.csv'
-    data = pd.read_csv(input_file_path)
+    # The FSR channels are remapped while loading, the raw file stays untouched
+    data, mapping = load_fmg_data(input_file_path, swap_table_file)
     data = data.drop(columns=["Timestamp"])
     data = data.rename(columns={"Timestamp_win": "Timestamp"})
 
@@ -69,9 +110,12 @@ def fmg_data_processing(input_file_path, emg_file_path, output_file_path):
 
     # 步骤4: 保存到新的CSV文件
     ##new_file_path = 'C:/Users/HOU/Desktop/datamerge/2_1/fmg_data_2.csv'
-    data.to_csv(output_file_path, index=False)
+    # Timestamp_win is recorded with millisecond precision and written the same way
+    save_processed_csv(data, output_file_path, 'ms')
+    save_channel_mapping(mapping, output_file_path)
 
     print(f"FMG_data：Updated file saved to: {output_file_path}")
+    return mapping
 
 # Example usage:
 if __name__ == "__main__":
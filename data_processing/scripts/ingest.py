@@ -0,0 +1,242 @@
+import os
+import numpy as np
+import pandas as pd
+from build_manifest import file_hash
+
+
+# Every recorded CSV is parsed only once. The parsed columns (timestamps as int64
+# nanoseconds, float columns as float32) are stored next to the CSV in a .npz bundle
+# together with the sha256, size and mtime of the CSV. The next read loads the bundle
+# instead of parsing the text again, a changed CSV (other hash) is parsed again. As in
+# build_manifest the CSV is only hashed if its size or mtime changed.
+
+CACHE_SUFFIX = '.cache.npz'
+# stored in every bundle, bundles of another version are parsed again
+CACHE_VERSION = 3
+# rows read to find the float columns, which are then parsed as float32 directly
+DTYPE_SAMPLE_ROWS = 1000
+
+# byte positions of the separators in 'YYYY-MM-DD HH:MM:SS[.fff[fff]]'
+TIMESTAMP_SEPARATORS = {4: b'-', 7: b'-', 13: b':', 16: b':'}
+# length of the written timestamps per unit
+TIMESTAMP_WIDTHS = {'s': 19, 'ms': 23, 'us': 26}
+
+
+def cache_path(csv_path):
+    return csv_path + CACHE_SUFFIX
+
+
+def days_from_civil(year, month, day):
+    # Days since 1970-01-01 for the proleptic Gregorian calendar (vectorized)
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def parse_fixed_timestamps(values):
+    """
+    Parses timestamp strings of the fixed format 'YYYY-MM-DD HH:MM:SS' with 0, 3 or 6
+    fraction digits (all strings of one length) directly from their bytes.
+    Returns datetime64[ns] or None if the strings do not have this format.
+    """
+    try:
+        chars = np.asarray(values).astype('S')
+    except (UnicodeEncodeError, ValueError, TypeError):
+        return None
+    length = chars.dtype.itemsize
+    if len(chars) == 0 or length not in (19, 23, 26):
+        return None
+
+    chars = chars.view(np.uint8).reshape(-1, length)
+    if (chars == 0).any():
+        return None  # shorter strings are padded with zero bytes
+    separators = dict(TIMESTAMP_SEPARATORS)
+    if length > 19:
+        separators[19] = b'.'
+    for position, separator in separators.items():
+        if (chars[:, position] != ord(separator)).any():
+            return None
+    if not np.isin(chars[:, 10], [ord(' '), ord('T')]).all():
+        return None
+
+    digit_positions = [i for i in range(length) if i not in separators and i != 10]
+    digits = chars[:, digit_positions].astype(np.int64) - ord('0')
+    if ((digits < 0) | (digits > 9)).any():
+        return None
+
+    def number(start, stop):
+        # value of the digits between the byte positions start and stop
+        result = np.zeros(len(chars), dtype=np.int64)
+        for i in range(start, stop):
+            result = result * 10 + (chars[:, i].astype(np.int64) - ord('0'))
+        return result
+
+    days = days_from_civil(number(0, 4), number(5, 7), number(8, 10))
+    seconds = ((days * 24 + number(11, 13)) * 60 + number(14, 16)) * 60 + number(17, 19)
+    fraction_ns = number(20, length) * 10 ** (9 - (length - 20)) if length > 19 else 0
+    return (seconds * 1000000000 + fraction_ns).astype('datetime64[ns]')
+
+
+def parse_timestamp_column(values):
+    # datetime64[ns] of a timestamp column, None if the column does not hold timestamps
+    timestamps = parse_fixed_timestamps(values)
+    if timestamps is not None:
+        return timestamps
+    try:
+        return pd.to_datetime(values, format='ISO8601').to_numpy(dtype='datetime64[ns]')
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_decimal_commas(values):
+    # Text column of numbers with a comma as decimal separator ("1,5" quoted in the CSV) -> float,
+    # None if the column holds other text
+    numbers = pd.to_numeric(values.str.replace(',', '.', regex=False), errors='coerce')
+    if numbers.isna().sum() != values.isna().sum():
+        return None
+    return numbers
+
+
+def parse_csv(csv_path, columns=None):
+    """
+    Parses a recorded CSV. Columns starting with 'Timestamp' become datetime64[ns]
+    (if they hold timestamps), float columns float32, integer columns keep their type.
+    Text columns of numbers with decimal commas are parsed as floats (no clean_csv needed).
+    With columns only these columns are parsed.
+    """
+    header = pd.read_csv(csv_path, nrows=0).columns
+    if columns is not None:
+        header = [col for col in header if col in set(columns)]
+    timestamp_columns = [col for col in header if col.startswith('Timestamp')]
+    usecols = header if columns is not None else None
+    dtype = {col: 'object' for col in timestamp_columns}
+    sample = pd.read_csv(csv_path, usecols=usecols, dtype=dtype, nrows=DTYPE_SAMPLE_ROWS)
+    float_dtype = dict(dtype, **{col: np.float32 for col in sample.select_dtypes(include='float64').columns})
+    try:
+        data = pd.read_csv(csv_path, usecols=usecols, dtype=float_dtype)
+    except ValueError:
+        # a float column with text further down (e.g. decimal commas), parsed below
+        data = pd.read_csv(csv_path, usecols=usecols, dtype=dtype)
+
+    for col in timestamp_columns:
+        timestamps = parse_timestamp_column(data[col].to_numpy())
+        # e.g. the microcontroller timestamp of the FMG is a number
+        data[col] = timestamps if timestamps is not None else pd.to_numeric(data[col], errors='coerce')
+
+    for col in data.columns:
+        if not col.startswith('Timestamp') and pd.api.types.is_string_dtype(data[col]) and data[col].notna().any():
+            numbers = parse_decimal_commas(data[col])
+            if numbers is not None:
+                data[col] = numbers
+
+    # integer columns of the sample with decimals further down and decimal comma columns
+    float_columns = data.select_dtypes(include='float64').columns
+    if len(float_columns):
+        data[float_columns] = data[float_columns].astype(np.float32)
+    return data
+
+
+def save_cache(data, csv_path, sha256, stat):
+    # One array per column in the .npz bundle, the column names and the hash, size and mtime of the CSV
+    arrays = {'__sha256': np.array(sha256), '__version': np.array(CACHE_VERSION),
+              '__size': np.array(stat.st_size), '__mtime': np.array(stat.st_mtime_ns),
+              '__columns': np.array(list(data.columns), dtype=str)}
+    for i, col in enumerate(data.columns):
+        values = data[col].to_numpy()
+        arrays[f'c{i}'] = values.astype(str) if values.dtype == object else values
+    np.savez(cache_path(csv_path), **arrays)
+
+
+def load_cache(csv_path, stat, columns=None):
+    # DataFrame from the .npz bundle, None if there is no bundle for this file content.
+    # The CSV is only hashed if its mtime changed but not its size (e.g. copied or touched).
+    # The arrays of the bundle are loaded lazily, so only the selected columns are read.
+    try:
+        with np.load(cache_path(csv_path)) as bundle:
+            if '__version' not in bundle or int(bundle['__version']) != CACHE_VERSION:
+                return None
+            if int(bundle['__size']) != stat.st_size:
+                return None
+            if int(bundle['__mtime']) != stat.st_mtime_ns and str(bundle['__sha256']) != file_hash(csv_path):
+                return None
+            stored = [str(col) for col in bundle['__columns']]
+            selected = set(stored if columns is None else columns)
+            arrays = {}
+            for i, col in enumerate(stored):
+                if col not in selected:
+                    continue
+                values = bundle[f'c{i}']
+                arrays[col] = values.astype(object) if values.dtype.kind == 'U' else values
+    except (OSError, KeyError, ValueError):
+        return None
+    return pd.DataFrame(arrays, columns=list(arrays))
+
+
+def select_time_range(data, time_range, margin=0):
+    """
+    Rows with start <= Timestamp <= end, None leaves a side open. margin keeps that many
+    rows before and after the range (the neighbours needed to align another recording).
+    """
+    if time_range is None or 'Timestamp' not in data or data['Timestamp'].dtype.kind != 'M':
+        return data
+    if not data['Timestamp'].is_monotonic_increasing:
+        data = data.sort_values('Timestamp', kind='stable').reset_index(drop=True)
+
+    start, end = time_range
+    timestamps = data['Timestamp'].to_numpy(dtype='datetime64[ns]')
+    first, last = 0, len(data)
+    if start is not None:
+        first = max(int(np.searchsorted(timestamps, pd.Timestamp(start).to_datetime64(), 'left')) - margin, 0)
+    if end is not None:
+        last = min(int(np.searchsorted(timestamps, pd.Timestamp(end).to_datetime64(), 'right')) + margin, len(data))
+    if first == 0 and last == len(data):
+        return data
+    return data.iloc[first:last].reset_index(drop=True)
+
+
+def read_recording(csv_path, use_cache=True, columns=None, time_range=None, margin=0):
+    """
+    Reads a recorded CSV (EMG, AUX, FMG, glove or processed _m.csv) into a DataFrame with
+    datetime64 timestamps and float32 values. With use_cache the parsed columns are taken
+    from the .npz bundle next to the CSV if it was written for the same file content.
+
+    columns: only these columns are loaded (the order of the file is kept).
+    time_range: (start, end) timestamps, only the rows in between (plus margin rows) are returned.
+    """
+    if not use_cache:
+        return select_time_range(parse_csv(csv_path, columns), time_range, margin)
+
+    stat = os.stat(csv_path)
+    data = load_cache(csv_path, stat, columns)
+    if data is None:
+        # the cache always holds the whole file
+        data = parse_csv(csv_path)
+        try:
+            save_cache(data, csv_path, file_hash(csv_path), stat)
+        except OSError as e:
+            print(f"Warning: Could not write the cache for {csv_path}: {e}")
+        if columns is not None:
+            data = data[[col for col in data.columns if col in set(columns)]]
+    return select_time_range(data, time_range, margin)
+
+
+def format_timestamps(timestamps, unit='us'):
+    # datetime64 -> 'YYYY-MM-DD HH:MM:SS.ffffff' ('us') or 'YYYY-MM-DD HH:MM:SS.fff' ('ms'), like strftime
+    width = TIMESTAMP_WIDTHS[unit]
+    iso = np.datetime_as_string(np.asarray(timestamps).astype(f'datetime64[{unit}]'), unit=unit)
+    chars = iso.astype(f'S{width}').view(np.uint8).reshape(-1, width).copy()
+    chars[:, 10] = ord(' ')  # replace the 'T' of the ISO format
+    return chars.view(f'S{width}').ravel().astype(f'U{width}')
+
+
+def save_processed_csv(data, output_file_path, timestamp_unit='us'):
+    """
+    Writes a processed recording (the _m.csv files) with its datetime64 'Timestamp' column in
+    the text format of the recorders, timestamp_unit 'us' (EMG, AUX) or 'ms' (FMG).
+    """
+    data = data.copy()
+    data['Timestamp'] = format_timestamps(data['Timestamp'].to_numpy(dtype='datetime64[ns]'), timestamp_unit)
+    data.to_csv(output_file_path, index=False)
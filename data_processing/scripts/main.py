@@ -1,11 +1,17 @@
 import os
-from aux_data import aux_data_processing
-from emg_data import emg_data_processing_upsampling
-from fmg_data import fmg_data_processing
-from data_integration import data_integration_processing_interpolate, data_integration_and_mat_conversion,merge_mat_files,mat_and_cuttoff
+import time
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from aux_data import aux_data_processing, aux_data_interpolation
+from emg_data import emg_data_processing_upsampling, emg_data_upsampling
+from fmg_data import fmg_data_processing, fmg_data_preparation, load_fmg_data, save_channel_mapping
+from data_integration import data_integration_processing_interpolate, data_integration_and_mat_conversion,merge_mat_files,mat_and_cuttoff,integrate_data,load_channel_map,save_integrated_data
 import scipy
 import numpy as np
 from scipy.io import loadmat, savemat
+from build_manifest import is_up_to_date, write_manifest
+from ingest import read_recording, save_processed_csv
 
 
 def merge_2_mat_files(mat_file_path1, mat_file_path2, output_file_path):
@@ -35,9 +41,37 @@ def merge_2_mat_files(mat_file_path1, mat_file_path2, output_file_path):
 
 
 
-def process_all_participants(input_base_folder, processing_base_folder, output_base_folder,sensors):
-    # Iterate through the numeric subfolders in the input base folder
-    for test_order in os.listdir(input_base_folder):
+def process_participant_in_memory(input_emg_file, input_aux_file, input_fmg_file, input_glove_file, final_output_file,
+                                  repetition_value, channel_map_file=None, intermediate_files=None):
+    """
+    Runs all processing stages in memory, from the raw recordings to the .mat file.
+
+    intermediate_files: optional (emg, aux, fmg) paths, the _m.csv files are only written if given (debugging).
+    """
+    # Step 1: Process EMG, AUX, and FMG data
+    emg_df = emg_data_upsampling(read_recording(input_emg_file))
+    aux_df = aux_data_interpolation(read_recording(input_aux_file))
+    fmg_df, mapping = load_fmg_data(input_fmg_file)
+    fmg_df = fmg_data_preparation(fmg_df)
+    glove_df = read_recording(input_glove_file)
+
+    if intermediate_files:
+        output_emg_file, output_aux_file, output_fmg_file = intermediate_files
+        save_processed_csv(emg_df, output_emg_file)
+        save_processed_csv(aux_df, output_aux_file)
+        save_processed_csv(fmg_df, output_fmg_file, 'ms')
+        save_channel_mapping(mapping, output_fmg_file)
+
+    # Step 2: Integrate data
+    data_dict = integrate_data(emg_df, aux_df, fmg_df, glove_df, repetition_value, load_channel_map(channel_map_file),
+                               fsr_mapping=mapping)
+    save_integrated_data(data_dict, final_output_file)
+
+
+def process_all_participants(input_base_folder, processing_base_folder, output_base_folder,sensors,in_memory=False,debug=False,parallel=False,max_workers=None,incremental=False,mat_format='v5'):
+    # Collect one task per participant and test order folder
+    tasks = []
+    for test_order in sorted(os.listdir(input_base_folder)):
         test_order_path = os.path.join(input_base_folder, test_order)
         
         # Ensure the folder name is numeric and it is a directory
@@ -48,12 +82,18 @@ def process_all_participants(input_base_folder, processing_base_folder, output_b
             os.makedirs(processing_folder, exist_ok=True)
             os.makedirs(output_folder, exist_ok=True)
 
-            # Process the files in this test order folder
-            process_files_in_test_order(test_order_path, processing_folder, output_folder, test_order,sensors)
+            tasks += collect_participant_tasks(test_order_path, processing_folder, output_folder, test_order,sensors,in_memory,debug,incremental,mat_format)
+
+    return run_tasks(tasks, parallel, max_workers)
         
 
 
-def process_files_in_test_order(test_order_path, processing_folder, output_folder, test_order,sensors):
+def process_files_in_test_order(test_order_path, processing_folder, output_folder, test_order,sensors,in_memory=False,debug=False,parallel=False,max_workers=None,incremental=False,mat_format='v5'):
+    tasks = collect_participant_tasks(test_order_path, processing_folder, output_folder, test_order,sensors,in_memory,debug,incremental,mat_format)
+    return run_tasks(tasks, parallel, max_workers)
+
+
+def collect_participant_tasks(test_order_path, processing_folder, output_folder, test_order,sensors,in_memory=False,debug=False,incremental=False,mat_format='v5'):
     # Collect participant numbers by matching file names
     participants = set()
     for file_name in os.listdir(test_order_path):
@@ -61,19 +101,66 @@ def process_files_in_test_order(test_order_path, processing_folder, output_folde
             participant_num = file_name.split('_P')[1].split('.')[0]  # Extract participant number
             participants.add(participant_num)
 
-    # Process each participant's files
-    for participant_num in participants:
+    # Sorted, so the tasks and their output paths do not depend on the directory listing
+    return [(test_order_path, processing_folder, output_folder, test_order, participant_num, sensors, in_memory, debug, incremental, mat_format)
+            for participant_num in sorted(participants)]
+
+
+def run_tasks(tasks, parallel=False, max_workers=None):
+    """
+    Processes all participant tasks, serially or in a process pool sized to the available cores.
+    Returns a summary with the status, time and error of every task.
+    """
+    start = time.perf_counter()
+    if parallel and len(tasks) > 1:
+        max_workers = max_workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+            results = list(executor.map(run_participant_task, tasks))
+    else:
+        results = [run_participant_task(task) for task in tasks]
+
+    summary = pd.DataFrame(results, columns=['test_order', 'participant', 'status', 'seconds', 'error'])
+    print_summary(summary, time.perf_counter() - start)
+    return summary
+
+
+def run_participant_task(task):
+    # Runs one task and catches its error, so one broken participant does not stop the others
+    test_order, participant_num = task[3], task[4]
+    start = time.perf_counter()
+    try:
+        status = process_participant(*task)
+        error = ''
+    except Exception as e:
+        status = 'error'
+        error = f"{type(e).__name__}: {e}"
+        print(f"Error processing participant {participant_num} in test order {test_order}: {e}")
+    return test_order, participant_num, status, time.perf_counter() - start, error
+
+
+def print_summary(summary, total_seconds):
+    print(f"\nProcessed {len(summary)} tasks in {total_seconds:.1f} s "
+          f"({(summary['status'] == 'done').sum()} done, {(summary['status'] == 'up-to-date').sum()} up-to-date, "
+          f"{(summary['status'] == 'skipped').sum()} skipped, "
+          f"{(summary['status'] == 'error').sum()} errors).")
+    if not summary.empty:
+        print(summary.to_string(index=False))
+
+
+def process_participant(test_order_path, processing_folder, output_folder, test_order, participant_num, sensors, in_memory=False, debug=False, incremental=False, mat_format='v5'):
         # Define file paths for each data type
         input_emg_file = os.path.join(test_order_path, f'emg_data_P{participant_num}.csv')
         input_aux_file = os.path.join(test_order_path, f'aux_data_P{participant_num}.csv')
         input_fmg_file = os.path.join(test_order_path, f'fmg_data_P{participant_num}.csv')
         input_glove_file = os.path.join(test_order_path, f'glove_data_P{participant_num}.csv')
+        channel_map_file = os.path.join(test_order_path, f'channel_map_P{participant_num}.yaml')
+        swap_table_file = '../data/swap_table.csv'
 
         # Ensure all required files exist for this participant
         if not (os.path.exists(input_emg_file) and os.path.exists(input_aux_file) and 
                 os.path.exists(input_fmg_file) and os.path.exists(input_glove_file)):
             print(f"Skipping participant {participant_num} in test order {test_order}: Missing required files.")
-            continue
+            return 'skipped'
 
         # Define intermediate and final output file paths
         output_emg_file = os.path.join(processing_folder, f'emg_data_P{participant_num}_m.csv')
@@ -83,28 +170,50 @@ def process_files_in_test_order(test_order_path, processing_folder, output_folde
         final_output_file = os.path.join(output_folder, f'final_data_P{participant_num}.mat')
         final_output_file_int = os.path.join(output_folder, f'interpolated_data_P{participant_num}.mat')
         final_output_file_cut = os.path.join(output_folder, f'cutted_data_P{participant_num}.mat')
-        # Perform the processing
-        try:
-            print(f"Processing participant {participant_num} in test order {test_order}...")
 
+        repetition_value=test_order
+        # Skip the participant if the inputs, parameters and code did not change since the last build
+        input_files = [input_emg_file, input_aux_file, input_fmg_file, input_glove_file, channel_map_file, swap_table_file]
+        # the processing path and the merge format are part of the build, switching them rebuilds the output
+        params = {'sensors': list(sensors), 'repetition': repetition_value, 'in_memory': in_memory, 'mat_format': mat_format}
+        if incremental and is_up_to_date(final_output_file, input_files, params):
+            print(f"Participant {participant_num} in test order {test_order} is up to date.")
+            return 'up-to-date'
+
+        # Perform the processing
+        print(f"Processing participant {participant_num} in test order {test_order}...")
+        if in_memory:
+            # Steps 1 and 2 without intermediate files (unless debugging)
+            intermediate_files = (output_emg_file, output_aux_file, output_fmg_file) if debug else None
+            process_participant_in_memory(input_emg_file, input_aux_file, input_fmg_file, input_glove_file, final_output_file,
+                                          repetition_value, channel_map_file, intermediate_files)
+        else:
             # Step 1: Process EMG, AUX, and FMG data
             emg_data_processing_upsampling(input_emg_file, output_emg_file)
             aux_data_processing(input_aux_file, output_aux_file)
-            fmg_data_processing(input_fmg_file, input_emg_file, output_fmg_file)
+            mapping = fmg_data_processing(input_fmg_file, input_emg_file, output_fmg_file)
 
             # Step 2: Integrate data
-            repetition_value=test_order
-            data_integration_and_mat_conversion(output_emg_file, output_aux_file, output_fmg_file, input_glove_file, final_output_file,sensors,repetition_value)
+            data_integration_and_mat_conversion(output_emg_file, output_aux_file, output_fmg_file, input_glove_file, final_output_file,sensors,repetition_value,channel_map_file,mapping)
            # data_integration_processing_interpolate(output_emg_file, output_aux_file, output_fmg_file, input_glove_file, final_output_file_int,sensors,repetition_value)
             #mat_and_cuttoff(output_emg_file, output_aux_file, output_fmg_file, input_glove_file, final_output_file_cut,repetition_value,cut_off)
 
-            print(f"Completed processing for participant {participant_num} in test order {test_order}.")
-            print(f"Completed processing for participant {participant_num} in test order {test_order}.")
+        write_manifest(final_output_file, input_files, params)
+        print(f"Completed processing for participant {participant_num} in test order {test_order}.")
+        return 'done'
 
-            
-    
-        except Exception as e:
-            print(f"Error processing participant {participant_num} in test order {test_order}: {e}")
+
+def merge_all_outputs(output_base_folder, final_data, interpolated_output_file, incremental=False, mat_format='v5'):
+    # Merges the .mat files of all test orders, skipped if none of them changed since the last merge
+    mat_files = sorted(os.path.join(root, file) for root, _, files in os.walk(output_base_folder)
+                       for file in files if file.endswith('.mat'))
+    params = {'final_data': final_data, 'interpolated_data': interpolated_output_file, 'mat_format': mat_format}
+    if incremental and is_up_to_date(final_data, mat_files, params):
+        print(f"Merged data in {final_data} is up to date.")
+        return
+    saved_files = merge_mat_files(output_base_folder, final_data, interpolated_output_file, mat_format)
+    if saved_files:
+        write_manifest(final_data, mat_files, params, saved_files)
 
 
 
@@ -140,7 +249,23 @@ def cut_mat(input,output,cutoff):
 cut_off=61
 Folder=4
 Pat=34
+in_memory=False # pass the data from stage to stage without _m.csv files (--in-memory)
+debug=False # write the intermediate _m.csv files in the in-memory mode (--debug)
+parallel=False # process participants and test orders in parallel processes (--parallel)
+max_workers=None # number of processes, None uses all cores (--workers)
+incremental=False # skip outputs whose inputs, parameters and code did not change, see build_manifest.py (--incremental)
+mat_format='v5' # format of the merged file, 'v7.3' for HDF5 without the 2 GB limit, needs h5py (--mat-format)
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Processes and integrates the recordings of all test orders and merges them.")
+    parser.add_argument("--in-memory", action="store_true", default=in_memory, help="Pass the data between the stages without _m.csv files.")
+    parser.add_argument("--debug", action="store_true", default=debug, help="Write the _m.csv files in the in-memory mode.")
+    parser.add_argument("--parallel", action="store_true", default=parallel, help="Process the participants in parallel processes.")
+    parser.add_argument("--workers", type=int, default=max_workers, help="Number of processes (default: all cores).")
+    parser.add_argument("--incremental", action="store_true", default=incremental, help="Only rebuild outputs whose inputs, parameters or code changed.")
+    parser.add_argument("--mat-format", choices=['v5', 'v7.3'], default=mat_format, help="Format of the merged file.")
+    args = parser.parse_args()
+    in_memory, debug, parallel, max_workers = args.in_memory, args.debug, args.parallel, args.workers
+    incremental, mat_format = args.incremental, args.mat_format
 
     input_base_folder = f'../data/input_data/P{Pat}'  # Input data folder with test order subfolders
     processing_base_folder = f'../data/processing_data/P{Pat}'  # Folder for intermediate processing files
@@ -152,7 +277,7 @@ if __name__ == "__main__":
 
     # Creates 2 Files (interpolated and not ) for every participant
 
-    process_all_participants(input_base_folder, processing_base_folder, output_base_folder,sensors)
+    process_all_participants(input_base_folder, processing_base_folder, output_base_folder,sensors,in_memory,debug,parallel,max_workers,incremental,mat_format)
    
 
     if 0: # cutting data
@@ -170,6 +295,6 @@ if __name__ == "__main__":
 
 
 
-    merge_mat_files(output_base_folder,final_data, interpolated_output_file)
+    merge_all_outputs(output_base_folder,final_data, interpolated_output_file, incremental, mat_format)
 
  
\ No newline at end of file
@@ -0,0 +1,141 @@
+import time
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+# Writer for MATLAB v7.3 .mat files. A v7.3 file is an HDF5 file with a 512 byte
+# MATLAB header in front, so it has no 2 GB limit per variable and the rows can be
+# appended chunk by chunk instead of building the whole dict in memory.
+# MATLAB stores matrices column-major, a (rows, columns) array is saved as an HDF5
+# dataset of shape (columns, rows) that grows along the second axis.
+# Needs h5py (pip install h5py), the v5 output through scipy.io.savemat does not.
+
+MATLAB_CLASSES = {
+    np.dtype(np.float64): 'double', np.dtype(np.float32): 'single',
+    np.dtype(np.int8): 'int8', np.dtype(np.int16): 'int16', np.dtype(np.int32): 'int32', np.dtype(np.int64): 'int64',
+    np.dtype(np.uint8): 'uint8', np.dtype(np.uint16): 'uint16', np.dtype(np.uint32): 'uint32', np.dtype(np.uint64): 'uint64',
+}
+
+def require_h5py():
+    if h5py is None:
+        raise ImportError("Writing MATLAB v7.3 files needs h5py (pip install h5py), or use mat_format='v5'.")
+
+
+def mat73_header():
+    # 116 bytes text, 8 bytes subsystem offset, version 0x0200 and endian indicator, padded to 128 bytes
+    text = f"MATLAB 7.3 MAT-file, Platform: GLNXA64, Created on: {time.strftime('%a %b %d %H:%M:%S %Y')} HDF5 schema 1.00 ."
+    return text.encode('ascii').ljust(116, b' ') + b'\x00' * 8 + b'\x00\x02' + b'IM'
+
+
+class Mat73Writer:
+    """
+    Writes a MATLAB v7.3 .mat file with chunked datasets that rows can be appended to.
+
+    Parameters:
+    - file_path: str, path of the .mat file, an existing file is replaced.
+    - compression: str or None, HDF5 compression of the datasets ('gzip', 'lzf' or None).
+    - chunk_rows: int, rows per HDF5 chunk.
+
+    Usage:
+    with Mat73Writer('final_data.mat') as writer:
+        for data_dict in sessions:
+            writer.append(data_dict)
+    """
+
+    def __init__(self, file_path, compression='gzip', chunk_rows=16384):
+        require_h5py()
+        self.file_path = file_path
+        self.compression = compression
+        self.chunk_rows = chunk_rows
+        self.file = h5py.File(file_path, 'w', userblock_size=512, libver='earliest', rdcc_nbytes=64 * 1024 * 1024)
+        self.rows = {}
+        self.columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, data_dict):
+        """
+        Appends the rows of every array of data_dict to the variable with the same key.
+        Variables with one row per dict (e.g. the frequency) get one row per appended file,
+        like the v5 merge.
+        """
+        for key, array in data_dict.items():
+            if key.startswith('__'):
+                continue
+            self.append_rows(key, array)
+
+    def append_rows(self, key, array):
+        array = np.asarray(array)
+        if array.ndim == 1:
+            array = array.reshape(-1, 1)
+        rows, columns = array.shape
+
+        if key not in self.rows:
+            self.rows[key] = 0
+            self.columns[key] = columns
+            if columns:
+                dataset = self.file.create_dataset(
+                    key, shape=(columns, 0), maxshape=(columns, None), dtype=array.dtype,
+                    chunks=(columns, self.chunk_rows), compression=self.compression,
+                )
+                dataset.attrs['MATLAB_class'] = np.bytes_(MATLAB_CLASSES[array.dtype])
+        elif columns != self.columns[key]:
+            raise ValueError(f"Key '{key}' has {columns} columns, expected {self.columns[key]}.")
+
+        if columns and rows:
+            dataset = self.file[key]
+            dataset.resize(self.rows[key] + rows, axis=1)
+            dataset[:, self.rows[key]:self.rows[key] + rows] = array.T
+        self.rows[key] += rows
+
+    def close(self):
+        if self.file is None:
+            return
+        # variables without columns are saved as MATLAB empty arrays (the dataset holds the dimensions)
+        for key, columns in self.columns.items():
+            if columns == 0:
+                dataset = self.file.create_dataset(key, data=np.array([self.rows[key], 0], dtype=np.uint64))
+                dataset.attrs['MATLAB_class'] = np.bytes_('double')
+                dataset.attrs['MATLAB_empty'] = np.uint8(1)
+        self.file.close()
+        self.file = None
+        with open(self.file_path, 'r+b') as file:
+            file.write(mat73_header())
+
+
+def save_mat73(file_path, data_dict, compression='gzip'):
+    # Whole dict in one go, same use as scipy.io.savemat
+    with Mat73Writer(file_path, compression) as writer:
+        writer.append(data_dict)
+
+
+def load_mat73(file_path, variable_names=None):
+    """
+    Reads the variables of a v7.3 .mat file back as (rows, columns) arrays.
+    """
+    require_h5py()
+    data = {}
+    with h5py.File(file_path, 'r') as file:
+        for key in variable_names or file.keys():
+            if key not in file:
+                continue
+            dataset = file[key]
+            if dataset.attrs.get('MATLAB_empty', 0):
+                data[key] = np.zeros(tuple(int(size) for size in dataset[()]), dtype=np.float64)
+            else:
+                data[key] = dataset[()].T
+    return data
+
+
+def is_mat73(file_path):
+    # True for v7.3 (HDF5) .mat files, False for v5 files
+    with open(file_path, 'rb') as file:
+        return file.read(10) == b'MATLAB 7.3'
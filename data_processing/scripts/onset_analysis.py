@@ -0,0 +1,174 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from segments import open_mat_arrays, load_segment_index, integrated_files
+
+
+# Latency between the label (stimulus) transitions and the physical onset in the signals.
+# For every transition of the segment index the samples around it are gathered from the
+# memory mapped .mat file as one (transitions, samples, channels) array per modality and
+# the onsets of all transitions and channels are detected at once:
+#   baseline    mean and std of every channel in the `baseline` seconds before the transition
+#   onset       first sample after the transition from which the signal stays more than
+#               `threshold` baseline stds away from the baseline mean for `min_duration` seconds
+# The onset of a modality is the earliest onset of its channels. EMG is analysed on its
+# envelope (centered moving mean of |emg| over `envelope` seconds, so its onsets are up to
+# envelope / 2 early), FMG and glove directly.
+
+MODALITIES = ('emg', 'fmg', 'glove')
+
+
+def label_transitions(index):
+    # segments whose label differs from the one of the segment before
+    index = index.reset_index(drop=True)
+    changed = index['label'].ne(index['label'].shift()) & (index.index > 0)
+    transitions = index[changed].copy()
+    transitions['from_label'] = index['label'].shift().loc[changed].astype(int)
+    transitions = transitions.rename(columns={'label': 'to_label', 'start': 'row'})
+    transitions['kind'] = np.where(transitions['from_label'] == 0, 'onset',
+                                   np.where(transitions['to_label'] == 0, 'release', 'change'))
+    return transitions[['row', 'from_label', 'to_label', 'repetition', 'kind']].reset_index(drop=True)
+
+
+def gather_windows(array, rows, before, after):
+    """
+    Rows row - before .. row + after - 1 around every row as (rows, before + after, channels) float64.
+    Samples outside of the array are NaN. Only these rows are read from a memory mapped array.
+    """
+    offsets = np.arange(-before, after)
+    index = np.asarray(rows)[:, None] + offsets
+    inside = (index >= 0) & (index < array.shape[0])
+    values = np.asarray(array[np.clip(index, 0, array.shape[0] - 1).ravel()], dtype=np.float64)
+    values = values.reshape(index.shape + (-1,))
+    values[~inside] = np.nan
+    return values
+
+
+def moving_mean(windows, width):
+    # centered moving mean along the samples, the result is width - 1 samples shorter
+    filled = np.nan_to_num(windows)
+    cumulative = np.concatenate((np.zeros_like(filled[:, :1]), np.cumsum(filled, axis=1)), axis=1)
+    return (cumulative[:, width:] - cumulative[:, :-width]) / width
+
+
+def detect_onsets(signal, before, threshold, min_samples):
+    """
+    signal: (transitions, samples, channels), the transition is at sample `before`.
+    Returns the onset (samples after the transition) of every transition and channel, -1 if none was found.
+    """
+    baseline = signal[:, :before]
+    mean = np.nanmean(baseline, axis=1, keepdims=True)
+    std = np.nanstd(baseline, axis=1, keepdims=True)
+    # a constant baseline (e.g. the glove at rest): every change is an onset
+    std = np.where(std > 0, std, np.finfo(np.float64).tiny)
+
+    with np.errstate(invalid='ignore'):
+        exceeds = np.abs(signal[:, before:] - mean) > threshold * std
+    # sustained: all min_samples samples from the onset on exceed the threshold
+    cumulative = np.concatenate((np.zeros_like(exceeds[:, :1], dtype=np.int64), np.cumsum(exceeds, axis=1)), axis=1)
+    sustained = (cumulative[:, min_samples:] - cumulative[:, :-min_samples]) == min_samples
+    found = sustained.any(axis=1)
+    return np.where(found, sustained.argmax(axis=1), -1)
+
+
+def modality_onsets(array, key, rows, before, after, threshold, min_samples, envelope_samples):
+    # onsets (transitions, channels) of one modality, EMG on its envelope
+    if key == 'emg':
+        half = max(int(round(envelope_samples)) // 2, 1)
+        signal = moving_mean(np.abs(gather_windows(array, rows, before + half, after + half)), 2 * half + 1)
+    else:
+        signal = gather_windows(array, rows, before, after)
+    return detect_onsets(signal, before, threshold, min_samples)
+
+
+def analyze_file(task):
+    """
+    Onset latencies of all label transitions of one integrated .mat file.
+    Returns a DataFrame with one row per transition and the latency (ms), the first channel
+    and the number of channels with an onset of every modality.
+    """
+    mat_file, baseline, search, threshold, min_duration, envelope, chunk = task
+    transitions = label_transitions(load_segment_index(mat_file))
+    transitions.insert(0, 'file', mat_file)
+    if transitions.empty:
+        return transitions
+
+    with open_mat_arrays(mat_file, ['frequency', 'timestamp'] + list(MODALITIES)) as arrays:
+        frequency = float(np.asarray(arrays['frequency']).ravel()[0]) if 'frequency' in arrays else 2000.0
+        rows = transitions['row'].to_numpy()
+        before, after = int(round(baseline * frequency)), int(round(search * frequency))
+        min_samples = max(int(round(min_duration * frequency)), 1)
+        timestamps = gather_windows(arrays['timestamp'], rows, 0, after)[:, :, 0]
+        transitions['time'] = timestamps[:, 0]
+
+        for key in MODALITIES:
+            if key not in arrays or arrays[key].shape[1] == 0:
+                continue
+            onsets = np.concatenate([
+                modality_onsets(arrays[key], key, rows[first:first + chunk], before, after, threshold, min_samples,
+                                envelope * frequency)
+                for first in range(0, len(rows), chunk)
+            ])
+
+            detected = onsets >= 0
+            found = detected.any(axis=1)
+            masked = np.where(detected, onsets, np.iinfo(np.int64).max)
+            channel = masked.argmin(axis=1)
+            onset_time = timestamps[np.arange(len(rows)), np.where(found, masked.min(axis=1), 0)]
+            transitions[f'{key}_latency_ms'] = np.where(found, ((onset_time - timestamps[:, 0]) * 1000).round(3), np.nan)
+            transitions[f'{key}_channel'] = np.where(found, channel, -1)
+            transitions[f'{key}_channels'] = detected.sum(axis=1)
+    return transitions
+
+
+def analyze_files(mat_files, output_file, baseline=0.5, search=2.0, threshold=3.0, min_duration=0.025, envelope=0.05,
+                  parallel=True, max_workers=None, chunk=128):
+    """
+    Onset latencies of all label transitions of all files, saved as one CSV table.
+
+    Parameters:
+    - mat_files: list of integrated .mat files.
+    - output_file: str, path of the CSV table.
+    - baseline: seconds before the transition for the baseline mean and std.
+    - search: seconds after the transition that are searched for the onset.
+    - threshold: distance from the baseline mean in baseline stds.
+    - min_duration: seconds the signal has to stay above the threshold.
+    - envelope: width of the EMG envelope in seconds.
+    - parallel, max_workers: one process per file (default: all cores).
+    - chunk: transitions analysed together (memory bound).
+    """
+    start = time.perf_counter()
+    tasks = [(mat_file, baseline, search, threshold, min_duration, envelope, chunk) for mat_file in mat_files]
+    if parallel and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count(), len(tasks))) as executor:
+            results = list(executor.map(analyze_file, tasks))
+    else:
+        results = [analyze_file(task) for task in tasks]
+    table = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    table.to_csv(output_file, index=False)
+    print(f"{len(table)} transitions of {len(mat_files)} files analysed in {time.perf_counter() - start:.1f} s, "
+          f"saved to {output_file}.")
+
+    latency_columns = [col for col in table.columns if col.endswith('_latency_ms')]
+    if latency_columns:
+        print(table.groupby('kind')[latency_columns].median().round(1).to_string())
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency between the label transitions and the onset in EMG, FMG and glove.")
+    parser.add_argument("mat_files", nargs="*", help="Integrated .mat files (default: all final_data_P*.mat in output_data).")
+    parser.add_argument("--output", default="../data/final_data/onset_latencies.csv", help="CSV table of the latencies.")
+    parser.add_argument("--threshold", type=float, default=3.0, help="Onset threshold in baseline standard deviations.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (default: all cores).")
+    args = parser.parse_args()
+
+    mat_files = args.mat_files or integrated_files('../data/output_data')
+    analyze_files(mat_files, args.output, threshold=args.threshold, max_workers=args.workers)
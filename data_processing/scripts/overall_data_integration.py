@@ -18,40 +18,127 @@ def initialize_csv(read_file_path,save_file_path):
     else:
         print(f"CSV file already exists at {save_file_path}")
 
+def read_header(file_path):
+    """
+    读取CSV文件的列头（只读第一行）。
+    """
+    return list(pd.read_csv(file_path, nrows=0).columns)
+
+
+def check_schema(input_file_paths, output_file_path=None):
+    """
+    在拼接之前检查所有CSV文件的列头是否一致（列名和顺序）。
+    如果输出文件已存在，它的列头也必须一致。不一致时抛出 ValueError。
+
+    参数:
+    input_file_paths -- 要拼接的CSV文件路径列表
+    output_file_path -- 已有的输出文件路径（可选）
+    返回:
+    共同的列头
+    """
+    if not input_file_paths:
+        raise ValueError("No CSV files to check.")
+    columns = read_header(input_file_paths[0])
+    files = list(input_file_paths[1:])
+    if output_file_path is not None and os.path.exists(output_file_path) and os.path.getsize(output_file_path):
+        files.append(output_file_path)
+
+    mismatches = []
+    for file_path in files:
+        other = read_header(file_path)
+        if other != columns:
+            missing = [col for col in columns if col not in other]
+            extra = [col for col in other if col not in columns]
+            mismatches.append(f"{file_path}: missing {missing}, extra {extra}" if missing or extra
+                              else f"{file_path}: different column order")
+    if mismatches:
+        raise ValueError(f"Columns do not match {input_file_paths[0]}:\n" + "\n".join(mismatches))
+    return columns
+
+
+def write_header(data_file_path, output_file):
+    """
+    把CSV文件的列头（第一行）写入已打开的输出文件。
+    """
+    with open(data_file_path, 'rb') as data_file:
+        output_file.write(data_file.readline().rstrip(b'\r\n') + b'\n')
+
+
+def copy_rows(data_file_path, output_file, chunk_size=1 << 20):
+    """
+    把CSV文件的数据行（不含列头）按块复制到已打开的输出文件，不解析数据。
+    """
+    with open(data_file_path, 'rb') as data_file:
+        data_file.readline()  # 跳过列头
+        last = b'\n'
+        for chunk in iter(lambda: data_file.read(chunk_size), b''):
+            output_file.write(chunk)
+            last = chunk[-1:]
+        if last != b'\n':
+            output_file.write(b'\n')
+
+
 def append_data_to_csv(data_file_path, output_file_path):
     """
     将新的CSV文件数据追加到已有的CSV文件。
+    只在文件末尾追加新数据，不再读取和重写已有的内容。
     
     参数:
     data_file_path -- 新的CSV数据文件的路径
     output_file_path -- 已有的CSV文件的路径，新数据将追加到这个文件
     """
-    # 读取新的CSV文件数据
-    new_data = pd.read_csv(data_file_path)
-    
-    # 检查新数据不为空
-    if not new_data.empty:
-        # 读取已有的CSV内容到DataFrame
-        if os.path.exists(output_file_path):
-            combined_csv = pd.read_csv(output_file_path)
-        else:
-            combined_csv = pd.DataFrame()
-        
-        # 追加新数据并保存
-        combined_csv = combined_csv._append(new_data, ignore_index=True)
-        combined_csv.to_csv(output_file_path, index=False)
+    check_schema([data_file_path], output_file_path)
+
+    # 追加新数据
+    with open(output_file_path, 'ab') as output_file:
+        if output_file.tell() == 0:
+            # 输出文件不存在或为空：先写列头
+            write_header(data_file_path, output_file)
+            print(f"Initialized CSV file with headers from {data_file_path} at {output_file_path}")
+        position = output_file.tell()
+        copy_rows(data_file_path, output_file)
+        appended = output_file.tell() > position
+    if appended:
         print(f"Appended data from {data_file_path} to {output_file_path}")
     else:
         print(f"No data to append from {data_file_path}")
 
+
+def concatenate_csv_files(input_file_paths, output_file_path):
+    """
+    把多个CSV文件流式拼接成一个文件：先检查列头，然后写一次列头，再按块复制每个文件的数据行。
+    内存占用与文件大小无关。先写入临时文件，完成后再替换输出文件，
+    所以重复运行不会重复追加数据，中断时也不会留下不完整的输出。
+
+    参数:
+    input_file_paths -- 要拼接的CSV文件路径列表（按顺序）
+    output_file_path -- 输出CSV文件的路径
+    """
+    if not input_file_paths:
+        raise ValueError(f"No input files to concatenate into {output_file_path}.")
+    check_schema(input_file_paths)
+
+    output_dir = os.path.dirname(output_file_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    temp_file_path = output_file_path + '.tmp'
+    with open(temp_file_path, 'wb') as output_file:
+        write_header(input_file_paths[0], output_file)
+        for data_file_path in input_file_paths:
+            copy_rows(data_file_path, output_file)
+            print(f"Appended data from {data_file_path} to {output_file_path}")
+    os.replace(temp_file_path, output_file_path)
+
+
 if __name__ == '__main__':
     participant_num = 2
     test_num = 6  #the rounds of the task
     output_file = f'../data/output_data/overall/all_data_P{participant_num}.csv'
+    input_files = []
     for i in range(1, test_num + 1):
         input_file = f'../data/output_data/{i}/integration_data_P{participant_num}_m.csv'
-        if i == 1:
-            initialize_csv(input_file,output_file)
-            pass
-        append_data_to_csv(input_file, output_file)
-    
\ No newline at end of file
+        if os.path.exists(input_file):
+            input_files.append(input_file)
+        else:
+            print(f"Skipping test {i}: {input_file} not found")
+    concatenate_csv_files(input_files, output_file)
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+
+# Resampling of the recordings (EMG ~2 kHz, AUX ~148 Hz, FMG ~100 Hz, glove 150 Hz)
+# onto one common time grid. All methods work on int64 nanosecond timestamps and
+# index arrays from np.searchsorted, so the memory stays linear in the output size.
+#
+# zoh       last sample at or before the grid time (same as pd.merge_asof), NaN before the first sample
+# nearest   closest sample in time
+# linear    linear interpolation between the two neighbouring samples
+# decimate  mean of all samples in the grid cell (boxcar anti-aliasing filter) for downsampling,
+#           cells without samples are interpolated linearly
+
+RESAMPLING_METHODS = ('zoh', 'nearest', 'linear', 'decimate')
+
+
+def to_ns(timestamps):
+    # datetime64 (or int64 ns) -> int64 nanoseconds
+    timestamps = np.asarray(timestamps)
+    if timestamps.dtype.kind == 'M':
+        return timestamps.astype('datetime64[ns]').astype(np.int64)
+    return timestamps.astype(np.int64)
+
+
+def target_grid(emg_timestamps, grid='emg'):
+    """
+    Returns the int64 ns timestamps of the target grid.
+
+    grid: 'emg' for the EMG timestamps themselves or a rate in Hz (e.g. 1000, or the rate of
+    a feature window step) for a fixed grid from the first to the last EMG sample.
+    """
+    emg_timestamps = to_ns(emg_timestamps)
+    if isinstance(grid, str):
+        if grid != 'emg':
+            raise ValueError(f"Unknown grid '{grid}', use 'emg' or a rate in Hz.")
+        return emg_timestamps
+    if len(emg_timestamps) == 0:
+        return emg_timestamps
+    step = int(round(1e9 / float(grid)))
+    return np.arange(emg_timestamps.min(), emg_timestamps.max() + 1, step, dtype=np.int64)
+
+
+def linear_weights(source, grid):
+    # Left neighbour and weight of the right neighbour for every grid time, held at the edges
+    right = np.clip(np.searchsorted(source, grid, 'right'), 1, len(source) - 1)
+    left = right - 1
+    span = (source[right] - source[left]).astype(np.float64)
+    weight = np.divide(grid - source[left], span, out=np.zeros(len(grid)), where=span > 0)
+    return left, np.clip(weight, 0.0, 1.0)
+
+
+def cell_edges(grid):
+    # Edges of the grid cells: midpoints between the grid times, half a step outside at the ends
+    if len(grid) == 1:
+        return np.array([grid[0], grid[0] + 1], dtype=np.int64)
+    middle = grid[:-1] + np.diff(grid) // 2
+    return np.concatenate(([grid[0] - (middle[0] - grid[0])], middle, [grid[-1] + (grid[-1] - middle[-1]) + 1]))
+
+
+def resample(timestamps, values, grid, method='linear'):
+    """
+    Resamples values (n, channels) sampled at timestamps onto the grid timestamps.
+    timestamps and grid are datetime64 or int64 ns and sorted. Returns (len(grid), channels) float32.
+    """
+    if method not in RESAMPLING_METHODS:
+        raise ValueError(f"Unknown resampling method '{method}', use one of {RESAMPLING_METHODS}.")
+    source = to_ns(timestamps)
+    grid = to_ns(grid)
+    values = np.asarray(values)
+    squeeze = values.ndim == 1
+    values = values.reshape(len(source), -1)
+    result = np.full((len(grid), values.shape[1]), np.nan, dtype=np.float32)
+    if len(source) == 0 or len(grid) == 0:
+        return result[:, 0] if squeeze else result
+
+    if method == 'zoh':
+        index = np.searchsorted(source, grid, 'right') - 1
+        valid = index >= 0
+        result[valid] = values[index[valid]]
+
+    elif method == 'nearest':
+        right = np.clip(np.searchsorted(source, grid, 'left'), 0, len(source) - 1)
+        left = np.clip(right - 1, 0, len(source) - 1)
+        index = np.where(np.abs(grid - source[left]) <= np.abs(source[right] - grid), left, right)
+        result[:] = values[index]
+
+    elif len(source) == 1:
+        result[:] = values[0]
+
+    else:
+        # linear interpolation, also the fallback of empty decimation cells
+        left, weight = linear_weights(source, grid)
+        weight = weight[:, None]
+        result[:] = values[left] * (1.0 - weight) + values[left + 1] * weight
+
+        if method == 'decimate':
+            edges = cell_edges(grid)
+            first = np.searchsorted(source, edges[:-1], 'left')
+            last = np.searchsorted(source, edges[1:], 'left')
+            counts = last - first
+            filled = counts > 0
+            if filled.any():
+                # sums of the cells with np.add.reduceat, the last filled cell ends at its own edge
+                starts = first[filled]
+                sums = np.add.reduceat(values.astype(np.float64), starts, axis=0)
+                sums[-1] = values[starts[-1]:last[filled][-1]].sum(axis=0, dtype=np.float64)
+                result[filled] = sums / counts[filled, None]
+
+    return result[:, 0] if squeeze else result
+
+
+def resample_frame(df, grid, method='linear', label_columns=('Action_Label',)):
+    """
+    Resamples all value columns of a recording DataFrame ('Timestamp' plus values) onto the grid.
+    Label columns are always taken with zero-order hold, labels are never interpolated.
+    Returns a DataFrame with the grid as datetime64[ns] 'Timestamp'.
+    """
+    timestamps = df['Timestamp'].to_numpy()
+    data = {'Timestamp': to_ns(grid).astype('datetime64[ns]')}
+    value_columns = [col for col in df.columns if col != 'Timestamp' and col not in label_columns]
+    if value_columns:
+        values = resample(timestamps, df[value_columns].to_numpy(dtype=np.float32), grid, method)
+        data.update({col: values[:, i] for i, col in enumerate(value_columns)})
+    for col in df.columns:
+        if col in label_columns:
+            labels = resample(timestamps, df[col].to_numpy(dtype=np.float32), grid, 'zoh')
+            data[col] = labels
+    return pd.DataFrame(data, columns=['Timestamp'] + [col for col in df.columns if col != 'Timestamp'])
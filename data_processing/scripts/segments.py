@@ -0,0 +1,185 @@
+import os
+import re
+import glob
+import mmap
+import struct
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from mat73 import is_mat73, require_h5py
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+# Segment index of the integrated .mat files: one row per contiguous run of the same
+# stimulus (and repetition) with its start and stop row, time range, label and repetition.
+# It is saved next to every output as <name>_segments.csv. get_segments() returns the
+# rows of selected segments without loading the whole file: uncompressed v5 files
+# (scipy.io.savemat) are memory mapped, v7.3 files are read partially through h5py.
+
+# data types of the MATLAB v5 format
+MAT5_DTYPES = {1: np.int8, 2: np.uint8, 3: np.int16, 4: np.uint16, 5: np.int32, 6: np.uint32,
+               7: np.float32, 9: np.float64, 12: np.int64, 13: np.uint64}
+MI_MATRIX = 14
+
+
+def integrated_files(output_base_folder='../data/output_data'):
+    # the .mat files written by main.py (<participant>/<test>/final_data_P{n}.mat), not the cut (_done, _f) files
+    return sorted(
+        path for path in glob.glob(os.path.join(output_base_folder, '**', 'final_data_P*.mat'), recursive=True)
+        if re.fullmatch(r'final_data_P\d+\.mat', os.path.basename(path))
+    )
+
+
+def segment_index_path(mat_file):
+    return os.path.splitext(mat_file)[0] + '_segments.csv'
+
+
+def build_segment_index(stimulus, repetition=None, timestamp=None, boundaries=None):
+    """
+    Returns the segment index DataFrame (label, repetition, start, stop, start_time, stop_time)
+    of the stimulus vector. stop is exclusive, the times are those of the first and last row.
+    boundaries: rows where a new segment always starts (e.g. the first row of every file of a merged file).
+    """
+    stimulus = np.asarray(stimulus).ravel()
+    n = len(stimulus)
+    repetition = np.zeros(n, dtype=np.int32) if repetition is None else np.asarray(repetition).ravel()
+
+    # a new segment starts where the label or the repetition changes
+    changes = (np.diff(stimulus) != 0) | (np.diff(repetition) != 0)
+    if boundaries is not None:
+        boundaries = np.asarray(boundaries, dtype=np.int64)
+        boundaries = boundaries[(boundaries > 0) & (boundaries < n)]
+        changes[boundaries - 1] = True
+    starts = np.concatenate(([0], np.flatnonzero(changes) + 1)) if n else np.array([], dtype=np.int64)
+    stops = np.append(starts[1:], n)
+
+    index = pd.DataFrame({
+        'label': stimulus[starts].astype(np.int64),
+        'repetition': repetition[starts].astype(np.int64),
+        'start': starts,
+        'stop': stops,
+    })
+    if timestamp is not None:
+        timestamp = np.asarray(timestamp).ravel()
+        index['start_time'] = timestamp[starts]
+        index['stop_time'] = timestamp[stops - 1]
+    return index
+
+
+def write_segment_index(mat_file, data_dict, boundaries=None):
+    # Builds the index from the stimulus, repetition and timestamp of an output and saves it next to the file
+    index = build_segment_index(data_dict['stimulus'], data_dict.get('repetition'), data_dict.get('timestamp'), boundaries)
+    index.to_csv(segment_index_path(mat_file), index=False)
+    return index
+
+
+def load_segment_index(mat_file):
+    # Loads the index of an output, it is built from the file (memory mapped) if it does not exist yet
+    index_file = segment_index_path(mat_file)
+    if os.path.exists(index_file):
+        return pd.read_csv(index_file)
+    with open_mat_arrays(mat_file, ['stimulus', 'repetition', 'timestamp']) as arrays:
+        data_dict = {key: np.asarray(value) for key, value in arrays.items()}
+    return write_segment_index(mat_file, data_dict)
+
+
+def read_element_tag(buffer, position):
+    # (data type, number of bytes, data position, next element position) of a v5 data element
+    mdtype, nbytes = struct.unpack_from('<II', buffer, position)
+    if mdtype >> 16:
+        # small data element format: type and size in the first 4 bytes, data in the next 4
+        return int(mdtype & 0xFFFF), int(mdtype >> 16), position + 4, position + 8
+    return int(mdtype), int(nbytes), position + 8, position + 8 + ((int(nbytes) + 7) // 8) * 8
+
+
+def mat5_layout(mat_file, variable_names=None):
+    """
+    Finds the numeric variables (all or variable_names) of an uncompressed v5 .mat file.
+    Returns {name: (dtype, (rows, columns), offset of the data in the file)}.
+    Only the element tags are read (the file is memory mapped), not the data.
+    """
+    with open(mat_file, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        if buffer[126:128] != b'IM':
+            raise ValueError(f"{mat_file} is not a little-endian v5 .mat file.")
+
+        layout = {}
+        position = 128
+        while position + 8 <= len(buffer):
+            mdtype, nbytes, data, next_element = read_element_tag(buffer, position)
+            if mdtype == MI_MATRIX:
+                # array flags, dimensions, name, real part
+                flags_type, _, flags_data, sub = read_element_tag(buffer, data)
+                array_class = buffer[flags_data] if flags_type else 0
+                _, dims_bytes, dims_data, sub = read_element_tag(buffer, sub)
+                dims = struct.unpack_from(f'<{dims_bytes // 4}i', buffer, dims_data)
+                _, name_bytes, name_data, sub = read_element_tag(buffer, sub)
+                name = buffer[name_data:name_data + name_bytes].decode('ascii')
+                if variable_names is None or name in variable_names:
+                    real_type, _, real_data, _ = read_element_tag(buffer, sub)
+                    # numeric classes 6 (double) to 15 (uint64), no complex arrays
+                    if 6 <= array_class <= 15 and real_type in MAT5_DTYPES and len(dims) == 2:
+                        layout[name] = (np.dtype(MAT5_DTYPES[real_type]).newbyteorder('<'), dims, real_data)
+            position = next_element
+    return layout
+
+
+class H5Rows:
+    # (rows, columns) view of a v7.3 dataset, only the selected rows are read
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.shape = dataset.shape[::-1]
+
+    def __getitem__(self, rows):
+        return self.dataset[:, rows].T
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.dataset[()].T, dtype=dtype)
+
+
+@contextmanager
+def open_mat_arrays(mat_file, variable_names=None):
+    """
+    Opens the variables of an integrated .mat file as (rows, columns) arrays without reading them,
+    use it as `with open_mat_arrays(mat_file) as arrays:`. v5 files give read-only np.memmap views,
+    v7.3 files H5Rows objects, the HDF5 file is closed at the end of the with block.
+    """
+    if is_mat73(mat_file):
+        require_h5py()
+        with h5py.File(mat_file, 'r') as file:
+            names = [name for name in (variable_names or file.keys()) if name in file]
+            yield {name: H5Rows(file[name]) for name in names if not file[name].attrs.get('MATLAB_empty', 0)}
+        return
+
+    arrays = {}
+    for name, (dtype, (rows, columns), offset) in mat5_layout(mat_file, variable_names).items():
+        if rows * columns == 0:
+            arrays[name] = np.zeros((rows, columns), dtype=dtype)
+            continue
+        # column-major data: the memmap has the shape (columns, rows), .T gives (rows, columns)
+        arrays[name] = np.memmap(mat_file, dtype=dtype, mode='r', offset=offset, shape=(columns, rows)).T
+    yield arrays
+
+
+def get_segments(mat_file, label=None, repetition=None, variable_names=None):
+    """
+    Returns the segments of an integrated .mat file with the given label and/or repetition
+    as a list of (segment index row, {variable: rows of the segment}). Only these rows are read.
+    Variables without one row per sample (frequency) are not included.
+    """
+    index = load_segment_index(mat_file)
+    rows = int(index['stop'].max()) if len(index) else 0
+    if label is not None:
+        index = index[index['label'] == label]
+    if repetition is not None:
+        index = index[index['repetition'] == repetition]
+
+    with open_mat_arrays(mat_file, variable_names) as arrays:
+        arrays = {name: array for name, array in arrays.items() if array.shape[0] == rows}
+        return [
+            (segment, {name: np.asarray(array[int(segment['start']):int(segment['stop'])]) for name, array in arrays.items()})
+            for _, segment in index.iterrows()
+        ]
@@ -0,0 +1,353 @@
+import os
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Synthetic measurement sessions in the formats of the recorders, for testing and benchmarking
+# the processing. Every session is written as input_data/P{n}/{test}/ (the test folder of
+# action.py and headless_session.py) with
+#   emg_data_P{n}.csv    Timestamp, 0 .. 15, Action_Label    record_emg3: one poll of the Trigno every
+#                        ~14 ms, all samples of a poll get the same millisecond timestamp, the label
+#                        is the one at the time of the poll, unused channels are 0.0
+#   aux_data_P{n}.csv    Timestamp, 0 .. 143                 same polls (and timestamps) as the EMG,
+#                        9 columns per sensor slot, ACC and GYRO in the first 6
+#   fmg_data_P{n}.csv    FSR01 .. FSR24, Timestamp, Timestamp_win    record_fmg: Arduino millis and
+#                        the receive time, idle FSRs at 3.292814016342163
+#   glove_data_P{n}.csv  Timestamp, Sensor0 .. Sensor17      record_cyberglove: 150 Hz, jittery sleeps
+# The labels follow blocks of rest and the actions 1 .. actions - 1, the signals react to
+# them after REACTION_TIME. Dropouts remove the samples of random intervals of a device,
+# clock skew (ppm) lets the clocks of the Trigno and the Arduino drift against the PC clock.
+#
+# The CSV lines are not formatted value by value: every value is quantized to a code of a
+# small table of preformatted tokens, the rows are assembled as byte matrices from these
+# tokens and the zero padding is dropped in one pass, so hours of data take seconds.
+
+EMG_RATE = 1925.925
+EMG_CHANNELS = 16
+EMG_POLL = 27  # samples per packet of the Trigno
+EMG_LSB = 1e-7  # volts per code
+AUX_RATE = 148.148
+AUX_CHANNELS = 144
+AUX_SLOT = 9  # AUX columns per sensor slot
+AUX_LSB = 1e-3
+FMG_RATE = 100
+FMG_CHANNELS = 24
+FMG_IDLE = 3.292814016342163  # value of a FSR without pressure (record_fmg.default_value)
+GLOVE_RATE = 150
+GLOVE_CHANNELS = 18
+REACTION_TIME = 0.25  # seconds from the label change to the movement
+
+
+def token_table(tokens):
+    # preformatted tokens -> (tokens, width) uint8 matrix padded with zero bytes
+    tokens = np.asarray(tokens, dtype=np.bytes_)
+    return tokens.view(np.uint8).reshape(len(tokens), tokens.dtype.itemsize)
+
+
+def float32_tokens(codes, lsb):
+    # the way pandas writes float32 values (shortest repr), e.g. '0.0001300684', '-3.4692137e-05'
+    return token_table([str(np.float32(code * lsb)) for code in codes])
+
+
+EMG_TOKENS = None
+AUX_TOKENS = None
+FMG_TOKENS = None
+INT_TOKENS = token_table([str(value) for value in range(256)])
+
+
+def tables():
+    # the float token tables are built once per process
+    global EMG_TOKENS, AUX_TOKENS, FMG_TOKENS
+    if EMG_TOKENS is None:
+        EMG_TOKENS = float32_tokens(np.arange(-32768, 32768), EMG_LSB)
+        AUX_TOKENS = float32_tokens(np.arange(-32768, 32768), AUX_LSB)
+        # 12 bit ADC values as written by record_fmg (float32 as Python float), the last one is idle
+        FMG_TOKENS = token_table([repr(float(np.float32(code * 3.3 / 4095))) for code in range(4096)]
+                                 + [repr(FMG_IDLE)])
+    return EMG_TOKENS, AUX_TOKENS, FMG_TOKENS
+
+
+def render_rows(columns):
+    """
+    Assembles CSV lines from token columns and returns them as bytes.
+
+    Parameters:
+    - columns: list of (token table, codes), codes is an int array with one code per row or one int for all rows.
+    """
+    rows = max(np.size(codes) for _, codes in columns)
+    # one record per line: every token is copied as one void scalar, the separators and the columns
+    # with one code for all rows are merged into constant fields
+    fields, values, constant = [], [], b''
+    for i, (table, codes) in enumerate(columns):
+        separator = b',' if i < len(columns) - 1 else b'\n'
+        if np.ndim(codes) == 0:
+            constant += table[codes].tobytes().rstrip(b'\0') + separator
+            continue
+        if constant:
+            fields.append(f'V{len(constant)}')
+            values.append(np.void(constant))
+        fields.append(f'V{table.shape[1]}')
+        values.append(table.view(f'V{table.shape[1]}').ravel()[codes])
+        constant = separator
+    if constant:
+        fields.append(f'V{len(constant)}')
+        values.append(np.void(constant))
+
+    lines = np.empty(rows, dtype=np.dtype([(f'f{i}', field) for i, field in enumerate(fields)]))
+    # filled in blocks of lines that stay in the cache while all fields are written
+    for first in range(0, rows, 4096):
+        block = lines[first:first + 4096]
+        for i, value in enumerate(values):
+            block[f'f{i}'] = value[first:first + 4096] if value.ndim else value
+    raw = lines.view(np.uint8)
+    return raw[raw != 0].tobytes()
+
+
+def timestamp_column(times_ms):
+    # int64 milliseconds since epoch -> token table of the distinct timestamps and their codes
+    unique, codes = np.unique(times_ms, return_inverse=True)
+    iso = np.datetime_as_string(unique.astype('datetime64[ms]'), unit='ms').astype(np.bytes_)
+    table = token_table(iso).copy()
+    table[:, 10] = ord(' ')  # '2024-05-01 10:00:00.020' as strftime(...)[:-3]
+    return table, codes
+
+
+def integer_column(values):
+    values = np.asarray(values, dtype=np.int64)
+    if values.min() >= 0 and values.max() < 256:
+        return INT_TOKENS, values
+    return token_table(values.astype(np.bytes_)), np.arange(len(values))
+
+
+def write_csv(file_path, header, chunks):
+    # chunks: iterable of token columns (see render_rows)
+    with open(file_path, 'wb') as file:
+        file.write((','.join(header) + '\n').encode())
+        for columns in chunks:
+            file.write(render_rows(columns))
+
+
+def label_schedule(duration, actions=5, rest_duration=2.0, action_duration=3.0):
+    """
+    Action_Label blocks: rest (0) and the actions 1 .. actions - 1 in turn.
+    Returns the start times (seconds) and labels of the blocks.
+    """
+    block_times, block_labels = [], []
+    t, action = 0.0, 0
+    while t < duration:
+        block_times.append(t)
+        block_labels.append(0)
+        t += rest_duration
+        if t >= duration:
+            break
+        block_times.append(t)
+        block_labels.append(action % (actions - 1) + 1)
+        t += action_duration
+        action += 1
+    return np.array(block_times), np.array(block_labels, dtype=np.int64)
+
+
+def labels_at(times, schedule):
+    # label of the block at every time (seconds), the first block before the start
+    block_times, block_labels = schedule
+    if len(block_times) == 0:
+        return np.zeros(len(times), dtype=np.int64)
+    return block_labels[np.clip(np.searchsorted(block_times, times, side='right') - 1, 0, None)]
+
+
+def dropout_mask(times, intervals):
+    # True for the times that are not inside one of the dropout intervals
+    keep = np.ones(len(times), dtype=bool)
+    for start, stop in intervals:
+        keep[np.searchsorted(times, start):np.searchsorted(times, stop)] = False
+    return keep
+
+
+def dropout_intervals(rng, duration, rate, mean_duration):
+    # rate dropouts per minute on average, exponential durations
+    count = rng.poisson(rate * duration / 60) if rate > 0 else 0
+    starts = np.sort(rng.uniform(0, duration, count))
+    return [(start, start + rng.exponential(mean_duration)) for start in starts]
+
+
+def write_session(folder, participant, duration, start='2024-05-01 10:00:00', sensors=6, aux_sensors=None,
+                  emg_rate=EMG_RATE, actions=5, rest_duration=2.0, action_duration=3.0, dropouts=0.0,
+                  dropout_duration=0.5, emg_skew=0.0, fmg_skew=0.0, seed=0, chunk=1 << 17):
+    """
+    Writes the four recordings of one synthetic session into folder.
+
+    Parameters:
+    - folder: str, test folder, e.g. '../data/input_data/P1/1'.
+    - participant: participant number of the file names.
+    - duration: seconds.
+    - start: PC time of the first sample.
+    - sensors: Trigno sensors with EMG (first EMG columns), aux_sensors: sensors with ACC and GYRO (default: sensors).
+    - emg_rate: EMG sampling rate, the AUX rate is AUX_RATE.
+    - actions, rest_duration, action_duration: label blocks (see label_schedule).
+    - dropouts: dropouts per minute and device, dropout_duration: their mean length in seconds.
+    - emg_skew, fmg_skew: drift of the Trigno and Arduino clocks against the PC clock in ppm.
+    - seed: random seed, chunk: rows per written block.
+    """
+    os.makedirs(folder, exist_ok=True)
+    emg_tokens, aux_tokens, fmg_tokens = tables()
+    aux_sensors = sensors if aux_sensors is None else aux_sensors
+    rng = np.random.default_rng(seed)
+    start_ms = np.datetime64(start.replace(' ', 'T'), 'ms').astype(np.int64)
+    schedule = label_schedule(duration, actions, rest_duration, action_duration)
+    # channel patterns of every label (0 = rest)
+    emg_pattern = np.vstack([np.zeros(EMG_CHANNELS), rng.uniform(0.2, 1.0, (actions - 1, EMG_CHANNELS))])
+    fmg_pattern = np.vstack([np.zeros(FMG_CHANNELS), rng.uniform(0, 1, (actions - 1, FMG_CHANNELS))
+                             * (rng.random((actions - 1, FMG_CHANNELS)) < 0.4)])
+    glove_rest = rng.integers(60, 140, GLOVE_CHANNELS)
+    glove_pattern = np.vstack([np.zeros(GLOVE_CHANNELS), rng.integers(-50, 100, (actions - 1, GLOVE_CHANNELS))])
+
+    # EMG and AUX: packets of EMG_POLL samples, received ~1-3 ms after the last sample on the PC clock
+    packets = int(duration * emg_rate) // EMG_POLL
+    packet_end = (np.arange(1, packets + 1) * EMG_POLL / emg_rate) * (1 + emg_skew * 1e-6)
+    receive = packet_end + rng.uniform(0.001, 0.003, packets)
+    keep = dropout_mask(packet_end, dropout_intervals(rng, duration, dropouts, dropout_duration))
+    packet_ms = start_ms + np.floor(np.maximum.accumulate(receive) * 1000).astype(np.int64)
+    packet_label = labels_at(receive, schedule)
+
+    kept = np.flatnonzero(keep)
+    emg_header = ['Timestamp'] + [str(i) for i in range(EMG_CHANNELS)] + ['Action_Label']
+
+    def emg_chunks():
+        for first in range(0, len(kept), max(chunk // EMG_POLL, 1)):
+            packet = np.repeat(kept[first:first + max(chunk // EMG_POLL, 1)], EMG_POLL)
+            sample = packet * EMG_POLL + np.tile(np.arange(EMG_POLL), len(packet) // EMG_POLL)
+            active = labels_at(sample / emg_rate - REACTION_TIME, schedule)
+            amplitude = 1e-5 + 2e-4 * emg_pattern[active][:, :sensors]
+            signal = rng.standard_normal((len(sample), sensors), dtype=np.float32) * amplitude.astype(np.float32)
+            codes = np.clip(np.rint(signal / EMG_LSB), -32767, 32767).astype(np.int64)
+            codes[codes == 0] = 1  # the processing drops rows with an exact 0.0 in the first channel
+            columns = [timestamp_column(packet_ms[packet])]
+            columns += [(emg_tokens, codes[:, c] + 32768) for c in range(sensors)]
+            columns += [(emg_tokens, 32768)] * (EMG_CHANNELS - sensors)
+            columns.append((INT_TOKENS, packet_label[packet]))
+            yield columns
+
+    write_csv(os.path.join(folder, f'emg_data_P{participant}.csv'), emg_header, emg_chunks())
+
+    # AUX samples of every packet: 2 or 3, the AUX clock runs with the EMG clock
+    aux_per_packet = np.diff(np.floor(np.arange(packets + 1) * EMG_POLL * AUX_RATE / emg_rate).astype(np.int64))
+    aux_packet = np.repeat(np.arange(packets), aux_per_packet)
+    aux_packet = aux_packet[keep[aux_packet]]
+    gravity = rng.normal(0, 0.3, (max(aux_sensors, 1), 3)) + [0, 0, -1]
+    aux_header = ['Timestamp'] + [str(i) for i in range(AUX_CHANNELS)]
+
+    def aux_chunks():
+        for first in range(0, len(aux_packet), chunk):
+            packet = aux_packet[first:first + chunk]
+            active = labels_at(packet_end[packet] - REACTION_TIME, schedule) > 0
+            columns = [timestamp_column(packet_ms[packet])]
+            for s in range(AUX_CHANNELS // AUX_SLOT):
+                if s < aux_sensors:
+                    acc = gravity[s] + rng.normal(0, 0.01, (len(packet), 3)) + 0.2 * active[:, None]
+                    gyro = rng.normal(0, 1.0, (len(packet), 3)) * (1 + 20 * active[:, None])
+                    codes = np.clip(np.rint(np.hstack([acc, gyro]) / AUX_LSB), -32768, 32767).astype(np.int64) + 32768
+                    columns += [(aux_tokens, codes[:, c]) for c in range(6)]
+                    columns += [(aux_tokens, 32768)] * (AUX_SLOT - 6)
+                else:
+                    columns += [(aux_tokens, 32768)] * AUX_SLOT
+            yield columns
+
+    write_csv(os.path.join(folder, f'aux_data_P{participant}.csv'), aux_header, aux_chunks())
+
+    # FMG: frames every 1 / FMG_RATE s of the Arduino clock, millis since its boot, receive time on the PC
+    frames = int(duration * FMG_RATE)
+    frame_time = np.arange(frames) / FMG_RATE * (1 + fmg_skew * 1e-6)
+    boot_ms = int(rng.integers(1000, 600000))
+    frame_keep = dropout_mask(frame_time, dropout_intervals(rng, duration, dropouts, dropout_duration))
+    frame = np.flatnonzero(frame_keep)
+    fmg_header = ['FSR{:02d}'.format(i) for i in range(1, FMG_CHANNELS + 1)] + ['Timestamp', 'Timestamp_win']
+
+    def fmg_chunks():
+        for first in range(0, len(frame), chunk):
+            index = frame[first:first + chunk]
+            pressure = fmg_pattern[labels_at(frame_time[index] - REACTION_TIME, schedule)]
+            voltage = FMG_IDLE - 2.5 * pressure + rng.normal(0, 0.01, pressure.shape)
+            codes = np.clip(np.rint(voltage * 4095 / 3.3), 0, 4095).astype(np.int64)
+            codes[pressure == 0] = 4096  # idle
+            receive_ms = start_ms + np.floor((frame_time[index] + rng.uniform(0.0005, 0.002, len(index))) * 1000)
+            millis = boot_ms + np.floor(index * 1000 / FMG_RATE).astype(np.int64)
+            columns = [(fmg_tokens, codes[:, c]) for c in range(FMG_CHANNELS)]
+            columns += [integer_column(millis), timestamp_column(receive_ms.astype(np.int64))]
+            yield columns
+
+    write_csv(os.path.join(folder, f'fmg_data_P{participant}.csv'), fmg_header, fmg_chunks())
+
+    # Glove: sleep based loop on the PC clock, every cycle a bit longer than 1 / GLOVE_RATE
+    cycles = int(duration * GLOVE_RATE)
+    glove_time = np.cumsum(np.full(cycles, 1 / GLOVE_RATE) + rng.exponential(0.0002, cycles)) - 1 / GLOVE_RATE
+    glove_time = glove_time[glove_time < duration]
+    glove_time = glove_time[dropout_mask(glove_time, dropout_intervals(rng, duration, dropouts, dropout_duration))]
+    glove_header = ['Timestamp'] + ['Sensor' + str(i) for i in range(GLOVE_CHANNELS)]
+
+    def glove_chunks():
+        for first in range(0, len(glove_time), chunk):
+            times = glove_time[first:first + chunk]
+            angles = glove_rest + glove_pattern[labels_at(times - REACTION_TIME, schedule)]
+            angles = np.clip(angles + rng.integers(-1, 2, angles.shape), 0, 255).astype(np.int64)
+            columns = [timestamp_column(start_ms + np.floor(times * 1000).astype(np.int64))]
+            columns += [(INT_TOKENS, angles[:, c]) for c in range(GLOVE_CHANNELS)]
+            yield columns
+
+    write_csv(os.path.join(folder, f'glove_data_P{participant}.csv'), glove_header, glove_chunks())
+
+
+def write_session_task(task):
+    folder, participant, duration, options = task
+    start = time.perf_counter()
+    write_session(folder, participant, duration, **options)
+    return folder, time.perf_counter() - start
+
+
+def generate_sessions(input_base_folder='../data/input_data', participants=(1,), tests=(1,), duration=300.0,
+                      start='2024-05-01 10:00:00', parallel=True, max_workers=None, seed=0, **options):
+    """
+    Writes a synthetic session for every participant and test as <input_base_folder>/P{n}/{test}.
+
+    The tests of a participant follow each other with a 5 minute break, the participants are a day apart.
+    The options are passed to write_session (sensors, dropouts, emg_skew, ...). Returns the session folders.
+    """
+    start_ms = np.datetime64(start.replace(' ', 'T'), 'ms')
+    tasks = []
+    for p, participant in enumerate(participants):
+        for t, test in enumerate(tests):
+            session_start = start_ms + np.timedelta64(p, 'D') + np.timedelta64(int(t * (duration + 300) * 1000), 'ms')
+            session_options = dict(options, start=str(session_start).replace('T', ' '),
+                                   seed=seed + 1000 * p + t)
+            tasks.append((os.path.join(input_base_folder, f'P{participant}', str(test)), participant, duration,
+                          session_options))
+
+    if parallel and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count(), len(tasks))) as executor:
+            results = list(executor.map(write_session_task, tasks))
+    else:
+        results = [write_session_task(task) for task in tasks]
+    for folder, seconds in results:
+        print(f"Synthetic session written to {folder} in {seconds:.1f} s.")
+    return [folder for folder, _ in results]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes synthetic sessions in the formats of the recorders.")
+    parser.add_argument("--output", default="../data/input_data", help="input_data folder.")
+    parser.add_argument("--participants", type=int, nargs="+", default=[1], help="Participant numbers.")
+    parser.add_argument("--tests", type=int, nargs="+", default=[1], help="Test numbers.")
+    parser.add_argument("--duration", type=float, default=300.0, help="Seconds per session.")
+    parser.add_argument("--sensors", type=int, default=6, help="Trigno sensors (EMG channels with data).")
+    parser.add_argument("--emg-rate", type=float, default=EMG_RATE, help="EMG sampling rate in Hz.")
+    parser.add_argument("--dropouts", type=float, default=0.0, help="Dropouts per minute and device.")
+    parser.add_argument("--dropout-duration", type=float, default=0.5, help="Mean dropout length in seconds.")
+    parser.add_argument("--emg-skew", type=float, default=0.0, help="Trigno clock drift in ppm.")
+    parser.add_argument("--fmg-skew", type=float, default=0.0, help="Arduino clock drift in ppm.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    generate_sessions(args.output, args.participants, args.tests, args.duration, seed=args.seed,
+                      sensors=args.sensors, emg_rate=args.emg_rate, dropouts=args.dropouts,
+                      dropout_duration=args.dropout_duration, emg_skew=args.emg_skew, fmg_skew=args.fmg_skew)
@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from build_manifest import is_up_to_date, write_manifest, file_hash
+from features import extract_features, save_model, FEATURE_SETS
+from segments import open_mat_arrays, integrated_files
+
+try:
+    from sklearn.ensemble import RandomForestClassifier
+except ImportError:
+    RandomForestClassifier = None
+
+
+# Training of the gesture classifier (random forest of config.yaml) on the integrated .mat files.
+# 1. per file: channel statistics for the histogram ranges and the window features, both cached
+#    next to the file (<name>_stats.json, <name>_features.npz) with a manifest, so a second run
+#    only computes the features of new or changed files (or after a change of the feature settings).
+#    The histogram ranges are fixed in <model>_hist_ranges.json and only computed again from all
+#    files on request (update_ranges), so a new file does not invalidate the other caches
+# 2. k-fold cross-validation split by repetition (all windows of a repetition are in the same fold,
+#    neighbouring windows overlap and would leak into the test fold otherwise), folds in parallel
+# 3. final model on all windows, saved with its feature settings (features.save_model) + metrics report
+
+FEATURES_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'features.py')
+
+
+def require_sklearn():
+    if RandomForestClassifier is None:
+        raise ImportError("Training the classifier needs scikit-learn (pip install scikit-learn).")
+
+
+def load_config(config_path):
+    with open(config_path, "r") as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+
+def training_modalities(config):
+    # the modalities that are available live: EMG (use_emg) and the IMU of the Trigno sensors (use_aux)
+    modalities = {}
+    if config.get('use_emg', True):
+        modalities['emg'] = FEATURE_SETS['emg']
+    if config.get('use_aux', True):
+        modalities['acc'] = FEATURE_SETS['acc']
+        modalities['gyro'] = FEATURE_SETS['gyro']
+    return modalities
+
+
+def feature_parameters(config):
+    return {
+        'zc_threshold': float(config.get('zc_threshold', 0.0)),
+        'ssc_threshold': float(config.get('ssc_threshold', 0.0)),
+        'hist_bins': int(config.get('hist_bins', 9)),
+    }
+
+
+def forest_parameters(config):
+    return {key: config[key] for key in ('n_estimators', 'max_depth', 'min_samples_split', 'min_samples_leaf',
+                                         'random_state', 'criterion') if key in config}
+
+
+def channel_stats(task):
+    """
+    Number of valid samples, sum and sum of squares of every channel (for the histogram ranges).
+    Cached in <name>_stats.json, the arrays are memory mapped and read in blocks.
+    """
+    mat_file, modalities, block_rows = task
+    stats_file = os.path.splitext(mat_file)[0] + '_stats.json'
+    params = {'modalities': sorted(modalities)}
+    if is_up_to_date(stats_file, [mat_file], params):
+        with open(stats_file, 'r') as file:
+            return json.load(file)
+
+    stats = {}
+    with open_mat_arrays(mat_file, list(modalities)) as arrays:
+        for key, array in arrays.items():
+            count = np.zeros(array.shape[1])
+            total = np.zeros(array.shape[1])
+            squares = np.zeros(array.shape[1])
+            for start in range(0, array.shape[0], block_rows):
+                block = np.asarray(array[start:start + block_rows], dtype=np.float64)
+                count += np.sum(~np.isnan(block), axis=0)
+                total += np.nansum(block, axis=0)
+                squares += np.nansum(block * block, axis=0)
+            stats[key] = [count.tolist(), total.tolist(), squares.tolist()]
+    with open(stats_file, 'w') as file:
+        json.dump(stats, file)
+    write_manifest(stats_file, [mat_file], params)
+    return stats
+
+
+def histogram_ranges(all_stats, modalities, width=3.0):
+    # mean +- width * std of every channel over all files, the same ranges are used live
+    ranges = {}
+    for key, feature_set in modalities.items():
+        if 'hist' not in feature_set:
+            continue
+        count, total, squares = (np.sum([np.asarray(stats[key][i]) for stats in all_stats], axis=0) for i in range(3))
+        count = np.maximum(count, 1)
+        mean = total / count
+        std = np.sqrt(np.maximum(squares / count - mean ** 2, 0.0))
+        std = np.where(std > 0, std, 1.0)
+        ranges[key] = ((mean - width * std).tolist(), (mean + width * std).tolist())
+    return ranges
+
+
+def file_features(task):
+    """
+    Window features of one integrated .mat file, cached in <name>_features.npz.
+    Returns the path of the cache file and whether the features were computed (False: taken from the cache).
+    """
+    mat_file, window_size, stride, modalities, params, hist_ranges, pure_windows = task
+    cache_file = os.path.splitext(mat_file)[0] + '_features.npz'
+    cache_params = {
+        'window_size': window_size, 'stride': stride, 'pure_windows': pure_windows,
+        'modalities': {key: list(feature_set) for key, feature_set in modalities.items()},
+        'feature_params': params, 'hist_ranges': {key: list(map(list, r)) for key, r in hist_ranges.items()},
+        'features_code': file_hash(FEATURES_MODULE),
+    }
+    if is_up_to_date(cache_file, [mat_file], cache_params):
+        return cache_file, False
+
+    with open_mat_arrays(mat_file, ['stimulus', 'repetition'] + list(modalities)) as data:
+        result = extract_features(data, window_size, stride, modalities, params['zc_threshold'], params['ssc_threshold'],
+                                  params['hist_bins'], hist_ranges, pure_windows)
+    np.savez(cache_file, features=result['features'], labels=result['labels'], repetition=result['repetition'],
+             start=result['start'], names=np.array(result['names']))
+    write_manifest(cache_file, [mat_file], cache_params)
+    return cache_file, True
+
+
+def repetition_folds(repetition, folds):
+    # test fold of every window: the repetitions are split into `folds` groups
+    repetitions = np.unique(repetition)
+    if len(repetitions) < folds:
+        raise ValueError(f"{folds} folds need at least {folds} repetitions, found {repetitions.tolist()}.")
+    fold_of_repetition = {rep: fold for fold, group in enumerate(np.array_split(repetitions, folds)) for rep in group}
+    return np.array([fold_of_repetition[rep] for rep in repetition], dtype=np.int32) if len(repetition) else repetition
+
+
+def classification_metrics(y_true, y_pred, classes):
+    # accuracy, confusion matrix (rows: true class) and precision / recall / f1 of every class
+    classes = np.asarray(classes)
+    confusion = np.zeros((len(classes), len(classes)), dtype=np.int64)
+    np.add.at(confusion, (np.searchsorted(classes, y_true), np.searchsorted(classes, y_pred)), 1)
+    true_positive = np.diag(confusion).astype(np.float64)
+    precision = np.divide(true_positive, confusion.sum(axis=0), out=np.zeros(len(classes)), where=confusion.sum(axis=0) > 0)
+    recall = np.divide(true_positive, confusion.sum(axis=1), out=np.zeros(len(classes)), where=confusion.sum(axis=1) > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(classes)), where=precision + recall > 0)
+    return {
+        'windows': int(len(y_true)),
+        'accuracy': float(true_positive.sum() / max(len(y_true), 1)),
+        'macro_f1': float(f1.mean()) if len(classes) else 0.0,
+        'classes': [int(label) for label in classes],
+        'precision': precision.tolist(),
+        'recall': recall.tolist(),
+        'f1': f1.tolist(),
+        'confusion': confusion.tolist(),
+    }
+
+
+def train_fold(task):
+    """
+    Trains and evaluates the forest of one fold. The training set is memory mapped from the
+    .npy files, so the processes do not get their own copy of it.
+    """
+    training_folder, fold, forest_params, n_jobs = task
+    features = np.load(os.path.join(training_folder, 'features.npy'), mmap_mode='r')
+    labels = np.load(os.path.join(training_folder, 'labels.npy'))
+    fold_of_window = np.load(os.path.join(training_folder, 'folds.npy'))
+    test = fold_of_window == fold
+
+    start = time.perf_counter()
+    model = RandomForestClassifier(n_jobs=n_jobs, **forest_params)
+    model.fit(features[~test], labels[~test])
+    predictions = model.predict(features[test])
+    metrics = classification_metrics(labels[test], predictions, np.unique(labels))
+    metrics.update({'fold': fold, 'train_windows': int((~test).sum()), 'seconds': time.perf_counter() - start})
+    return metrics
+
+
+def ranges_file_path(model_file):
+    return os.path.splitext(model_file)[0] + '_hist_ranges.json'
+
+
+def load_histogram_ranges(ranges_file, modalities):
+    # fixed histogram ranges of an earlier run, None if there are none for these modalities
+    try:
+        with open(ranges_file, 'r') as file:
+            content = json.load(file)
+    except (OSError, ValueError):
+        return None
+    keys = sorted(key for key, feature_set in modalities.items() if 'hist' in feature_set)
+    if sorted(content.get('ranges', {})) != keys:
+        return None
+    return {key: tuple(r) for key, r in content['ranges'].items()}
+
+
+def save_histogram_ranges(ranges_file, hist_ranges, mat_files):
+    with open(ranges_file, 'w') as file:
+        json.dump({'files': list(mat_files), 'ranges': {key: list(map(list, r)) for key, r in hist_ranges.items()}},
+                  file, indent=2)
+
+
+def train(mat_files, model_file, config, max_workers=None, pure_windows=True, update_ranges=False):
+    """
+    Cross-validates and trains the classifier of config.yaml on the integrated .mat files.
+
+    Parameters:
+    - mat_files: list of integrated .mat files (one per participant and test, not the merged files).
+    - model_file: str, path of the model artifact, the metrics are saved as <name>_metrics.json.
+    - config: dict, config.yaml (windows, folds, forest, use_emg/use_aux, build_model).
+    - max_workers: int, processes (default: all cores).
+    - pure_windows: bool, use only windows inside one segment (one label and repetition).
+    - update_ranges: bool, compute the histogram ranges again from all files, otherwise the ranges
+      of <model>_hist_ranges.json are used (computed once if the file does not exist).
+
+    Returns the metrics report.
+    """
+    require_sklearn()
+    start = time.perf_counter()
+    max_workers = max_workers or os.cpu_count()
+    window_size, stride = int(config['emg_window_size']), int(config['emg_strides'])
+    folds = int(config.get('folds', 2))
+    modalities = training_modalities(config)
+    params = feature_parameters(config)
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, max(len(mat_files), 1))) as executor:
+        # Step 1: histogram ranges (fixed unless update_ranges), then the features of every file
+        ranges_file = ranges_file_path(model_file)
+        hist_ranges = None if update_ranges else load_histogram_ranges(ranges_file, modalities)
+        if hist_ranges is None:
+            all_stats = list(executor.map(channel_stats, [(mat_file, modalities, 1 << 20) for mat_file in mat_files]))
+            hist_ranges = histogram_ranges(all_stats, modalities)
+            os.makedirs(os.path.dirname(ranges_file) or '.', exist_ok=True)
+            save_histogram_ranges(ranges_file, hist_ranges, mat_files)
+            print(f"Histogram ranges of {len(mat_files)} files saved to {ranges_file}.")
+        tasks = [(mat_file, window_size, stride, modalities, params, hist_ranges, pure_windows) for mat_file in mat_files]
+        cached = list(executor.map(file_features, tasks))
+    computed = sum(new for _, new in cached)
+    print(f"Features of {len(mat_files)} files ready ({computed} computed, {len(mat_files) - computed} from the cache).")
+
+    # Step 2: one training set on disk, windows with missing samples are left out
+    bundles = [np.load(cache_file) for cache_file, _ in cached]
+    names = [str(name) for name in bundles[0]['names']] if bundles else []
+    features = np.concatenate([bundle['features'] for bundle in bundles]) if bundles else np.empty((0, 0), np.float32)
+    labels = np.concatenate([bundle['labels'] for bundle in bundles]) if bundles else np.empty(0, np.int32)
+    repetition = np.concatenate([bundle['repetition'] for bundle in bundles]) if bundles else np.empty(0, np.int32)
+    valid = ~np.isnan(features).any(axis=1)
+    features, labels, repetition = features[valid], labels[valid], repetition[valid]
+    if len(labels) == 0:
+        raise ValueError("No complete feature windows found in the input files.")
+
+    training_folder = os.path.splitext(model_file)[0] + '_training'
+    os.makedirs(training_folder, exist_ok=True)
+    np.save(os.path.join(training_folder, 'features.npy'), features)
+    np.save(os.path.join(training_folder, 'labels.npy'), labels)
+    np.save(os.path.join(training_folder, 'folds.npy'), repetition_folds(repetition, folds))
+
+    # Step 3: the folds in parallel, the cores are shared between them
+    forest_params = forest_parameters(config)
+    workers = min(max_workers, folds)
+    fold_tasks = [(training_folder, fold, forest_params, max(1, max_workers // workers)) for fold in range(folds)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        fold_metrics = list(executor.map(train_fold, fold_tasks))
+    for metrics in fold_metrics:
+        print(f"Fold {metrics['fold'] + 1}/{folds}: accuracy {metrics['accuracy']:.3f}, macro F1 {metrics['macro_f1']:.3f}")
+
+    report = {
+        'files': list(mat_files),
+        'windows': int(len(labels)),
+        'features': len(names),
+        'repetitions': sorted(int(rep) for rep in np.unique(repetition)),
+        'folds': fold_metrics,
+        'mean_accuracy': float(np.mean([metrics['accuracy'] for metrics in fold_metrics])),
+        'mean_macro_f1': float(np.mean([metrics['macro_f1'] for metrics in fold_metrics])),
+        'forest': forest_params,
+        'window_size': window_size,
+        'stride': stride,
+        'feature_params': params,
+    }
+
+    # Step 4: final model on all windows
+    output_dir = os.path.dirname(model_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if config.get('build_model', True):
+        model = RandomForestClassifier(n_jobs=max_workers, **forest_params)
+        model.fit(features, labels)
+        save_model(model_file, model, {'names': names, 'hist_ranges': hist_ranges}, window_size, stride, modalities, params)
+        report['model_file'] = model_file
+        print(f"Model saved to {model_file}.")
+
+    report['seconds'] = time.perf_counter() - start
+    metrics_file = os.path.splitext(model_file)[0] + '_metrics.json'
+    with open(metrics_file, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Metrics saved to {metrics_file} (mean accuracy {report['mean_accuracy']:.3f}, {report['seconds']:.1f} s).")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the gesture classifier on the integrated .mat files.")
+    parser.add_argument("mat_files", nargs="*", help="Integrated .mat files (default: all final_data_P*.mat in output_data).")
+    parser.add_argument("--config", default="../../config.yaml", help="Path to config.yaml.")
+    parser.add_argument("--model", default="../data/models/gesture_model.pkl", help="Path of the model artifact.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes (default: all cores).")
+    parser.add_argument("--update-ranges", action="store_true",
+                        help="Compute the histogram ranges again from all files (recomputes all features).")
+    args = parser.parse_args()
+
+    mat_files = args.mat_files or integrated_files('../data/output_data')
+    train(mat_files, args.model, load_config(args.config), args.workers, update_ranges=args.update_ranges)
@@ -0,0 +1,157 @@
+import threading
+import time
+import record_emg3 as emg
+import record_fmg as fmg
+import record_cyberglove as glove
+
+
+# Connects all devices at the same time instead of one after another. Every device
+# thread waits on a common barrier until its device delivered the first valid sample,
+# afterwards one common start instant is set in all recorders. Until then the start
+# instant is NOT_STARTED, so the recorders drop every warm-up sample and all files
+# start at the same time. Devices that are not ready when the barrier breaks are
+# stopped and left out of the session.
+
+NOT_STARTED = float('inf')
+
+
+def _bring_up_fmg(participant_num, test_order, config_path, devices, barrier, timeout):
+    fmg.session_start_time = NOT_STARTED
+    threading.Thread(target=fmg.read_serial, daemon=True).start()
+    fmg.start_recording(participant_num, test_order)
+    devices['fmg'] = True
+    if not fmg.fmg_ready_event.wait(timeout):
+        raise TimeoutError("No FMG frame received.")
+    barrier.wait()
+
+
+def _bring_up_emg(participant_num, test_order, config_path, devices, barrier, timeout):
+    emg_recorder = emg.EMGRecorder(config_path)
+    emg_recorder.session_start_time = NOT_STARTED
+    devices['emg'] = emg_recorder
+    emg_recorder.start_recording()
+    emg_recorder.update_participant_action(participant_num, 0)
+    if not emg_recorder.ready_event.wait(timeout):
+        raise TimeoutError("No EMG sample received.")
+    barrier.wait()
+
+
+def _bring_up_glove(participant_num, test_order, config_path, devices, barrier, timeout):
+    glove.session_start_time = NOT_STARTED
+    glove_recorder = glove.initialize_cyberglove()
+    devices['glove'] = glove_recorder
+    glove.start_recording_thread(glove_recorder)
+    if not glove.glove_ready_event.wait(timeout):
+        raise TimeoutError("No CyberGlove sample received.")
+    barrier.wait()
+
+
+BRING_UP_FUNCTIONS = {
+    'emg': _bring_up_emg,
+    'fmg': _bring_up_fmg,
+    'glove': _bring_up_glove,
+}
+
+
+def _is_ready(name, devices):
+    if name == 'emg':
+        return devices['emg'].ready_event.is_set()
+    if name == 'fmg':
+        return fmg.fmg_ready_event.is_set()
+    return glove.glove_ready_event.is_set()
+
+
+def _stop_device(name, devices):
+    # stops a device that was started but never got ready, nothing of it is saved
+    device = devices.pop(name)
+    try:
+        if name == 'emg':
+            device.stop_event.set()
+            for reader in device.group_readers:
+                reader.stop()
+        elif name == 'fmg':
+            fmg.stop_recording()
+        else:
+            glove.is_recording = False
+            device.stop()
+    except Exception as e:
+        print(f"Error stopping {name}: {str(e)}")
+
+
+def bring_up_devices(participant_num, test_order, config_path="config.yaml", device_names=('emg', 'fmg', 'glove'), timeout=10):
+    """
+    Connects the selected devices in parallel and waits until each one delivered its first sample.
+
+    Parameters
+    ----------
+    participant_num : int
+        Number of the participant.
+    test_order : str
+        Folder of the test below input_data, e.g. 'P1/1'.
+    config_path : str
+        Path to the sensor config file of the EMG recorder.
+    device_names : tuple
+        Devices to start ('emg', 'fmg', 'glove').
+    timeout : float
+        Seconds to wait for all devices to be ready.
+
+    Returns
+    ----------
+    devices : dict
+        'emg' -> EMGRecorder, 'glove' -> CyberGlove, 'fmg' -> True for every started device.
+    start_time : float
+        Common start instant (time.time()) of the session.
+    """
+    devices = {}
+    errors = {}
+    # one party per device plus the calling thread
+    barrier = threading.Barrier(len(device_names) + 1)
+    lock = threading.Lock()
+    bring_up_done = threading.Event()
+    session = {}  # devices that are ready when the barrier is released or broken
+
+    def run(name):
+        try:
+            BRING_UP_FUNCTIONS[name](participant_num, test_order, config_path, devices, barrier, timeout)
+        except threading.BrokenBarrierError:
+            pass
+        except Exception as e:
+            errors[name] = e
+            barrier.abort()
+        # a device that connected after the bring-up ended is not part of the session
+        with lock:
+            if bring_up_done.is_set() and name in devices and name not in session:
+                _stop_device(name, devices)
+
+    bring_up_start = time.perf_counter()
+    threads = [threading.Thread(target=run, args=(name,), daemon=True) for name in device_names]
+    for thread in threads:
+        thread.start()
+
+    try:
+        barrier.wait(timeout=timeout + 5)
+    except threading.BrokenBarrierError:
+        for name, error in errors.items():
+            print(f"Bring-up of {name} failed: {str(error)}")
+        print("Not all devices are ready. Recording starts without them.")
+
+    # the device threads may still be connecting, only devices that delivered a sample remain
+    with lock:
+        for name in list(devices):
+            if _is_ready(name, devices):
+                session[name] = devices[name]
+            else:
+                _stop_device(name, devices)
+        bring_up_done.set()
+
+    # common start instant for all recorders
+    start_time = time.time()
+    if 'fmg' in session:
+        fmg.session_start_time = start_time
+    if 'glove' in session:
+        glove.session_start_time = start_time
+    if 'emg' in session:
+        session['emg'].session_start_time = start_time
+
+    print(f"Devices {list(session)} ready after {time.perf_counter() - bring_up_start:.2f} s.")
+    return session, start_time
@@ -0,0 +1,153 @@
+import argparse
+import time
+import yaml
+import record_fmg as fmg
+import record_cyberglove as glove
+from device_bringup import bring_up_devices
+
+
+# Runs a measurement without the Tkinter GUI. The actions, durations, rest periods
+# and repetitions are read from a protocol file (see protocol.yaml), the devices are
+# the same recorders that action.py uses and the files end up in the same folders.
+
+
+def load_protocol(protocol_path):
+    """
+    Loads a protocol file and fills in the default values.
+    """
+    with open(protocol_path, "r") as file:
+        protocol = yaml.load(file, Loader=yaml.FullLoader)
+
+    protocol.setdefault('devices', ['emg', 'fmg', 'glove'])
+    protocol.setdefault('initial_rest', 0.0)
+    protocol.setdefault('cycles', 1)
+    for block in protocol['blocks']:
+        block.setdefault('rest', 0.0)
+        block.setdefault('repetitions', 1)
+        if int(block['action']) <= 0:
+            raise ValueError(f"Invalid action number {block['action']} in protocol. Actions start from 1.")
+    return protocol
+
+
+def build_schedule(protocol):
+    """
+    Turns the protocol into a list of (start offset in seconds, action label) steps.
+    The last step sets the label back to 0 and marks the end of the session.
+    """
+    schedule = []
+    offset = float(protocol['initial_rest'])
+    for _ in range(int(protocol['cycles'])):
+        for block in protocol['blocks']:
+            for _ in range(int(block['repetitions'])):
+                schedule.append((offset, int(block['action'])))
+                offset += float(block['duration'])
+                schedule.append((offset, 0))
+                offset += float(block['rest'])
+    schedule.append((offset, 0))
+    return schedule
+
+
+def sleep_until(deadline):
+    """
+    Sleeps until time.perf_counter() reaches the deadline. Deadlines are absolute, so
+    the error of one step does not add up over a long session.
+    """
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return
+        # sleep coarse first and spin for the last millisecond
+        time.sleep(remaining - 0.001 if remaining > 0.002 else 0)
+
+
+class HeadlessSession:
+    """
+    Drives the EMG, FMG and CyberGlove recorders from a protocol instead of the GUI.
+    """
+
+    def __init__(self, protocol, participant_num, test_number, config_path="config.yaml"):
+        self.protocol = protocol
+        self.participant_num = participant_num
+        self.test_number = test_number
+        # same folder layout as action.py: input_data/P{n}/{test}
+        self.test_order = f'P{participant_num}/{test_number}'
+        self.config_path = config_path
+        self.devices = set(protocol['devices'])
+        self.session_devices = {}  # devices that came up, only these are driven and stopped
+        self.emg_recorder = None
+        self.glove_recorder = None
+
+    def start_devices(self):
+        """
+        Starts all devices selected in the protocol in parallel and waits for their first sample.
+        """
+        device_names = [name for name in ('emg', 'fmg', 'glove') if name in self.devices]
+        self.session_devices, start_time = bring_up_devices(self.participant_num, self.test_order, self.config_path, device_names)
+        self.emg_recorder = self.session_devices.get('emg')
+        self.glove_recorder = self.session_devices.get('glove')
+        return start_time
+
+    def set_action(self, action_num):
+        """
+        Sets the action label of all recorders that store a label.
+        """
+        if self.emg_recorder:
+            self.emg_recorder.update_participant_action(self.participant_num, action_num)
+
+    def stop_devices(self):
+        """
+        Stops the devices of the session and saves the data, same order as quit_program in action.py.
+        """
+        try:
+            if 'fmg' in self.session_devices:
+                fmg.stop_recording()
+                print("FMG recording stopped.")
+                time.sleep(1)
+            if self.emg_recorder:
+                self.emg_recorder.stop_recording(self.participant_num, self.test_order)
+                print("EMG recording stopped.")
+            if self.glove_recorder:
+                glovefile = f'../data/input_data/{self.test_order}/glove_data_P{self.participant_num}.csv'
+                glove.stop_cyberglove(self.glove_recorder, glovefile)
+                print("Cyberglove recording stopped.")
+        except Exception as e:
+            print(f"Error during shutdown: {str(e)}")
+
+    def run(self):
+        """
+        Runs the whole protocol and returns the list of (planned offset, actual offset, label) steps.
+        """
+        schedule = build_schedule(self.protocol)
+        print(f"Protocol with {len(schedule)} steps, duration {schedule[-1][0]:.1f} s.")
+        log = []
+        self.start_devices()
+        try:
+            session_start = time.perf_counter()
+            for offset, action_num in schedule:
+                sleep_until(session_start + offset)
+                self.set_action(action_num)
+                actual = time.perf_counter() - session_start
+                log.append((offset, actual, action_num))
+                print(f"[{actual:9.3f} s] Action label set to {action_num}.")
+        except KeyboardInterrupt:
+            print("Session manually stopped.")
+        finally:
+            self.set_action(0)
+            self.stop_devices()
+        return log
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a measurement from a protocol file without the GUI.")
+    parser.add_argument("protocol", nargs="?", default="protocol.yaml", help="Path to the protocol file.")
+    parser.add_argument("--participant", type=int, help="Participant number (overrides the protocol file).")
+    parser.add_argument("--test", type=int, help="Test number (overrides the protocol file).")
+    parser.add_argument("--config", default="config.yaml", help="Path to the sensor config file.")
+    args = parser.parse_args()
+
+    protocol = load_protocol(args.protocol)
+    participant_num = args.participant if args.participant else protocol['participant']
+    test_number = args.test if args.test else protocol['test']
+
+    session = HeadlessSession(protocol, participant_num, test_number, args.config)
+    session.run()
@@ -4,6 +4,49 @@ import numpy
 from collections import defaultdict
 import pandas as pd
 import datetime
+import os
+import time
+import threading
+import yaml
+
+
+class TrignoSensorCache(object):
+    """
+    Last known pairing, mode and serial number of every sensor, stored per TCU host,
+    and the channel layout of every sensor, stored per serial number and mode.
+
+    Parameters
+    ----------
+    cache_path : str, optional
+        YAML file the cache is loaded from and saved to. When None the cache is only kept in memory.
+    """
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+        self.entries = {}
+        self.layouts = {}
+        if self.cache_path and os.path.exists(self.cache_path):
+            with open(self.cache_path, "r") as file:
+                content = yaml.load(file, Loader=yaml.FullLoader) or {}
+            self.entries = content.get('sensors', {})
+            self.layouts = content.get('layouts', {})
+
+    def get(self, host, sensor_number):
+        return self.entries.get(host, {}).get(int(sensor_number))
+
+    def update(self, host, sensor_number, **values):
+        self.entries.setdefault(host, {}).setdefault(int(sensor_number), {}).update(values)
+
+    def get_layout(self, serial, mode):
+        return self.layouts.get(f'{serial}/{mode}')
+
+    def update_layout(self, serial, mode, layout):
+        self.layouts[f'{serial}/{mode}'] = layout
+
+    def save(self):
+        if self.cache_path:
+            with open(self.cache_path, "w") as file:
+                yaml.dump({'sensors': self.entries, 'layouts': self.layouts}, file)
+
 
 class _BaseTrignoDaq(object):
     """
@@ -64,7 +107,8 @@ class _BaseTrignoDaq(object):
         self._comm_socket = socket.create_connection(
             (self.host, self.cmd_port), 10)
         self._comm_socket.recv(1024)
-
+        # replies of pipelined commands are collected here
+        self._reply_buffer = bytes()
 
         if self.emg_data_port:
             # create the data socket
@@ -203,9 +247,8 @@ class _BaseTrignoDaq(object):
         return sensors_mask
 
     def _send_cmd(self, command, return_reply = False):
-        self._comm_socket.send(self._cmd(command))
-        raw_resp = self._comm_socket.recv(128)
-        formated_resp = self._get_reply(raw_resp)
+        # through the reply buffer, so a reply split over several packets or pipelined replies are not mixed up
+        formated_resp = self._send_cmds([command])[0]
         if('?') in command:
             print("Query: {} <->  Reply: {}".format(command, formated_resp))
         else:
@@ -213,12 +256,112 @@ class _BaseTrignoDaq(object):
         if return_reply:
             return formated_resp
 
-    def _get_reply(self, response):
-        reply = struct.unpack(str(len(response)) + 's', response)
-        reply = reply[0].decode(encoding='ascii')
-        if(self.CMD_TERM in reply):
-            reply = reply.replace(self.CMD_TERM,'')
-        return reply
+    def _send_cmds(self, commands):
+        """
+           Send several commands back-to-back and collect their replies.
+
+           Parameters
+           ----------
+           commands : list
+               Commands to send, the TCU answers them in the same order.
+
+           Returns
+           ----------
+           replies : list
+               Reply for every command.
+        """
+        if not commands:
+            return []
+        self._comm_socket.sendall(b''.join(self._cmd(command) for command in commands))
+        return self._read_replies(len(commands))
+
+    def _read_replies(self, number_of_replies):
+        """
+           Read replies from the command socket until the given number of terminated replies is buffered.
+        """
+        term = self.CMD_TERM.encode('ascii')
+        while self._reply_buffer.count(term) < number_of_replies:
+            self._reply_buffer += self._comm_socket.recv(1024)
+        replies = []
+        for _ in range(number_of_replies):
+            reply, self._reply_buffer = self._reply_buffer.split(term, 1)
+            replies.append(reply.decode(encoding='ascii').strip())
+        return replies
+
+    def configure_sensors(self, sensors_ids, mode_number, cache=None):
+        """
+           Query and configure all sensors with pipelined commands.
+
+           When the cache knows every sensor as paired and in the desired mode only the
+           serial numbers and modes are queried (one batch) and SETMODE is sent to sensors whose
+           mode changed since. Otherwise pairing, active state, mode and serial of all
+           sensors are queried in one batch and SETMODE is only sent to sensors in another mode.
+
+           Parameters
+           ----------
+           sensors_ids : tuple
+               Identifiers of used sensors.
+           mode_number : int
+               Desired mode of sensors.
+           cache : TrignoSensorCache, optional
+               Last known state of the sensors, updated with the replies.
+
+           Returns
+           ----------
+           unpaired : list
+               Identifiers of sensors that are not paired.
+        """
+        if cache is None:
+            cache = TrignoSensorCache()
+        mode = str(mode_number)
+        cached = [cache.get(self.host, sensor_id) for sensor_id in sensors_ids]
+
+        if all(entry and entry.get('paired') == 'YES' and entry.get('mode') == mode for entry in cached):
+            queries = []
+            for sensor_id in sensors_ids:
+                queries += [f'SENSOR {sensor_id} SERIAL?', f'SENSOR {sensor_id} MODE?']
+            replies = self._send_cmds(queries)
+            serials, modes = replies[0::2], replies[1::2]
+            if all(serial == entry.get('serial') for serial, entry in zip(serials, cached)):
+                # same sensors, only a mode changed outside of this program has to be set again
+                set_mode_ids = [sensor_id for sensor_id, current_mode in zip(sensors_ids, modes) if current_mode != mode]
+                if set_mode_ids:
+                    self._set_modes(set_mode_ids, mode, cache)
+                    cache.save()
+                print(f'Sensors {tuple(sensors_ids)} unchanged, mode {mode} set on {tuple(set_mode_ids)}.')
+                return []
+
+        queries = []
+        for sensor_id in sensors_ids:
+            queries += [f'SENSOR {sensor_id} PAIRED?', f'SENSOR {sensor_id} ACTIVE?',
+                        f'SENSOR {sensor_id} MODE?', f'SENSOR {sensor_id} SERIAL?']
+        replies = self._send_cmds(queries)
+
+        unpaired = []
+        set_mode_ids = []
+        for i, sensor_id in enumerate(sensors_ids):
+            paired, active, current_mode, serial = replies[4 * i:4 * i + 4]
+            cache.update(self.host, sensor_id, paired=paired, serial=serial, mode=current_mode)
+            if paired == 'NO':
+                unpaired.append(sensor_id)
+                continue
+            if active != 'YES':
+                print(f'Sensor {sensor_id} is inactive.')
+            if current_mode != mode:
+                set_mode_ids.append(sensor_id)
+
+        self._set_modes(set_mode_ids, mode, cache)
+        cache.save()
+        print(f'Sensors {tuple(sensors_ids)} configured, mode {mode} set on {tuple(set_mode_ids)}.')
+        return unpaired
+
+    def _set_modes(self, sensors_ids, mode, cache):
+        # pipelined SETMODE, the cache is updated with the sensors that accepted the mode
+        set_mode_replies = self._send_cmds([f'SENSOR {sensor_id} SETMODE {mode}' for sensor_id in sensors_ids])
+        for sensor_id, reply in zip(sensors_ids, set_mode_replies):
+            self._validate(reply)
+            if 'OK' in reply:
+                cache.update(self.host, sensor_id, mode=mode)
 
     def set_mode(self,sensor_number, mode_number):
         """
@@ -287,7 +430,8 @@ class _BaseTrignoDaq(object):
            sensor_number : int
                ID of sensor
         """
-        self._send_cmd(f'SENSOR {sensor_number} SERIAL?', return_reply=False)
+        reply = self._send_cmd(f'SENSOR {sensor_number} SERIAL?', return_reply=True)
+        return reply
 
     def what_rate(self,sensor_number, channel_number):
         """
@@ -300,7 +444,8 @@ class _BaseTrignoDaq(object):
            channel_number : int
                Number of channel
         """
-        self._send_cmd(f'SENSOR {sensor_number} CHANNEL {channel_number} RATE?', return_reply=False)
+        reply = self._send_cmd(f'SENSOR {sensor_number} CHANNEL {channel_number} RATE?', return_reply=True)
+        return reply
 
     def where_start(self,sensor_number):
         """
@@ -311,7 +456,8 @@ class _BaseTrignoDaq(object):
            sensor_number : int
                ID of sensor
         """
-        self._send_cmd(f'SENSOR {sensor_number} STARTINDEX?', return_reply=False)
+        reply = self._send_cmd(f'SENSOR {sensor_number} STARTINDEX?', return_reply=True)
+        return reply
 
     def what_aux_channel_count(self,sensor_number):
         """
@@ -322,7 +468,8 @@ class _BaseTrignoDaq(object):
            sensor_number : int
                ID of sensor
         """
-        self._send_cmd(f'SENSOR {sensor_number} AUXCHANNELCOUNT?', return_reply=False)
+        reply = self._send_cmd(f'SENSOR {sensor_number} AUXCHANNELCOUNT?', return_reply=True)
+        return reply
 
     def what_mode(self,sensor_number):
         """
@@ -362,6 +509,18 @@ class _BaseTrignoDaq(object):
         if 'OK' not in s:
             print("warning: TrignoDaq command failed: {}".format(s))
 
+# names of the AUX channels of one sensor, depending on the number of AUX channels in use
+AUX_CHANNEL_NAMES = {
+    3: [('acc', 'acc_x (g)'), ('acc', 'acc_y (g)'), ('acc', 'acc_z (g)')],
+    4: [('orientation', 're'), ('orientation', 'im_x'), ('orientation', 'im_y'), ('orientation', 'im_z')],
+    6: [('acc', 'acc_x (g)'), ('acc', 'acc_y (g)'), ('acc', 'acc_z (g)'),
+        ('gyro', 'gyr_x (deg/s)'), ('gyro', 'gyr_y (deg/s)'), ('gyro', 'gyr_z (deg/s)')],
+    9: [('acc', 'acc_x (g)'), ('acc', 'acc_y (g)'), ('acc', 'acc_z (g)'),
+        ('gyro', 'gyr_x (deg/s)'), ('gyro', 'gyr_y (deg/s)'), ('gyro', 'gyr_z (deg/s)'),
+        ('mag', 'mag_x (uT)'), ('mag', 'mag_y (uT)'), ('mag', 'mag_z (uT)')],
+}
+
+
 class TrignoEMG_Aux(_BaseTrignoDaq):
     """
     Delsys Trigno wireless EMG system orientation data.
@@ -414,6 +573,84 @@ class TrignoEMG_Aux(_BaseTrignoDaq):
             channels_per_aux_sensor = int(self.total_aux_channels / self.max_number_of_sensors) # 9 for quaternion and imu
             self.aux_channels_mask = self._channels_mask(sensors_ids, self.aux_data_channels, channels_per_aux_sensor)
 
+        # exact channel layout, filled by discover_channel_layout()
+        self.channel_layout = None
+
+    def discover_channel_layout(self, sensors_ids, sensors_labels, mode_number, cache=None):
+        """
+           Query where the channels of every sensor are in the data buffers and at which rate they are sampled.
+
+           The start index and the number of EMG and AUX channels are queried for every sensor in one
+           pipelined batch, the rates of all channels in a second one. Layouts are cached per serial
+           number and mode, so the rates are only queried for unknown sensors.
+
+           Parameters
+           ----------
+           sensors_ids : tuple
+               Identifiers of used sensors.
+           sensors_labels : tuple
+               Labels of used sensors, used for the channel names.
+           mode_number : int
+               Mode of the sensors.
+           cache : TrignoSensorCache, optional
+               Cache of the channel layouts.
+
+           Returns
+           ----------
+           channel_layout : dict
+               'emg' and 'aux' lists with one entry per real channel: column in the data buffer,
+               name, sensor label, kind and sampling rate.
+        """
+        if cache is None:
+            cache = TrignoSensorCache()
+        queries = []
+        for sensor_id in sensors_ids:
+            queries += [f'SENSOR {sensor_id} SERIAL?', f'SENSOR {sensor_id} STARTINDEX?',
+                        f'SENSOR {sensor_id} EMGCHANNELCOUNT?', f'SENSOR {sensor_id} AUXCHANNELCOUNT?']
+        replies = self._send_cmds(queries)
+
+        sensors = []
+        rate_queries = []
+        for i, sensor_id in enumerate(sensors_ids):
+            serial, start_index, emg_count, aux_count = replies[4 * i:4 * i + 4]
+            layout = cache.get_layout(serial, mode_number)
+            if layout is None:
+                layout = {'emg_count': int(emg_count), 'aux_count': int(aux_count), 'rates': None}
+                # channels are numbered from 1, EMG channels first
+                rate_queries += [f'SENSOR {sensor_id} CHANNEL {channel} RATE?'
+                                 for channel in range(1, layout['emg_count'] + layout['aux_count'] + 1)]
+            sensors.append((sensor_id, sensors_labels[i], serial, int(start_index), layout))
+
+        rates = self._send_cmds(rate_queries)
+        for sensor_id, label, serial, start_index, layout in sensors:
+            if layout['rates'] is None:
+                number_of_channels = layout['emg_count'] + layout['aux_count']
+                layout['rates'] = [float(rate) for rate in rates[:number_of_channels]]
+                rates = rates[number_of_channels:]
+                cache.update_layout(serial, mode_number, layout)
+        cache.save()
+
+        channels_per_aux_sensor = int(self.total_aux_channels / self.max_number_of_sensors)
+        channel_layout = {'emg': [], 'aux': []}
+        for sensor_id, label, serial, start_index, layout in sensors:
+            emg_count, aux_count = layout['emg_count'], layout['aux_count']
+            for channel in range(emg_count):
+                name = label if emg_count == 1 else f'{label}_emg{channel + 1}'
+                channel_layout['emg'].append({
+                    'column': start_index - 1 + channel, 'name': name, 'sensor': label,
+                    'kind': 'emg', 'rate': layout['rates'][channel]})
+            aux_names = AUX_CHANNEL_NAMES.get(aux_count, [('aux', f'aux{k + 1}') for k in range(aux_count)])
+            for channel, (kind, name) in enumerate(aux_names):
+                channel_layout['aux'].append({
+                    'column': (start_index - 1) * channels_per_aux_sensor + channel, 'name': f'{label}_{name}',
+                    'sensor': label, 'kind': kind, 'rate': layout['rates'][emg_count + channel]})
+
+        # only the real channels are read from now on
+        self.channel_layout = channel_layout
+        self.emg_channels_mask = [channel['column'] for channel in channel_layout['emg']]
+        self.aux_channels_mask = [channel['column'] for channel in channel_layout['aux']]
+        return channel_layout
+
 
     def read_time_data(self):
         """
@@ -429,12 +666,14 @@ class TrignoEMG_Aux(_BaseTrignoDaq):
 
         if self.read_emg:
             emg_data = super(TrignoEMG_Aux,self).read_all_emg()
-            #emg_data = emg_data[self.emg_channels_mask,:]
+            if self.channel_layout:
+                emg_data = emg_data[self.emg_channels_mask,:]
 
 
         if self.read_acc or self.read_gyro or self.read_orientation:
             aux_data = super(TrignoEMG_Aux,self).read_all_aux()
-            #aux_data = aux_data[self.aux_channels_mask,:]
+            if self.channel_layout:
+                aux_data = aux_data[self.aux_channels_mask,:]
 
 
         return emg_data, aux_data
@@ -444,7 +683,7 @@ class Sensor():
 
 
     """
-    def __init__(self, operation_mode, sensors_mode_number, read_emg, read_acc, read_gyro, read_orientation, sensors_ids, sensors_labels, host, cmd_port, emg_port, imu_port, timeout):
+    def __init__(self, operation_mode, sensors_mode_number, read_emg, read_acc, read_gyro, read_orientation, sensors_ids, sensors_labels, host, cmd_port, emg_port, imu_port, timeout, cache_path='trigno_sensor_cache.yaml'):
         self.operation_mode = operation_mode
         self.sensors_mode_number = sensors_mode_number
         self.sensors_ids = sensors_ids
@@ -458,6 +697,7 @@ class Sensor():
         self.read_gyro = read_gyro
         self.read_orientation = read_orientation
         self.timeout = timeout
+        self.sensor_cache = TrignoSensorCache(cache_path)
 
         self.active_sensors = defaultdict(list)
         self.add_sensors()
@@ -503,29 +743,34 @@ class Sensor():
         try:
             trigno_sensor = TrignoEMG_Aux(sensors_mode_number, read_emg, read_acc, read_gyro, read_orientation, sensors_ids, host,
                  cmd_port, emg_port, imu_port, timeout)
-            for sensor_id in self.sensors_ids:
-                reply_paired = trigno_sensor.is_paired(sensor_id)
-                if (reply_paired == 'NO'):
+            unpaired = trigno_sensor.configure_sensors(self.sensors_ids, self.sensors_mode_number, self.sensor_cache)
+            while unpaired:
+                for sensor_id in unpaired:
                     print(f'Sensor {sensor_id} is unpaired. Please pair it now...')
                     trigno_sensor.pair_sensor(sensor_id)
-                    response = input("press any key to proceed or press q to quit.")
-                    if response == 'q':
-                        return None
-                    else:
-                        self.__create_sensors()
-                else:
-                    reply_active = trigno_sensor.is_active(sensor_id)
-                    if (reply_active == 'YES'):
-                        print(f'Sensor {sensor_id} is active.')
-                    else:
-                        print(f'Sensor {sensor_id} is inactive.')
-                trigno_sensor.set_mode(sensor_id, self.sensors_mode_number)
+                response = input("press any key to proceed or press q to quit.")
+                if response == 'q':
+                    return None
+                unpaired = trigno_sensor.configure_sensors(self.sensors_ids, self.sensors_mode_number, self.sensor_cache)
+            try:
+                trigno_sensor.discover_channel_layout(self.sensors_ids, self.sensors_labels, self.sensors_mode_number, self.sensor_cache)
+            except Exception as e:
+                print(f'Channel layout discovery failed ({e}). All channels are recorded.')
             return trigno_sensor
         except:
             print(f'Connection problem or unrecognized sensor mode {self.sensors_mode_number}.')
             return None
 
 
+    def get_channel_layout(self):
+        """
+        Channel layout of the first sensor group or None if it could not be discovered.
+        """
+        try:
+            return list(self.active_sensors.values())[0][0].channel_layout
+        except IndexError:
+            return None
+
     def start_acquisition(self):
         """
         Start data acquisition from all sensors.
@@ -558,14 +803,80 @@ class Sensor():
             print("sensordata not working")
 
 
+class SensorGroupReader(threading.Thread):
+    """
+    Reads one sensor group (a Sensor, e.g. the sensors of one Trigno base) in its own thread.
 
+    Every poll is stored together with the time it was received, so the data of several
+    groups and bases can be merged on the common session clock afterwards.
 
+    Parameters
+    ----------
+    sensor : Sensor
+        Sensor group to read.
+    name : str, optional
+        Name of the group, used for the thread name.
+    """
+    def __init__(self, sensor, name=None):
+        super(SensorGroupReader, self).__init__(name=name, daemon=True)
+        self.sensor = sensor
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.emg_chunks = []  # (receive time, data with shape (channels, samples))
+        self.aux_chunks = []
+
+    def run(self):
+        self.sensor.start_acquisition()
+        while not self.stop_event.is_set():
+            receive_time = time.time()
+            data = self.sensor.get_sensor_data()
+            if data is None:
+                continue
+            emg_data, aux_data = data
+            with self.lock:
+                if emg_data.size > 0:
+                    self.emg_chunks.append((receive_time, emg_data))
+                if aux_data.size > 0:
+                    self.aux_chunks.append((receive_time, aux_data))
+            if emg_data.size == 0 and aux_data.size == 0:
+                # give the other readers the interpreter while the buffer fills up
+                time.sleep(0.001)
+        self.sensor.stop_acquisition()
+
+    def stop(self, timeout=2):
+        """
+        Stops reading and waits for the thread to finish.
+        """
+        self.stop_event.set()
+        self.join(timeout)
+
+    def take_chunks(self):
+        """
+        Returns all chunks read so far and starts new lists.
+        """
+        with self.lock:
+            emg_chunks, self.emg_chunks = self.emg_chunks, []
+            aux_chunks, self.aux_chunks = self.aux_chunks, []
+        return emg_chunks, aux_chunks
+
+
+def spread_sample_times(receive_times, counts, rate):
+    """
+    Session time of every sample, assuming the last sample of a poll arrived at its receive time
+    and the samples before it are 1/rate apart.
 
-
-
-
-
-
-
-
+    Parameters
+    ----------
+    receive_times : array
+        Receive time of every poll.
+    counts : array
+        Number of samples of every poll.
+    rate : float
+        Sampling rate of the channels.
+    """
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+    ends = numpy.cumsum(counts)
+    position = numpy.arange(ends[-1] if len(ends) else 0) - numpy.repeat(ends - counts, counts)
+    return numpy.repeat(numpy.asarray(receive_times, dtype=numpy.float64), counts) \
+        - (numpy.repeat(counts, counts) - 1 - position) / rate
 
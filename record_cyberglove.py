@@ -8,6 +8,8 @@ import os
 
 
 glove_error_event = threading.Event()
+glove_ready_event = threading.Event()  # set as soon as the first sample was read
+session_start_time = None  # common start instant (time.time()), samples before it are dropped, inf: not started yet
 
 
 is_recording = False  # Flag indicating if recording is active
@@ -63,6 +65,7 @@ def record_cyberglove(cg):
     global is_recording, raw_data_list
     is_recording = True  # Set recording flag to True
     raw_data_list = []  # Clear any old data
+    glove_ready_event.clear()
     interval = 1 / 150  # Sampling interval for CyberGlove (150 Hz)
 
     try:
@@ -71,7 +74,11 @@ def record_cyberglove(cg):
             raw_data = cg.read()  # Read sensor data from CyberGlove
             timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]  # Timestamp with millisecond precision
             data_row = [timestamp] + raw_data.reshape(-1,).tolist()  # Append timestamp to data row
-            raw_data_list.append(data_row)  # Store data row in list
+            glove_ready_event.set()
+
+            # Warm-up samples before the common start instant are not recorded
+            if session_start_time is None or start_cycle >= session_start_time:
+                raw_data_list.append(data_row)  # Store data row in list
             
             # Monitor the sensor values for changes
             monitor_sensor_values(raw_data)
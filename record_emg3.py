@@ -1,11 +1,16 @@
 import yaml  
+import numpy as np  
 import pandas as pd  
 import threading  
 import time  
 from datetime import datetime  
-from pytrignos import Sensor  
+from pytrignos import Sensor, SensorGroupReader, spread_sample_times  
 import os  
 
+# Default Trigno sampling rates, used if the channel layout could not be discovered
+DEFAULT_EMG_RATE = 1925.925
+DEFAULT_AUX_RATE = 148.148
+
 emg_error_event = threading.Event()
 
 
@@ -19,12 +24,27 @@ class EMGRecorder:
         self.config_path = config_path
         self.load_config()  # Load settings from YAML
         self.sensor = self.initialize_sensor()  # Set up sensor based on config
+        # Columns are named by their position in the Trigno data buffer, only real channels are kept
+        self.channel_layout = self.sensor.get_channel_layout()
+        if self.channel_layout:
+            self.emg_columns = [channel['column'] for channel in self.channel_layout['emg']]
+            self.aux_columns = [channel['column'] for channel in self.channel_layout['aux']]
+        else:
+            self.emg_columns = None
+            self.aux_columns = None
+        # Additional sensor groups / Trigno bases, each one is read by its own thread
+        self.group_sensors = [self.initialize_sensor(group) for group in self.groups]
+        self.group_readers = []
+        self.emg_receive_times = []  # (receive time, number of samples) of every EMG poll of the main group
+        self.aux_receive_times = []  # (receive time, number of samples) of every AUX poll of the main group
         self.old_time=0
         self.emg_data = []  # List to store EMG data frames
         self.aux_data = []  # List to store auxiliary data frames
         self.participant_num = 1  # Default participant ID
         self.action_label = 1  # Default action label
         self.stop_event = threading.Event()  # Event to signal thread stop
+        self.ready_event = threading.Event()  # Set as soon as the first EMG sample arrived
+        self.session_start_time = None  # Common start instant (time.time()), data before it is dropped, inf: not started yet
         self.lock = threading.Lock()  # Lock for thread-safe access to shared data
         # Sensor value tracking
         self.emg_last_values = {}  # Track last values of each EMG sensor
@@ -34,6 +54,7 @@ class EMGRecorder:
         self.stale_duration = 5  # Time in seconds for which a value must remain the same to trigger a warning
         self.emg_last_log_time = {}  # Track last log time for EMG sensors
         self.aux_last_log_time = {}  # Track last log time for auxiliary sensors
+        self.listeners = []  # Callbacks that get every poll live, e.g. the online classification
 
     def load_config(self):
         """
@@ -47,6 +68,8 @@ class EMGRecorder:
         self.input_data_path = self.config['input_data_path']
         self.output_data_path = self.config['output_data_path']
         self.processing_data_path = self.config['processing_data_path']
+        # Sensor groups besides the main one (other sockets or other TCU hosts)
+        self.groups = self.config.get('sensor_groups') or []
     def determine_aux_sensor_ids(self):
         """
         Generates auxiliary sensor IDs based on config options for orientation, accelerometer, and gyroscope data.
@@ -65,15 +88,17 @@ class EMGRecorder:
                     aux_sensor_ids += [f"{label}_gyr_x (deg/s)", f"{label}_gyr_y (deg/s)", f"{label}_gyr_z (deg/s)"]
         return aux_sensor_ids
 
-    def initialize_sensor(self):
+    def initialize_sensor(self, group=None):
         """
         Initializes the Sensor instance with parameters from the configuration.
+        Settings of a sensor group override the ones of the main configuration.
         """
+        config = dict(self.config, **(group or {}))
         return Sensor(
-            self.config['aquisition_mode'], self.config['sensors_mode_number'], self.config['read_emg'],
-            self.config['read_acc'], self.config['read_gyro'], self.config['read_orientation'],
-            self.config['sensor_ids'], self.config['sensors_labels'], self.config['host'],
-            self.config['cmd_port'], self.config['emg_port'], self.config['aux_port'], self.config['timeout']
+            config['aquisition_mode'], config['sensors_mode_number'], config['read_emg'],
+            config['read_acc'], config['read_gyro'], config['read_orientation'],
+            tuple(config['sensor_ids']), tuple(config['sensors_labels']), config['host'],
+            config['cmd_port'], config['emg_port'], config['aux_port'], config['timeout']
         )
 
     def start_recording(self):
@@ -83,6 +108,12 @@ class EMGRecorder:
         self.emg_data = []  # Clear existing EMG data
         self.aux_data = []  # Clear existing auxiliary data
         self.stop_event.clear()  # Reset stop flag
+        self.ready_event.clear()  # Wait again for the first sample
+        self.emg_receive_times = []
+        self.aux_receive_times = []
+        self.group_readers = [SensorGroupReader(sensor, name=f"group{i + 1}") for i, sensor in enumerate(self.group_sensors)]
+        for reader in self.group_readers:
+            reader.start()
         threading.Thread(target=self.record_data).start()  # Start data recording thread
 
 
@@ -104,25 +135,39 @@ class EMGRecorder:
                 timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]  # Timestamp with millisecond precision
                 action_label = self.action_label
 
+            # Warm-up data before the common start instant is not recorded
+            if self.session_start_time is not None and current_time < self.session_start_time:
+                if emg_data.size > 0:
+                    self.ready_event.set()
+                    last_data_time = current_time
+                continue
+
             # Check if EMG data is valid
             if emg_data.size > 0:
-                emg_df = pd.DataFrame(data=emg_data.transpose())  # Create DataFrame for EMG 
+                self.ready_event.set()
+                emg_df = pd.DataFrame(data=emg_data.transpose(), columns=self.emg_columns)  # Create DataFrame for EMG 
                 emg_df.insert(0, 'Timestamp', timestamp)  # Add Timestamp column
                 emg_df['Action_Label'] = action_label  # Add action label column
                 with self.lock:  
                     self.emg_data.append(emg_df)
+                    self.emg_receive_times.append((current_time, len(emg_df)))
                 last_data_time = current_time  # Update last data time
                 emg_error_event.clear()
 
             # Check if auxiliary data is valid
             if aux_data.size > 0:
-                aux_df = pd.DataFrame(data=aux_data.transpose())  # Create DataFrame for auxiliary data
+                aux_df = pd.DataFrame(data=aux_data.transpose(), columns=self.aux_columns)  # Create DataFrame for auxiliary data
                 aux_df.insert(0, 'Timestamp', timestamp)  # Add Timestamp column
                 with self.lock:  
                     self.aux_data.append(aux_df)
+                    self.aux_receive_times.append((current_time, len(aux_df)))
                 last_data_time = current_time  # Update last data time
                 
 
+            if self.listeners and (emg_data.size > 0 or aux_data.size > 0):
+                for listener in self.listeners:
+                    listener(emg_data, aux_data, current_time)
+
             # Check if no data has been received in the last 5 seconds
             if current_time - last_data_time >= 1:
 
@@ -134,6 +179,14 @@ class EMGRecorder:
 
 
             
+    def add_listener(self, callback):
+        """
+        Registers callback(emg_data, aux_data, receive_time) that is called with every poll of the
+        main group (arrays of shape (channels, samples), possibly empty). It runs in the recording
+        thread, so it must return quickly.
+        """
+        self.listeners.append(callback)
+
     def update_participant_action(self, pn, al):
         """
         Updates participant number and action label for the current recording.
@@ -148,6 +201,8 @@ class EMGRecorder:
         Stops data recording and saves the collected data to CSV files.
         """ 
         self.stop_event.set()  # Signal to stop recording
+        for reader in self.group_readers:
+            reader.stop()
         with self.lock:
 
             if self.emg_data or self.aux_data:  # Save data if any is recorded
@@ -168,6 +223,11 @@ class EMGRecorder:
         emg_df = pd.concat(self.emg_data, ignore_index=True) if self.emg_data else pd.DataFrame()
         aux_df = pd.concat(self.aux_data, ignore_index=True) if self.aux_data else pd.DataFrame()
 
+        # Merge the other sensor groups onto the samples of the main group
+        channel_layout = self.channel_layout
+        if self.group_readers:
+            emg_df, aux_df, channel_layout = self.merge_sensor_groups(emg_df, aux_df)
+
         # Define file paths based on participant and test number
         base_path = f'{self.input_data_path}/{test_number}'  # Path for input data
         output_path = f'{self.processing_data_path}/{test_number}'  # Path for processed data
@@ -178,6 +238,13 @@ class EMGRecorder:
         os.makedirs(output_path, exist_ok=True)
         os.makedirs(final_data, exist_ok=True)
 
+        # Save the channel layout next to the data, so the integration knows which column is which channel
+        if channel_layout:
+            channel_map_file = f'{base_path}/channel_map_P{participant_num}.yaml'
+            with open(channel_map_file, "w") as file:
+                yaml.dump(channel_layout, file, sort_keys=False)
+            print(f"Channel map saved to {channel_map_file}.")
+
         # Save EMG data to CSV (append mode)
         if not emg_df.empty:
             emg_file = f'{base_path}/emg_data_P{participant_num}.csv'
@@ -209,3 +276,63 @@ class EMGRecorder:
                 print(f"Auxiliary data saved to {aux_file}.")
         else:
             print("No auxiliary data recorded.")
+
+    def merge_sensor_groups(self, emg_df, aux_df):
+        """
+        Merges the data of all sensor groups onto the samples of the main group.
+
+        Every sample gets a time on the session clock (receive time of its poll, earlier samples
+        of the poll spaced by the sampling rate). The samples of the other groups are matched to
+        the nearest sample of the main group. Columns of group k are shifted by k times the number
+        of channels of a Trigno base, so they stay unique in the files and the channel map.
+        """
+        channel_layout = {'emg': [], 'aux': []}
+        if self.channel_layout:
+            channel_layout['emg'] += [dict(channel, group=0) for channel in self.channel_layout['emg']]
+            channel_layout['aux'] += [dict(channel, group=0) for channel in self.channel_layout['aux']]
+
+        for kind, df, receive_times in (('emg', emg_df, self.emg_receive_times), ('aux', aux_df, self.aux_receive_times)):
+            if df.empty:
+                continue
+            layout = self.channel_layout[kind] if self.channel_layout else None
+            rate = layout[0]['rate'] if layout else (DEFAULT_EMG_RATE if kind == 'emg' else DEFAULT_AUX_RATE)
+            times, counts = zip(*receive_times)
+            df['_session_time'] = spread_sample_times(times, counts, rate)
+        merged = {'emg': emg_df, 'aux': aux_df}
+
+        for group_number, reader in enumerate(self.group_readers, start=1):
+            group_chunks = reader.take_chunks()
+            group_layout = reader.sensor.get_channel_layout()
+            for kind, chunks in zip(('emg', 'aux'), group_chunks):
+                if self.session_start_time is not None:
+                    chunks = [chunk for chunk in chunks if chunk[0] >= self.session_start_time]
+                if not chunks or merged[kind].empty:
+                    continue
+                offset = group_number * (self.config['total_EMG_channels'] if kind == 'emg' else self.config['total_AUX_channels'])
+                layout = group_layout[kind] if group_layout else None
+                rate = layout[0]['rate'] if layout else (DEFAULT_EMG_RATE if kind == 'emg' else DEFAULT_AUX_RATE)
+
+                data = np.hstack([chunk[1] for chunk in chunks]).transpose()
+                columns = [channel['column'] for channel in layout] if layout else list(range(data.shape[1]))
+                group_df = pd.DataFrame(data=data, columns=[column + offset for column in columns])
+                group_df['_session_time'] = spread_sample_times([chunk[0] for chunk in chunks], [chunk[1].shape[1] for chunk in chunks], rate)
+                if layout:
+                    channel_layout[kind] += [dict(channel, column=channel['column'] + offset, group=group_number) for channel in layout]
+
+                main_df = merged[kind].reset_index().sort_values('_session_time', kind='stable')
+                main_df = pd.merge_asof(main_df, group_df.sort_values('_session_time', kind='stable'),
+                                        on='_session_time', direction='nearest', tolerance=2 / rate)
+                merged[kind] = main_df.sort_values('index').set_index('index').rename_axis(None)
+                print(f"Sensor group {group_number}: {len(group_df)} {kind.upper()} samples merged.")
+
+        # Label column stays the last one
+        for kind in ('emg', 'aux'):
+            df = merged[kind].drop(columns=['_session_time'], errors='ignore')
+            if 'Action_Label' in df.columns:
+                df = df[[column for column in df.columns if column != 'Action_Label'] + ['Action_Label']]
+            merged[kind] = df
+
+        if not self.channel_layout:
+            channel_layout = None
+        return merged['emg'], merged['aux'], channel_layout
+
@@ -9,6 +9,8 @@ from datetime import datetime
 # Serielle Verbindung konfigurieren
 
 fmg_error_event = threading.Event()
+fmg_ready_event = threading.Event()  # set as soon as the first valid frame arrived
+session_start_time = None  # common start instant (time.time()), frames before it are dropped, inf: not started yet
 stop_fmg=0
 serial_port = 'COM13'  # Passe dies an deinen Port an (z. B. 'COM3' unter Windows)
 baud_rate = 115200  # Baudrate, passend zum Arduino
@@ -28,6 +30,7 @@ debug_mode=0 # liveprints all fmg sensors that change from 3.29 V (O)
 
 def read_serial():
     global is_recording, stop_fmg
+    fmg_ready_event.clear()
     try:
         ser = serial.Serial(serial_port, baud_rate, timeout=1)
         print(f"Verbindung zu {serial_port} hergestellt.")
@@ -53,8 +56,10 @@ def read_serial():
                     end_delim = ser.read(1)
                     if end_delim == b'\x00':
                         data_with_timestamp = sensor_data + [timestamp] + [timestamp_win]
+                        fmg_ready_event.set()
 
-                        if is_recording:
+                        # warm-up frames before the common start instant are not recorded
+                        if is_recording and (session_start_time is None or time.time() >= session_start_time):
                             message_queue.put_nowait(data_with_timestamp)
                             fmg_error_event.clear()  # Fehlerstatus zurücksetzen
                         